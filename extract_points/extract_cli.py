@@ -0,0 +1,367 @@
+"""
+command line runner of extraction jobs described in a manifest
+
+Instead of editing the paths, dynamic_task and extracting_state of
+extractor.py for every region, jobs are described in a YAML or JSON manifest:
+
+    defaults:
+      workers: 8
+      sources: [landsat]             # landsat, sentinel, modis, precip
+      out_path: data2/{region}/extract        # relative to home
+      checkpoint_path: data2/{region}/intermediate_save
+      catalogs:
+        landsat: data2/citrus/citrus_PR/landsat/hnsc_l8_sr_list.json
+        sentinel: data_pool/U-TMP/China_2018_Sentinel_sr_part.json
+        modis: {MOD_Path: tq-data04/modis/MOD11A1.006,
+                MYD_Path: tq-data04/modis/MYD11A1.006}
+    jobs:
+      - region: hunan
+        samples: data2/citrus/hunan_data/hunan_process/2018_*_sample_points_c.npz
+        dates: [[20180101, 20181231]]
+        sources: [landsat, sentinel]
+
+Every job entry is expanded into one job per sample file (a glob) and date
+range. Year and crop type come from the sample file name, YEAR_CROP_..., and
+{region}, {year}, {crop}, {start}, {end} may be used in the paths, an entry
+with several date ranges gets a {start}_{end} sub folder if out_path has none.
+One source with a scene catalog is streamed to the chunk files, several
+sources run as a pipeline and are joined, see Extractor.run_pipeline().
+
+    python extract_cli.py run jobs.yaml [--parallel 2]
+    python extract_cli.py shard jobs.yaml /shared/queue
+    python extract_cli.py work /shared/queue [--parallel 2]
+
+run: runs the jobs on this machine, --parallel jobs at a time, the workers of
+every job are its own pool.
+shard: writes every job to queue/pending/<job>.json.
+work: takes jobs from the queue until it is empty, a job is claimed by moving
+its file to running/, so nodes sharing the folder never run a job twice, and
+it ends up in done/ or failed/.
+"""
+import os
+import sys
+import glob
+import json
+import socket
+import argparse
+import multiprocessing
+import time
+from extractor import Extractor, IO_SOURCES
+from extractor_functions.result_writer import ChunkWriter
+from extractor_functions.checkpoint import CheckpointStore
+
+SOURCES = ["landsat", "sentinel", "modis", "precip"]
+QUEUE_FOLDERS = ["pending", "running", "done", "failed"]
+
+
+def home_path(path):
+    """
+    function to get a path relative to home, absolute paths are kept
+    """
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.expanduser("~"), os.path.normpath(path))
+
+
+def load_manifest(manifest_file):
+    """
+    function to read a YAML or JSON job manifest,
+    yaml is only needed for .yml and .yaml files
+    out: {"defaults": {...}, "jobs": [...]}
+    """
+    if manifest_file.endswith(".json"):
+        with open(manifest_file) as fid:
+            manifest = json.load(fid)
+    elif manifest_file.endswith((".yml", ".yaml")):
+        import yaml
+
+        with open(manifest_file) as fid:
+            manifest = yaml.safe_load(fid)
+    else:
+        raise ValueError("Manifest %s is not .json, .yml or .yaml" % manifest_file)
+    if not manifest or "jobs" not in manifest:
+        raise ValueError("No jobs in manifest %s" % manifest_file)
+    manifest.setdefault("defaults", {})
+    return manifest
+
+
+def expand_jobs(manifest):
+    """
+    function to expand manifest entries into single jobs,
+    one per sample file and date range
+    out: list of job dicts with
+         name, samples, year, crop, region, start, end, sources, workers,
+         out_path, checkpoint_path, catalogs
+    """
+    jobs = []
+    for entry in manifest["jobs"]:
+        entry = dict(manifest["defaults"], **entry)
+        unknown = set(entry.get("sources", [])) - set(SOURCES)
+        if len(unknown) != 0:
+            raise ValueError("Unknown sources %s" % sorted(unknown))
+        region = str(entry.get("region", "default"))
+        sample_files = sorted(glob.glob(home_path(entry["samples"])))
+        if len(sample_files) == 0:
+            print("No sample file for %s, pass" % entry["samples"])
+        for sample_file in sample_files:
+            basename = os.path.basename(sample_file)
+            year, crop = basename.split("_")[0], basename.split("_")[1]
+            for start, end in entry["dates"]:
+                start, end = str(start), str(end)
+                layout = {
+                    "region": region,
+                    "year": year,
+                    "crop": crop,
+                    "start": start,
+                    "end": end,
+                }
+                out_path = entry["out_path"]
+                if len(entry["dates"]) > 1 and "{start}" not in out_path:
+                    # chunk files of date ranges must not overwrite each other
+                    out_path = out_path + "/{start}_{end}"
+                jobs.append(
+                    {
+                        "name": "_".join(
+                            [region, basename.split(".")[0], start, end]
+                        ),
+                        "samples": sample_file,
+                        "year": year,
+                        "crop": crop,
+                        "region": region,
+                        "start": start,
+                        "end": end,
+                        "sources": list(entry.get("sources", ["landsat"])),
+                        "workers": int(
+                            entry.get("workers", multiprocessing.cpu_count() - 1)
+                        ),
+                        "out_path": out_path.format(**layout),
+                        "checkpoint_path": entry.get(
+                            "checkpoint_path", out_path + "/intermediate_save"
+                        ).format(**layout),
+                        "catalogs": entry.get("catalogs", {}),
+                    }
+                )
+    return jobs
+
+
+def run_job(job):
+    """
+    function to run one extraction job
+    """
+    print("Starting job %s" % job["name"])
+    tic = time.time()
+    sources = list(job["sources"])
+    if "sentinel" in sources and int(job["year"]) < 2016:
+        print("Year %s has no sentinel data, pass" % job["year"])
+        sources.remove("sentinel")
+
+    e = Extractor(worker_num=job["workers"])
+    writer = ChunkWriter(home_path(job["out_path"]), job["year"], job["crop"])
+    # results of a checkpoint are those of its date range
+    sample_name = os.path.basename(job["samples"]).split(".")[0]
+    checkpoint = CheckpointStore(
+        os.path.join(
+            home_path(job["checkpoint_path"]),
+            "_".join([sample_name, job["start"], job["end"], "checkpoint"]),
+        )
+    )
+    point_dict = e.get_latlon(job["samples"])
+    file_lists = {}
+    for sensor in sources:
+        if sensor in IO_SOURCES:
+            file_lists[sensor] = e.get_catalog(
+                home_path(job["catalogs"][sensor]), sensor
+            )
+        elif sensor == "modis":
+            file_lists[sensor] = job["catalogs"][sensor]
+
+    try:
+        if len(sources) == 1 and sources[0] in IO_SOURCES:
+            # one scene source, finished points are streamed to the chunk files
+            run = e.run_landsat if sources[0] == "landsat" else e.run_sentinel
+            run(
+                point_dict,
+                job["start"],
+                job["end"],
+                file_lists[sources[0]],
+                writer=writer,
+                checkpoint=checkpoint,
+            )
+        else:
+            e.run_pipeline(
+                point_dict,
+                job["start"],
+                job["end"],
+                file_lists,
+                writer,
+                sources=sources,
+                checkpoint=checkpoint,
+            )
+    finally:
+        checkpoint.close()
+    print("Extracting time {}".format(time.time() - tic))
+    print(
+        "Job %s: %d points saved to %d files"
+        % (job["name"], writer.n_points, writer.n_files)
+    )
+
+
+def run_jobs(jobs, parallel=1):
+    """
+    function to run jobs on this machine, parallel jobs at a time,
+    every job runs in its own process so it can start its own pool
+    out: names of failed jobs
+    """
+    if parallel <= 1:
+        failed = []
+        for job in jobs:
+            try:
+                run_job(job)
+            except Exception as e:
+                print("Job %s failed: %s" % (job["name"], e))
+                failed.append(job["name"])
+        return failed
+
+    running = []
+    failed = []
+    jobs = list(jobs)
+    while len(jobs) != 0 or len(running) != 0:
+        while len(jobs) != 0 and len(running) < parallel:
+            job = jobs.pop(0)
+            process = multiprocessing.Process(target=run_job, args=(job,))
+            process.start()
+            running.append((job, process))
+        time.sleep(1)
+        for job, process in list(running):
+            if not process.is_alive():
+                process.join()
+                running.remove((job, process))
+                if process.exitcode != 0:
+                    failed.append(job["name"])
+    return failed
+
+
+def write_shards(jobs, queue_path):
+    """
+    function to write every job to the pending folder of a shared queue
+    """
+    for folder in QUEUE_FOLDERS:
+        if not os.path.exists(os.path.join(queue_path, folder)):
+            os.makedirs(os.path.join(queue_path, folder))
+    for job in jobs:
+        shard = os.path.join(queue_path, "pending", job["name"] + ".json")
+        with open(shard + ".tmp", "w") as fid:
+            json.dump(job, fid, indent=2)
+        # a shard only shows up once it is complete
+        os.replace(shard + ".tmp", shard)
+    print("%d shards written to %s" % (len(jobs), queue_path))
+
+
+def claim_shard(queue_path):
+    """
+    function to take the next pending job of a shared queue
+    out: (path of the claimed shard, job), None if the queue is empty
+    """
+    pending = os.path.join(queue_path, "pending")
+    owner = "%s-%d" % (socket.gethostname(), os.getpid())
+    for name in sorted(os.listdir(pending)):
+        if not name.endswith(".json"):
+            continue
+        claimed = os.path.join(queue_path, "running", owner + "." + name)
+        try:
+            # rename is atomic, only one node gets the shard
+            os.rename(os.path.join(pending, name), claimed)
+        except OSError:
+            continue
+        with open(claimed) as fid:
+            return claimed, json.load(fid)
+    return None
+
+
+def work_queue(queue_path):
+    """
+    function to run pending jobs of a shared queue until it is empty
+    out: names of failed jobs
+    """
+    failed = []
+    while True:
+        claimed = claim_shard(queue_path)
+        if claimed is None:
+            return failed
+        shard, job = claimed
+        try:
+            run_job(job)
+            state = "done"
+        except Exception as e:
+            print("Job %s failed: %s" % (job["name"], e))
+            failed.append(job["name"])
+            state = "failed"
+        os.replace(shard, os.path.join(queue_path, state, job["name"] + ".json"))
+
+
+def work_process(queue_path):
+    """
+    function to run work_queue() in a worker process,
+    the exit code is the number of failed jobs, at most 255
+    """
+    sys.exit(min(len(work_queue(queue_path)), 255))
+
+
+def work_jobs(queue_path, parallel=1):
+    """
+    function to work on a shared queue, parallel workers at a time,
+    see run_jobs()
+    out: names of failed jobs, or of crashed workers
+    """
+    if parallel <= 1:
+        return work_queue(queue_path)
+
+    workers = [
+        multiprocessing.Process(target=work_process, args=(queue_path,))
+        for _ in range(parallel)
+    ]
+    for worker in workers:
+        worker.start()
+    failed = []
+    for worker in workers:
+        worker.join()
+        if worker.exitcode > 0:
+            failed.append("%s, %d failed jobs" % (worker.name, worker.exitcode))
+        elif worker.exitcode != 0:
+            failed.append("%s crashed" % worker.name)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run extraction jobs of a manifest")
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="run jobs on this machine")
+    run_parser.add_argument("manifest", help="YAML or JSON job manifest")
+    run_parser.add_argument("--parallel", type=int, default=1, help="jobs at a time")
+    shard_parser = commands.add_parser("shard", help="write jobs to a shared queue")
+    shard_parser.add_argument("manifest", help="YAML or JSON job manifest")
+    shard_parser.add_argument("queue", help="shared queue folder")
+    work_parser = commands.add_parser("work", help="run jobs of a shared queue")
+    work_parser.add_argument("queue", help="shared queue folder")
+    work_parser.add_argument("--parallel", type=int, default=1, help="jobs at a time")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        failed = run_jobs(expand_jobs(load_manifest(args.manifest)), args.parallel)
+    elif args.command == "shard":
+        write_shards(expand_jobs(load_manifest(args.manifest)), args.queue)
+        failed = []
+    elif args.command == "work":
+        failed = work_jobs(args.queue, args.parallel)
+    else:
+        parser.print_help()
+        return 2
+    if len(failed) != 0:
+        print("Failed: %s" % failed)
+        return 1
+    print("HERO: all done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
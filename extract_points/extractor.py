@@ -8,9 +8,11 @@ The Extractor class extracts pixel level timeseries, including
 extracting_state: 
     1: landsat
     2: sentinel
+    3: all sources at the same time, joined on point ids, see run_pipeline()
 
 INPUT: sampled points from sampler. e.g.
-    {"landsat":{"tile1":[(lat1,lon1),(lat2,lon2),...]}
+    {"points": {"ids": ..., "lat": ..., "lon": ...}, table of the points,
+     "landsat":{"tile1":[(lat1,lon1),(lat2,lon2),...]}
                {"tile2":[(lat1,lon1),(lat2,lon2),...]}
       "sentinel":{"tile1":[(lat1,lon1),(lat2,lon2),...]}
                  {"tile2":[(lat1,lon1),(lat2,lon2),...]}
@@ -22,8 +24,9 @@ INPUT: sampled points from sampler. e.g.
        sentinel tiles data
        TRMM, GPM data
        MODIS tiles data
-OUTPUT: list of following format, first element
-        ["lat1,lon1",
+OUTPUT: list of following format, first element is the point id,
+        see extractor_functions/point_registry.py
+        [id1,
          {"S_R_band":[(time1,value1),(time2,value2),...],
          "S_G_band":...
          "S_B_band":...
@@ -40,7 +43,7 @@ OUTPUT: list of following format, first element
          "GPM_TRMM":[(time1,value1),(time2,value2),...]
          }
 
-         ["lat2,lon2",
+         [id2,
          {
           }]
         ]
@@ -53,21 +56,46 @@ import os
 import numpy
 import json
 import signal
+import collections
 import functools
 import multiprocessing
 from extractor_functions.landsat_extractor import extract_landsat_SR
 from extractor_functions.sentinel_extractor import extract_sentinel_SR
 from extractor_functions.precip_extractor import extract_TRMM_GPM
-from extractor_functions.MODIS_extractor import extract_MODIS_LST
+from extractor_functions.MODIS_extractor import extract_MODIS_LST, refresh_catalog
+from extractor_functions.scene_catalog import open_catalog
+from extractor_functions.result_store import ResultStore
+from extractor_functions.result_writer import ChunkWriter
+from extractor_functions.geo_functions import get_latlon_key_vector
+from extractor_functions import point_registry
+from extractor_functions import scheduler
+from extractor_functions.checkpoint import CheckpointStore
+from extractor_functions.shared_transport import SharedPoints
+from extractor_functions.ensemble import Ensemble
 import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+# sources of the pipeline, see Extractor.iter_pipeline()
+# landsat and sentinel wait on their storage volumes and run in threads,
+# MODIS and precipitation decode files and run in processes
+IO_SOURCES = ["landsat", "sentinel"]
+CPU_SOURCES = ["modis", "precip"]
+SCENE_EXTRACTORS = {"landsat": extract_landsat_SR, "sentinel": extract_sentinel_SR}
+
+# I/O threads per worker of the budget not given to CPU sources
+IO_THREADS_PER_WORKER = 2
+# threads a scene task of the pipeline reads its files with, the budget's I/O
+# threads are shared out to tasks in groups of this size
+IO_THREADS_PER_TASK = 2
 
 
 class Extractor(object):
-    def __init__(self):
+    def __init__(self, worker_num=5):
         """
           initialize class
+          worker_num: number of processes of the extracting pool
           """
-        pass
+        self.worker_num = worker_num
 
     def get_jsonlist(self, input_file):
         """
@@ -77,9 +105,21 @@ class Extractor(object):
         lists = json.load(fid)
         return lists
 
+    def get_catalog(self, input_file, sensor):
+        """
+          function to get the scene catalog file of a json list,
+          the catalog is built once and reused until the json changes
+          """
+        catalog = open_catalog(input_file, sensor)
+        catalog.close()
+        return catalog.db_path
+
     def get_latlon(self, input_file):
         """
-          function to get grouped points
+          function to get grouped points,
+          the point table of the file becomes the registry of this process
+          and of the workers started after, files without a table get
+          ids in the order of their points
           """
         tmp = numpy.load(input_file)
         tmp = tmp["arr_0"]
@@ -88,6 +128,21 @@ class Extractor(object):
         latlon_array_dict = tmp
         del tmp
 
+        table = latlon_array_dict.pop("points", None)
+        if table is not None:
+            registry = point_registry.PointRegistry(**table)
+        else:
+            registry = point_registry.PointRegistry()
+            registry.register(
+                [
+                    pt
+                    for tile_dict in latlon_array_dict.values()
+                    for points in tile_dict.values()
+                    for pt in points
+                ]
+            )
+        point_registry.set_registry(registry)
+
         return latlon_array_dict
 
     def parallel_initializer(self):
@@ -96,78 +151,228 @@ class Extractor(object):
         """
         signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    def run_parallel(self, run_function, tasks):
+    def iter_parallel(self, run_function, tasks):
         """
-          function to run parallel
+          function to run parallel, returned results are yielded in the
+          order tasks finish
+          tasks are put on a work queue and handed to the next idle worker,
+          a dict of tiles is run as one task per tile,
+          Control+C stops the workers and is raised again
           """
-        # convert to a list of dict
-        tasks = [{key: val} for key, val in tasks.items()]
+        if isinstance(tasks, dict):
+            # convert to a list of dict
+            tasks = [{key: val} for key, val in tasks.items()]
 
-        # worker_num = multiprocessing.cpu_count() - 1
-        worker_num = 5
-        pool = multiprocessing.Pool(worker_num, self.parallel_initializer)
+        pool = multiprocessing.Pool(self.worker_num, self.parallel_initializer)
         try:
-            returned = pool.map_async(run_function, tasks)
+            for returned in pool.imap_unordered(run_function, tasks):
+                yield returned
             pool.close()
-            pool.join()
         except KeyboardInterrupt:
             print("Received Control+C from Keyboard, EXITING........")
+            # the caller must not take the partial results as complete
+            raise
+        finally:
+            # also when the caller stops iterating, workers are not left running
             pool.terminate()
             pool.join()
-        if returned is not None:
-            out = returned.get()  # a list of dict
+
+    def run_parallel(self, run_function, tasks):
+        """
+          function to run parallel, see iter_parallel()
+          """
+        return list(self.iter_parallel(run_function, tasks))
+
+    def iter_tasks(self, run_function, tasks, sensor=None, checkpoint=None):
+        """
+          function to run (tile, scenes) tasks in parallel,
+          yields (task number, result) in the order tasks finish,
+          finished tasks are recorded in the checkpoint
+          """
+        # points and results cross to and from workers in shared memory
+        shared = SharedPoints(tasks)
+        runn = functools.partial(scheduler.run_shared_task, run_function=run_function)
+        returned_blocks = self.iter_parallel(runn, list(enumerate(shared.descriptors)))
+        try:
+            for number, descriptor in returned_blocks:
+                returned = shared.receive(descriptor)
+                if checkpoint is not None:
+                    tile_dict, files = tasks[number]
+                    for tile, points in tile_dict.items():
+                        checkpoint.record(sensor, tile, points, files, returned)
+                yield number, returned
+        finally:
+            # workers are stopped before blocks not received are unlinked
+            returned_blocks.close()
+            shared.close()
+
+    def run_streaming(
+        self, run_function, tasks, writer, sensor=None, checkpoint=None, previous=None
+    ):
+        """
+          function to run (tile, scenes) tasks in parallel and hand every
+          point to the writer once all tasks holding it have returned,
+          only unfinished points are kept in memory
+          in: run_function, extractor with time period bound
+              tasks, from scheduler.scene_tasks()
+              writer, result_writer.ChunkWriter
+              sensor, checkpoint, see iter_tasks()
+              previous, ResultStore of scenes done in an earlier run
+          """
+        pending = collections.Counter()
+        task_keys = []
+        for tile_dict, _ in tasks:
+            keys = set(
+                get_latlon_key_vector(
+                    [pt for points in tile_dict.values() for pt in points]
+                ).tolist()
+            )
+            pending.update(keys)
+            task_keys.append(keys)
+
+        unfinished = previous
+        if unfinished is not None:
+            # points with nothing left to extract
+            finished = [key for key in unfinished if pending[key] == 0]
+            writer.add(unfinished.take(finished))
+            unfinished.drop(finished)
+
+        returned_tasks = self.iter_tasks(run_function, tasks, sensor, checkpoint)
+        for number, returned in returned_tasks:
+            if returned is not None and len(returned) != 0:
+                if unfinished is None:
+                    unfinished = returned
+                else:
+                    unfinished.merge(returned)
+
+            finished = []
+            for key in task_keys[number]:
+                pending[key] -= 1
+                if pending[key] == 0:
+                    finished.append(key)
+            task_keys[number] = None
+
+            if unfinished is not None and len(finished) != 0:
+                writer.add(unfinished.take(finished))
+                unfinished.drop(finished)
+        writer.close()
+
+    def run_scenes(
+        self,
+        sensor,
+        run_function,
+        latlon_dict,
+        start_time,
+        end_time,
+        file_lists,
+        writer=None,
+        checkpoint=None,
+    ):
+        """
+          function to run a scene extractor over (tile, scenes) tasks
+          in: sensor, "landsat" or "sentinel"
+              run_function, extractor with time period bound
+              writer, with a writer results are streamed and nothing is returned
+              checkpoint, checkpoint.CheckpointStore, scenes recorded in it are
+                          not read again, their saved results are used instead
+          """
+        tasks = scheduler.scene_tasks(
+            latlon_dict,
+            file_lists,
+            sensor,
+            start_time,
+            end_time,
+            self.worker_num,
+            checkpoint=checkpoint,
+        )
+        previous = None
+        if checkpoint is not None:
+            previous = checkpoint.results(sensor, latlon_dict, start_time, end_time)
+        if writer is not None:
+            self.run_streaming(
+                run_function, tasks, writer, sensor, checkpoint, previous
+            )
+            return
+        tmp = [previous] + [
+            returned
+            for _, returned in self.iter_tasks(run_function, tasks, sensor, checkpoint)
+        ]
+        out = self.organize_out(tmp)
+        del (tmp)
         return out
 
     def organize_out(self, iinn):
         """
            funciton to sort parallel returned results to final wanted format
-           in: parallel out format: list of list of dict
-           out: dict
+           in: parallel out format: list of ResultStore (or dict)
+           out: ResultStore with partial results of a point merged,
+                or dict for dict results
            """
         ooout = {}
-        for i in range(len(iinn)):
-            if iinn[i] is not None and iinn[i] != {}:
-                ooout.update(iinn[i])
+        for item in iinn:
+            if item is None or len(item) == 0:
+                continue
+            if isinstance(item, ResultStore):
+                if isinstance(ooout, ResultStore):
+                    ooout.merge(item)
+                else:
+                    ooout = item
+            else:
+                ooout.update(item)
         return ooout
 
-    def run_sentinel(self, point_dict, start_time, end_time, file_lists):
+    def run_sentinel(
+        self, point_dict, start_time, end_time, file_lists, writer=None, checkpoint=None
+    ):
         """
           function to run sentinel extractor
+          with a writer, results are streamed to it and nothing is returned
           """
         latlon_dict = point_dict["sentinel"]
         runn = functools.partial(
-            extract_sentinel_SR,
-            start_time=start_time,
-            end_time=end_time,
-            data_source=file_lists,
+            extract_sentinel_SR, start_time=start_time, end_time=end_time
+        )
+        return self.run_scenes(
+            "sentinel",
+            runn,
+            latlon_dict,
+            start_time,
+            end_time,
+            file_lists,
+            writer=writer,
+            checkpoint=checkpoint,
         )
-        tmp = self.run_parallel(runn, latlon_dict)
-        sentinel_out = self.organize_out(tmp)
-        del tmp
-        return sentinel_out
 
-    def run_landsat(self, point_dict, start_time, end_time, file_lists):
+    def run_landsat(
+        self, point_dict, start_time, end_time, file_lists, writer=None, checkpoint=None
+    ):
         """
           function to run landsat extractor
+          with a writer, results are streamed to it and nothing is returned
           """
         latlon_dict = point_dict["landsat"]
         # latlon_dict = point_dict
         runn = functools.partial(
-            extract_landsat_SR,
-            start_time=start_time,
-            end_time=end_time,
-            data_source=file_lists,
+            extract_landsat_SR, start_time=start_time, end_time=end_time
+        )
+        return self.run_scenes(
+            "landsat",
+            runn,
+            latlon_dict,
+            start_time,
+            end_time,
+            file_lists,
+            writer=writer,
+            checkpoint=checkpoint,
         )
-        tmp = self.run_parallel(runn, latlon_dict)
-        landsat_out = self.organize_out(tmp)
-        del (tmp)
-        return landsat_out
 
     def run_modis(self, point_dict, start_time, end_time, file_lists):
         """
           function to run modis extractor
           """
         latlon_dict = point_dict["modis"]
+        # scan MODIS folders once, all workers share the catalog
+        file_lists = dict(file_lists, Catalog=refresh_catalog(file_lists))
         runn = functools.partial(
             extract_MODIS_LST,
             start_time=start_time,
@@ -183,86 +388,248 @@ class Extractor(object):
         """
           function to run precipitation extractor
           """
+        precip_out = extract_TRMM_GPM(
+            self.precip_points(point_dict), start_time, end_time
+        )
+
+        return precip_out
+
+    def precip_points(self, point_dict):
+        """
+          function to get the points of the precipitation extractor
+          """
         # we do not need to group points by tile, since precipitation is global covered
         latlon_dict = point_dict["landsat"]  # ensemble points
         latlon_list = []
         for key, val in latlon_dict.items():
             latlon_list.extend(val)
 
-        latlon_list = list(set(latlon_list))  # get rid of duplicates
-        precip_out = extract_TRMM_GPM(latlon_list, start_time, end_time)
-
-        return precip_out
+        return list(set(latlon_list))  # get rid of duplicates
 
     def ensemble(self, landsat_out, sentinel_out, modis_out, precip_out):
         """
-          function to ensemble all together into a large dict
+          function to join all sources on their point ids,
+          see extractor_functions/ensemble.py
+          in: ResultStore of every source, None for sources not run
+          out: ResultStore with the bands of all sources
           """
-        # final = modis_out  # modis as base
-        final = landsat_out  # landsat as base
-        # for latlon_key in final.keys():  # lat,lon points as key
-        #     try:
-        #         # TODO How to deal with duplicated points?????
-        #         # NOTE dict update will not work if there are identical keys
-        #         # luckily, we have not-alike key here:
-        #         # key in sentinel_out, modis_out, precip_out are all different
-        #         final[latlon_key].update(sentinel_out.get(latlon_key, []))
-        #         final[latlon_key].update(landsat_out.get(latlon_key, []))
-        #         final[latlon_key].update(precip_out.get(latlon_key, []))
-        #     except Exception:
-        #         continue
-        return final
+        final = Ensemble()
+        for out in [landsat_out, sentinel_out, modis_out, precip_out]:
+            final.add(out)
+        return final.store()
 
-    def save_to_npz(self, dataset, out_path, yr, ctype):
+    def pipeline_budget(self, sources, io_threads=None, cpu_workers=None):
         """
-          function to save to npz file
-          chunk data into small pieces
+          function to split the worker budget between I/O threads and
+          CPU processes, sources of only one kind get the whole budget
+          out: io_threads, cpu_workers
+          """
+        has_io = any(sensor in IO_SOURCES for sensor in sources)
+        has_cpu = any(sensor in CPU_SOURCES for sensor in sources)
+        if cpu_workers is None:
+            cpu_workers = self.worker_num if not has_io else self.worker_num // 2
+            cpu_workers = max(1, cpu_workers) if has_cpu else 0
+        if io_threads is None:
+            io_workers = max(1, self.worker_num - cpu_workers)
+            io_threads = io_workers * IO_THREADS_PER_WORKER if has_io else 0
+        return io_threads, cpu_workers
+
+    def iter_pipeline(
+        self,
+        point_dict,
+        start_time,
+        end_time,
+        file_lists,
+        sources,
+        checkpoint=None,
+        io_threads=None,
+        cpu_workers=None,
+    ):
+        """
+          function to run all sources at the same time, yields
+          (source, ResultStore, finished point ids) of every task in the order
+          tasks finish, a point is finished once all tasks holding it, of all
+          sources, have returned, points of saved results without a task left
+          are yielded as finished with source None before any task returns
+          in: point_dict, from get_latlon()
+              file_lists, {"landsat": catalog, "sentinel": catalog,
+                           "modis": {"MOD_Path": ..., "MYD_Path": ...}}
+              sources, e.g. ["landsat", "modis", "precip"]
+              checkpoint, landsat and sentinel scenes recorded in it are not
+                          read again, their saved results are yielded first
+              io_threads, cpu_workers, budget, see pipeline_budget(),
+              io_threads is the number of files read at the same time, scene
+              tasks run IO_THREADS_PER_TASK of them each
           """
-        if not out_path.startswith(os.path.expanduser("~")):
-            out_path = os.path.join(os.path.expanduser("~"), out_path.strip("./"))
-
-        length = len(dataset.keys())
-        chunk = 5000  # arbitrary chunk size
-        iter_total = int(length / chunk) + 1
-
-        for n in range(iter_total):
-            # tmp = itertools.islice(dataset.items(), n * chunk, (n + 1) * chunk)
-            tmp = list(dataset.items())[(n * chunk):(n + 1) * chunk]  # noqa : E203
-            try:
-                os.remove(
-                    os.path.join(
-                        out_path,
-                        yr
-                        + "_"
-                        + ctype
-                        + "_"
-                        + "extractor_results"
-                        + "_"
-                        + str(n)
-                        + ".npz",
+        io_threads, cpu_workers = self.pipeline_budget(
+            sources, io_threads, cpu_workers
+        )
+        print(
+            "Pipeline of %s: %d I/O threads, %d CPU processes"
+            % (", ".join(sources), io_threads, cpu_workers)
+        )
+        # the extractors read masks and bands in their own threads,
+        # every task only gets its share of the budget
+        read_threads = max(1, min(IO_THREADS_PER_TASK, io_threads))
+        io_tasks = max(1, io_threads // read_threads)
+        futures = {}
+        interrupted = False
+        io_pool = ThreadPoolExecutor(io_tasks)
+        cpu_pool = ProcessPoolExecutor(
+            max(1, cpu_workers), initializer=self.parallel_initializer
+        )
+        try:
+            # processes are forked before any I/O thread is started
+            if "modis" in sources:
+                modis_source = dict(
+                    file_lists["modis"], Catalog=refresh_catalog(file_lists["modis"])
+                )
+                runn = functools.partial(
+                    extract_MODIS_LST,
+                    start_time=start_time,
+                    end_time=end_time,
+                    data_source=modis_source,
+                )
+                for tile, points in point_dict["modis"].items():
+                    future = cpu_pool.submit(runn, {tile: points})
+                    futures[future] = ("modis", None, points)
+            if "precip" in sources:
+                precip_points = self.precip_points(point_dict)
+                future = cpu_pool.submit(
+                    extract_TRMM_GPM, precip_points, start_time, end_time
+                )
+                futures[future] = ("precip", None, precip_points)
+
+            saved_keys = set()
+
+            for sensor in IO_SOURCES:
+                if sensor not in sources:
+                    continue
+                latlon_dict = point_dict[sensor]
+                if checkpoint is not None:
+                    previous = checkpoint.results(
+                        sensor, latlon_dict, start_time, end_time
                     )
+                    if previous is not None:
+                        saved_keys.update(previous.point_keys.tolist())
+                    yield sensor, previous, []
+                runn = functools.partial(
+                    SCENE_EXTRACTORS[sensor],
+                    start_time=start_time,
+                    end_time=end_time,
+                    read_threads=read_threads,
+                )
+                tasks = scheduler.scene_tasks(
+                    latlon_dict,
+                    file_lists[sensor],
+                    sensor,
+                    start_time,
+                    end_time,
+                    io_tasks,
+                    checkpoint=checkpoint,
                 )
-            except Exception:
-                pass
+                for task in tasks:
+                    future = io_pool.submit(scheduler.run_task, task, runn)
+                    futures[future] = (
+                        sensor,
+                        task,
+                        [pt for points in task[0].values() for pt in points],
+                    )
 
-            numpy.savez(
-                os.path.join(
-                    out_path,
-                    yr
-                    + "_"
-                    + ctype
-                    + "_"
-                    + "extracted_results"
-                    + "_"
-                    + str(n)
-                    + ".npz",
-                ),
-                tmp,
-            )
+            # tasks still to return for every point
+            pending = collections.Counter()
+            task_keys = {}
+            for future, (_, _, points) in futures.items():
+                task_keys[future] = set(get_latlon_key_vector(points).tolist())
+                pending.update(task_keys[future])
+            yield None, None, [key for key in saved_keys if pending[key] == 0]
+
+            for future in as_completed(list(futures)):
+                sensor, task, _ = futures.pop(future)
+                returned = future.result()
+                if task is not None and checkpoint is not None:
+                    tile_dict, files = task
+                    for tile, points in tile_dict.items():
+                        checkpoint.record(sensor, tile, points, files, returned)
+                finished = []
+                for key in task_keys.pop(future):
+                    pending[key] -= 1
+                    if pending[key] == 0:
+                        finished.append(key)
+                yield sensor, returned, finished
+        except KeyboardInterrupt:
+            print("Received Control+C from Keyboard, EXITING........")
+            interrupted = True
+            # the caller must not take the partial results as complete
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+            # after Control+C running tasks are not waited for
+            io_pool.shutdown(wait=not interrupted, cancel_futures=True)
+            cpu_pool.shutdown(wait=not interrupted, cancel_futures=True)
+
+    def run_pipeline(
+        self,
+        point_dict,
+        start_time,
+        end_time,
+        file_lists,
+        writer,
+        sources=None,
+        checkpoint=None,
+        io_threads=None,
+        cpu_workers=None,
+    ):
+        """
+          function to run all sources at the same time and join their
+          results as tasks finish, see iter_pipeline() and ensemble.py,
+          a point is written to the writer once all its tasks have returned
+          and dropped from the join, so only unfinished points are kept
+          in: sources, default all sources with a file list, and precipitation
+          out: Ensemble of the points left at the end, written as well
+          """
+        if sources is None:
+            sources = [
+                sensor for sensor in IO_SOURCES + ["modis"] if sensor in file_lists
+            ] + ["precip"]
+        joined = Ensemble()
+        for sensor, returned, finished in self.iter_pipeline(
+            point_dict,
+            start_time,
+            end_time,
+            file_lists,
+            sources,
+            checkpoint=checkpoint,
+            io_threads=io_threads,
+            cpu_workers=cpu_workers,
+        ):
+            joined.add(returned)
+            if len(finished) != 0:
+                writer.add(joined.take(finished))
+                joined.drop(finished)
+        joined.write(writer)
+        return joined
+
+    def save_to_npz(self, dataset, out_path, yr, ctype):
+        """
+          function to save to npz file
+          chunk data into small pieces, see result_writer.ChunkWriter
+          in: dataset, ResultStore, or records in the old dict format,
+              e.g. from organize_out()
+          """
+        if isinstance(dataset, dict):
+            dataset = ResultStore.from_records(dataset)
+        if not isinstance(dataset, ResultStore):
+            raise TypeError("Unable to save %s" % type(dataset).__name__)
+        writer = ChunkWriter(out_path, yr, ctype)
+        writer.add(dataset)
+        writer.close()
 
 
 if __name__ == "__main__":
     # FILE LIST should not include home dir
+    # batches of regions and date ranges: see extract_cli.py and its job manifest
 
     # some static path information
     input_file = os.path.join(
@@ -309,7 +676,9 @@ if __name__ == "__main__":
         ],
     }
 
+    # 1: landsat, 2: sentinel, 3: all sources joined, see Extractor.run_pipeline
     extracting_state = 1
+    worker_num = multiprocessing.cpu_count() - 1
 
     # do a loop to execute all task
     assert len(dynamic_task["date_pair"]) == len(dynamic_task["tasks"])
@@ -329,54 +698,77 @@ if __name__ == "__main__":
             # print(basename)
             year, crop = basename.split("_")[0], basename.split("_")[1]
 
-            e = Extractor()
+            e = Extractor(worker_num=worker_num)
+            # finished points are streamed to chunk files while extracting
+            writer = ChunkWriter(out_path, year, crop)
+            # finished scenes are recorded, a rerun only reads what is left,
+            # or only new scenes when the inventory got new dates
+            checkpoint = CheckpointStore(
+                os.path.join(
+                    os.path.expanduser("~"),
+                    intermediate_out_path,
+                    "_".join(
+                        [task_f.split(".")[0], start_date, end_date, "checkpoint"]
+                    ),
+                )
+            )
 
             latlon_array = e.get_latlon(input_files)
-            sentinel_file_list = e.get_jsonlist(sentinel_listfile)
-            landsat_file_list = e.get_jsonlist(landsat_listfile)
+            sentinel_file_list = e.get_catalog(sentinel_listfile, "sentinel")
+            landsat_file_list = e.get_catalog(landsat_listfile, "landsat")
 
             if extracting_state == 1:
                 print("Starting Landsat")
                 tic = time.time()
-                final = e.run_landsat(
-                    latlon_array, start_date, end_date, landsat_file_list
+                e.run_landsat(
+                    latlon_array,
+                    start_date,
+                    end_date,
+                    landsat_file_list,
+                    writer=writer,
+                    checkpoint=checkpoint,
                 )
                 print("Extracting time {}".format(time.time() - tic))
-                # save intermediat file
-                numpy.savez(
-                    os.path.join(
-                        os.path.expanduser("~"),
-                        intermediate_out_path,
-                        task_f.split(".")[0]
-                        + "_landsat_intermediate_china.npz",
-                    ),
-                    final,
-                )
                 print("landsat file saved")
 
             if extracting_state == 2:
                 print("Starting Sentinel")
                 if int(year) < 2016:
                     print("Year %s has no sentinel data, pass" % year)
-                    final = {}
                 else:
                     tic = time.time()
-                    final = e.run_sentinel(
-                        latlon_array, start_date, end_date, sentinel_file_list
+                    e.run_sentinel(
+                        latlon_array,
+                        start_date,
+                        end_date,
+                        sentinel_file_list,
+                        writer=writer,
+                        checkpoint=checkpoint,
                     )
                     print("Extracting time {}".format(time.time() - tic))
-                    # save sentinel intermediate file
-                    numpy.savez(
-                        os.path.join(
-                            os.path.expanduser("~"),
-                            intermediate_out_path,
-                            task_f.split(".")[0]
-                            + "_sentinel_intermediate.npz",
-                        ),
-                        final,
-                    )
                     print("sentinel file saved")
 
+            if extracting_state == 3:
+                # all sources at the same time under one worker budget,
+                # results are joined as tasks finish and written at the end
+                tic = time.time()
+                file_lists = {
+                    "landsat": landsat_file_list,
+                    "modis": modis_file_list,
+                }
+                if int(year) >= 2016:
+                    file_lists["sentinel"] = sentinel_file_list
+                e.run_pipeline(
+                    latlon_array,
+                    start_date,
+                    end_date,
+                    file_lists,
+                    writer,
+                    checkpoint=checkpoint,
+                )
+                print("Extracting time {}".format(time.time() - tic))
+                print("ensemble file saved")
+
             # print("Starting Modis")
             # tic = time.time()
             # m_o = e.run_modis(latlon_array, start_date, end_date, modis_file_list)
@@ -409,11 +801,5 @@ if __name__ == "__main__":
             # )
             # print("precipitation file saved")
 
-            tic = time.time()
-            # final = e.ensemble(
-            # landsat_out=l_o, sentinel_out=s_o, modis_out=m_o, precip_out=p_o
-            # landsat_out=l_o, sentinel_out=0, modis_out=0, precip_out=0
-            # )
-            # print("SSS %f" % (time.time() - tic))
-            e.save_to_npz(final, out_path, year, crop)
+            print("%d points saved to %d files" % (writer.n_points, writer.n_files))
             print("HERO: all done")
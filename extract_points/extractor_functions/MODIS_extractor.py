@@ -9,43 +9,67 @@ import pprint
 from osgeo import gdal
 from os.path import join
 import numpy
-from datetime import datetime
 import extractor_functions.geo_functions as geo_functions
+from extractor_functions.result_store import ResultStore
+from extractor_functions.scene_cache import SceneGeometryCache
+from extractor_functions import scene_catalog
+from extractor_functions import calendar_axis
 import gc
 import time
 
 printer = pprint.PrettyPrinter(indent=3)
 
 
-def create_tar_hdf(data_path, tile_key, start_time, end_time):
+# default catalog of the MODIS folder trees, relative to home
+MODIS_CATALOG = ".modis_catalog.sqlite"
+
+# catalog product of the folder trees of a data source
+PRODUCTS = {"MOD_Path": "MOD11A1", "MYD_Path": "MYD11A1"}
+
+
+def modis_roots(data_source):
+    """
+    function to get {product: folder} of the MOD and MYD folder trees
+    in: data_source, {"MOD_Path": ..., "MYD_Path": ...}
+    """
+    roots = {}
+    for key, product in PRODUCTS.items():
+        root = data_source[key]
+        if not os.path.isabs(root):
+            root = join(os.path.expanduser("~"), os.path.normpath(root))
+        roots[product] = root
+    return roots
+
+
+def refresh_catalog(data_source, db_path=None):
+    """
+    function to scan the MOD and MYD folder trees into the scene catalog,
+    only date folders changed since the last scan are listed again
+    out: catalog file, pass it as data_source["Catalog"] to skip the scan
+    """
+    if db_path is None:
+        db_path = join(os.path.expanduser("~"), MODIS_CATALOG)
+    catalog = scene_catalog.open_folder_catalog(modis_roots(data_source), db_path)
+    catalog.close()
+    return db_path
+
+
+def create_tar_hdf(catalog, product, tile_key, start_time, end_time):
     """
        function to get a list of data file given time period and tileid
        """
-    start_time = datetime.strptime(start_time, "%Y%m%d")
-    end_time = datetime.strptime(end_time, "%Y%m%d")
-
-    hdf_list = []
-    for MOD11Folder in os.listdir(data_path):
-        MOD11Date = datetime.strptime(MOD11Folder, "%Y.%m.%d")
-        if start_time <= MOD11Date <= end_time:
-            for MOD11_file in os.listdir(join(data_path, MOD11Folder)):
-                if (MOD11_file.split(".")[-1] == "hdf") and (
-                    MOD11_file.split(".")[2] in [tile_key]
-                ):
-                    hdf_list.append(join(data_path, MOD11Folder, MOD11_file))
-        else:
-            continue
-    return hdf_list
+    return catalog.query(product, tile_key, start_time, end_time)
 
 
 def date2DOY(file_date):
     """
-    function to convert date to day of year
+    function to convert dates to year and day of year
+    in: file_date, YYYYMMDD, a scalar or a sequence
+    out: int64 YYYYDDD, same shape
     """
-
-    file_date = datetime.strptime(file_date, "%Y%m%d")
-    days = str(file_date.year).zfill(4) + str(file_date.timetuple().tm_yday).zfill(3)
-    return days
+    days = calendar_axis.to_days(file_date)
+    year = calendar_axis.year_of(days).astype(numpy.int64)
+    return year * 1000 + calendar_axis.day_of_year(days)
 
 
 def extract_MODIS_LST(tile_dict, start_time, end_time, data_source):
@@ -55,8 +79,10 @@ def extract_MODIS_LST(tile_dict, start_time, end_time, data_source):
     points: coordinate (lat, lon); float, a list of tuple
     start time: start time, should be in the format of 'YYYYMMDD' [string]
     end time: end time, should be in the format of "YYYYMMDD" [string]
+    data_source: {"MOD_Path": ..., "MYD_Path": ...}, "Catalog": catalog file
+                 from refresh_catalog(), the folders are scanned if not given
     output of the function:
-    a list of data with format{"lat,lon":{'MODIS_LST':
+    a list of data with format{point id:{'MODIS_LST':
                                    [(time1,value1),(time2,value2),...]}}
     ---------------Valid LST Data-----------------
     7500 <= LST <= 65535 (scale is 0.02)
@@ -64,24 +90,33 @@ def extract_MODIS_LST(tile_dict, start_time, end_time, data_source):
     --------------Invalid LST Data----------------
     LST = -1
     Others(eg. QC == 2/3)
+    valid day and night LST of MOD and MYD files of a date are averaged
     """
-    # Results
-    MODIS_LST_res = {}
-
-    # MODIS LST folders
-    MOD_data_path = join(os.path.expanduser("~"), data_source["MOD_Path"].strip("./"))
-    MYD_data_path = join(os.path.expanduser("~"), data_source["MYD_Path"].strip("./"))
+    # Results store, one row for each point of all tiles
+    MODIS_LST_res = ResultStore(
+        geo_functions.get_latlon_key_vector(
+            [pt for points in tile_dict.values() for pt in points]
+        ).tolist(),
+        ["MODIS_LST"],
+        decimals=2,
+    )
+
+    # MODIS LST files, indexed by (product, tile, date) once for all tiles
+    if "Catalog" not in data_source:
+        data_source = dict(data_source, Catalog=refresh_catalog(data_source))
+    catalog = scene_catalog.SceneCatalog(data_source["Catalog"])
+    products = list(modis_roots(data_source).keys())
 
     # Get Data
     tile_count = 0
     for tile_key in tile_dict.keys():
         tic = time.time()
-        # Add MOD file list
-        hdf_files = create_tar_hdf(MOD_data_path, tile_key, start_time, end_time)
-        # Add MYD file list
-        hdf_files = hdf_files + create_tar_hdf(
-            MYD_data_path, tile_key, start_time, end_time
-        )
+        # Add MOD and MYD file list
+        hdf_files = []
+        for product in products:
+            hdf_files += create_tar_hdf(
+                catalog, product, tile_key, start_time, end_time
+            )
 
         print(
             "Processing the tile",
@@ -100,143 +135,90 @@ def extract_MODIS_LST(tile_dict, start_time, end_time, data_source):
             continue
 
         tile_count += 1
-
-        # start looping file
-        for file_path in hdf_files:
-            try:
-                hdf_ds = gdal.Open(file_path, gdal.GA_ReadOnly)
-            except Exception:
-                print("Unable to open file: \n" + file_path + "\nSkipping\n")
-                continue
-
+        tile_rows = MODIS_LST_res.rows(
+            geo_functions.get_latlon_key_vector(tile_dict[tile_key]).tolist()
+        )
+        scene_geometry = SceneGeometryCache(tile_dict[tile_key])
+
+        # group MOD and MYD files by date, they are averaged together
+        date_files = {}
+        path_infos = [file_path.split("/") for file_path in hdf_files]
+        file_doys = date2DOY([info[-2].replace(".", "") for info in path_infos])
+        for file_path, path_info, file_doy in zip(
+            hdf_files, path_infos, file_doys.tolist()
+        ):
             # Compare file info and folder info
-            path_info = file_path.split("/")
             file_date = path_info[-2].replace(".", "")
             file_type = path_info[-3].split(".")[0]
             file_name = os.path.basename(file_path)
             file_info = file_name.split(".")
-            if file_type != file_info[0] or date2DOY(file_date) != file_info[1][1:]:
+            if file_type != file_info[0] or str(file_doy) != file_info[1][1:]:
                 print("File info unmatch: \n" + file_path + "\nSkipping\n")
                 continue
+            date_files.setdefault(file_date, []).append(file_path)
 
-            # get in all data
-            try:
-                # Get Day LST and QC
-                # Get Day QC Dataset
-                day_lst_ds = gdal.Open(hdf_ds.GetSubDatasets()[0][0])
-                day_lst_rst = day_lst_ds.GetRasterBand(1).ReadAsArray()
-
-                # Get geo info
-                geo_ct = geo_functions.getSRSPair(day_lst_ds)
-                geo_tran = day_lst_ds.GetGeoTransform()
-                XSize = day_lst_ds.RasterXSize
-                YSize = day_lst_ds.RasterYSize
-
-                day_qc_ds = gdal.Open(hdf_ds.GetSubDatasets()[1][0])
-                day_qc_rst = day_qc_ds.GetRasterBand(1).ReadAsArray()
-
-                # Get Night LST and QC
-                # Get Night QC Value
-                night_lst_ds = gdal.Open(hdf_ds.GetSubDatasets()[4][0])
-                night_lst_rst = night_lst_ds.GetRasterBand(1).ReadAsArray()
-
-                night_qc_ds = gdal.Open(hdf_ds.GetSubDatasets()[5][0])
-                night_qc_rst = night_qc_ds.GetRasterBand(1).ReadAsArray()
-            except Exception as e:
-                print(e)
-                continue
-            # store all location index and dict key
-            px_array, py_array, res_key_array = geo_functions.point_boundary_is_valid_vector(  # noqa : E501
-                XSize, YSize, tile_dict[tile_key], geo_tran, geo_ct
-            )
-
-            # get day qc value
-            day_qc_value = geo_functions.get_band_value_vector(
-                day_qc_rst, px_array, py_array, 3, cloud=True
+        # start looping dates
+        for file_date in sorted(date_files):
+            # day and night LST of every file stacked, nan if not valid
+            lst_stack = numpy.full(
+                (len(tile_dict[tile_key]), 2 * len(date_files[file_date])), numpy.nan
             )
-
-            # get day lst value
-            day_lst_value = geo_functions.get_band_value_vector(
-                day_lst_rst, px_array, py_array, 3
-            )
-
-            # get night qc value
-            night_qc_value = geo_functions.get_band_value_vector(
-                night_qc_rst, px_array, py_array, 3, cloud=True
-            )
-
-            # get night lst value
-            night_lst_value = geo_functions.get_band_value_vector(
-                night_lst_rst, px_array, py_array, 3
-            )
-
-            # filter out location points not satisfy  qc criteria
-            # 0 or convert to unsigned integter & 0x000F
-            index_day = []
-            index_night = []
-            for i in range(px_array.shape[0]):
-                if not (day_qc_value[i] == 0 or day_qc_value[i] & 0x000F == 1):
-                    index_day.append(i)
-                if not (night_qc_value[i] == 0 or night_qc_value[i] & 0x000F == 1):
-                    index_night.append(i)
-
-            # filter value out of normal range
-            day_lst_value[
-                numpy.logical_or(
-                    day_lst_value >= 65535 * 0.02, day_lst_value <= 7500 * 0.02
-                )
-            ] = numpy.nan
-            # filter out value not satisfy qc
-            day_lst_value[index_day] = numpy.nan
-
-            # filter value out of normal range
-            night_lst_value[
-                numpy.logical_or(
-                    night_lst_value >= 65535 * 0.02, night_lst_value <= 7500 * 0.02
-                )
-            ] = numpy.nan
-            # filter out value not satisfy qc
-            night_lst_value[index_night] = numpy.nan
-
-            # do average
-            lst_value = numpy.nanmean([day_lst_value, night_lst_value], axis=0)
-            index = numpy.where(~numpy.isnan(lst_value))
-            lst_value = lst_value[index].round(decimals=2)
-            res_key_array = res_key_array[index]
-
-            # Add to results, key and band data has to be 1-1 match
-            for i, res_key in enumerate(res_key_array):
-                if res_key in MODIS_LST_res.keys():
-                    try:
-                        MODIS_LST_record = MODIS_LST_res[res_key]
-                        MODIS_LST_record["MODIS_LST"].append(
-                            (file_date, float(lst_value[i]))
-                        )
-                    except KeyError:
-                        print("Key Error!!!")
-                        pass
-                else:
-                    MODIS_LST_record = {}
-                    MODIS_LST_record["MODIS_LST"] = [(file_date, float(lst_value[i]))]
-                    MODIS_LST_res[res_key] = MODIS_LST_record
-            # del variable after file loop
-            del (hdf_ds)
-            del (day_lst_rst)
-            del (night_lst_rst)
-            del (day_qc_rst)
-            del (night_qc_rst)
-            del (day_lst_ds)
-            del (day_qc_ds)
-            del (night_lst_ds)
-            del (night_qc_ds)
-            del (day_lst_value)
-            del (night_lst_value)
+            for k, file_path in enumerate(date_files[file_date]):
+                try:
+                    hdf_ds = gdal.Open(file_path, gdal.GA_ReadOnly)
+                    sub_datasets = hdf_ds.GetSubDatasets()
+                    # Day LST and QC, Night LST and QC
+                    day_lst_ds = gdal.Open(sub_datasets[0][0])
+                    day_qc_ds = gdal.Open(sub_datasets[1][0])
+                    night_lst_ds = gdal.Open(sub_datasets[4][0])
+                    night_qc_ds = gdal.Open(sub_datasets[5][0])
+                except Exception as e:
+                    print(e)
+                    print("Unable to open file: \n" + file_path + "\nSkipping\n")
+                    continue
+
+                # store all location index and position in tile points,
+                # points are projected once for files sharing geo info
+                px_array, py_array, index = scene_geometry.locate(day_lst_ds)
+
+                datasets = [(day_lst_ds, day_qc_ds), (night_lst_ds, night_qc_ds)]
+                for j, (lst_ds, qc_ds) in enumerate(datasets):
+                    # only blocks holding points are read
+                    lst_value = geo_functions.get_band_value_block_vector(
+                        lst_ds, px_array, py_array, 3
+                    )
+                    qc_value = geo_functions.read_points_by_block(
+                        qc_ds, px_array, py_array
+                    ).astype(numpy.int64)
+
+                    # qc criteria: 0 or & 0x000F == 1, and normal range
+                    valid = numpy.logical_or(qc_value == 0, qc_value & 0x000F == 1)
+                    valid &= numpy.logical_and(
+                        lst_value < 65535 * 0.02, lst_value > 7500 * 0.02
+                    )
+                    lst_stack[index[valid], 2 * k + j] = lst_value[valid]
+
+                # del variable after file loop
+                del (hdf_ds)
+                del (day_lst_ds)
+                del (day_qc_ds)
+                del (night_lst_ds)
+                del (night_qc_ds)
+
+            # do average of day/night and MOD/MYD
+            n_valid = numpy.count_nonzero(~numpy.isnan(lst_stack), axis=1)
+            observed = numpy.flatnonzero(n_valid)
+            lst_value = (
+                numpy.nansum(lst_stack[observed], axis=1) / n_valid[observed]
+            ).round(decimals=2)
+
+            # Add to results, rows and lst value has to be 1-1 match
+            if observed.shape[0] != 0:
+                MODIS_LST_res.write_scene(file_date, tile_rows[observed], lst_value)
+            del (lst_stack)
             gc.collect()
 
         print("Tile %s, take time %f" % (tile_key, time.time() - tic))
 
-    # sort the results by Date
-    for _, MODIS_LST_record in MODIS_LST_res.items():
-        MODIS_LST_record["MODIS_LST"].sort()
-
+    catalog.close()
     return MODIS_LST_res
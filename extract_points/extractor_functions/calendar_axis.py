@@ -0,0 +1,106 @@
+"""
+shared calendar of extraction and preprocessing, dates as int32 day ordinals
+
+Dates travel as YYYYMMDD strings and used to be parsed with strptime wherever
+they were compared, filled or turned into day of year. Here a date is encoded
+once into an int32 day ordinal, days since 1970-01-01, and everything else is
+integer arithmetic on arrays:
+
+    days = to_days(store.dates)               # (scene,) int32
+    axis = date_axis("20180401", "20181001")  # every day of the window, cached
+    cols = days - axis[0]                     # column of a date on the axis
+    doy = day_of_year(days)
+
+Chunk files carry the ordinals of their dates as "days", see
+ResultStore.save(), so readers do not parse the date strings again.
+"""
+import functools
+import numpy
+
+# number of (start, end) windows whose axes are kept, see date_axis()
+AXIS_CACHE = 64
+
+
+def to_days(dates):
+    """
+    function to encode dates as day ordinals
+    in: dates, YYYYMMDD as strings or integers, a scalar or a sequence
+    out: int32 days since 1970-01-01, same shape
+    """
+    ymd = numpy.asarray(dates).astype(numpy.int64)
+    months = (ymd // 10000 - 1970) * 12 + ymd // 100 % 100 - 1
+    days = months.astype("datetime64[M]").astype("datetime64[D]") + (ymd % 100 - 1)
+    return days.astype(numpy.int32)
+
+
+def to_dates(days):
+    """
+    function to decode day ordinals
+    out: YYYYMMDD strings, same shape
+    """
+    days = numpy.asarray(days).astype("datetime64[D]")
+    months = days.astype("datetime64[M]")
+    years = months.astype("datetime64[Y]")
+    ymd = (
+        (years.astype(numpy.int64) + 1970) * 10000
+        + (months - years.astype("datetime64[M]")).astype(numpy.int64) * 100
+        + (days - months.astype("datetime64[D]")).astype(numpy.int64)
+        + 101
+    )
+    return ymd.astype("<U8")
+
+
+def day_of_year(days):
+    """
+    function to get the day of year of day ordinals
+    out: int32, 1 for January 1st
+    """
+    days = numpy.asarray(days).astype("datetime64[D]")
+    first = days.astype("datetime64[Y]").astype("datetime64[D]")
+    return ((days - first).astype(numpy.int64) + 1).astype(numpy.int32)
+
+
+def year_of(days):
+    """
+    function to get the year of day ordinals
+    out: int32
+    """
+    years = numpy.asarray(days).astype("datetime64[D]").astype("datetime64[Y]")
+    return (years.astype(numpy.int64) + 1970).astype(numpy.int32)
+
+
+@functools.lru_cache(maxsize=AXIS_CACHE)
+def _axis(start_day, end_day):
+    axis = numpy.arange(to_days(start_day), to_days(end_day) + 1, dtype=numpy.int32)
+    axis.flags.writeable = False
+    labels = to_dates(axis)
+    labels.flags.writeable = False
+    return axis, labels
+
+
+def date_axis(start_day, end_day):
+    """
+    function to get every day from start to end day, both included,
+    axes are cached per window and shared, they are read only
+    in: start and end day in format YYYYMMDD
+    out: (day,) int32 day ordinals
+    """
+    return _axis(str(start_day), str(end_day))[0]
+
+
+def date_labels(start_day, end_day):
+    """
+    function to get the YYYYMMDD labels of date_axis()
+    """
+    return _axis(str(start_day), str(end_day))[1]
+
+
+def axis_columns(days, axis):
+    """
+    function to get the columns of days on a date axis
+    in: days, day ordinals, axis, from date_axis()
+    out: int64 columns, -1 for days outside the axis
+    """
+    cols = numpy.asarray(days, dtype=numpy.int64) - int(axis[0])
+    cols[(cols < 0) | (cols >= axis.shape[0])] = -1
+    return cols
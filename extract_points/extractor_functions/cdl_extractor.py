@@ -3,10 +3,11 @@
 
 import os
 import logging
-import itertools
 import json
 import datetime
+import numpy
 from osgeo import gdal, osr
+from extractor_functions import geo_functions
 
 # very simple logging facility
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +31,26 @@ def get_cdl(cdl_source, coord, time_start, time_end):
        for more information regarding format of output
        please refer to extractor.py file
     ALSO NOTE, cdl changes every year, so literally time string should be in year
+    for many points, use get_cdl_codes(), it keeps the result in arrays
+    """
+    years, codes = get_cdl_codes(cdl_source, coord, time_start, time_end)
+    types = match_croptype(codes)  # (point, year) crop names
+
+    final = list(
+        {"coordinate": coord[i], "crop_type": list(zip(years, types[i]))}
+        for i in range(len(coord))
+    )
+    return final
+
+
+def get_cdl_codes(cdl_source, coord, time_start, time_end):
+    """
+    function to extract cdl crop codes of many points, array backed
+    input of the function: see get_cdl()
+    output of the function:
+       years: list of year strings
+       codes: uint8 array (point, year) of cdl codes, 0 (Background) for points
+              outside the image, use match_croptype() to get crop names
     """
     # parse date, format=YYYYMMDD
     time_start = datetime.datetime.strptime(time_start, "%Y%m%d")
@@ -38,9 +59,9 @@ def get_cdl(cdl_source, coord, time_start, time_end):
     e_yr = time_end.year
 
     all_timestring = list(map(str, range(int(s_yr), int(e_yr) + 1)))
-    final = list({"coordinate": coord[i], "crop_type": []} for i in range(len(coord)))
+    codes = numpy.zeros((len(coord), len(all_timestring)), dtype=numpy.uint8)
 
-    for ts in all_timestring:
+    for j, ts in enumerate(all_timestring):
         filename = [cdl for cdl in cdl_source if ts in cdl][0]
         filename = os.path.join(os.path.expanduser("~"), filename.strip("./ \n"))
         """
@@ -63,33 +84,29 @@ def get_cdl(cdl_source, coord, time_start, time_end):
 
         img = gdal.Open(filename)
         # going to convert coord into coord_index based on which to extract data
-        coord_ind = toindex(coord, img)
-
-        # HERE another consideration is NOT read in the entire raster.
-        # extract data
-        crop_ind = [img.ReadAsArray(cc[0], cc[1], 1, 1)[0][0] for cc in coord_ind]
-        types = match_croptype(crop_ind)
-
-        tmp = list(zip(itertools.repeat(ts, len(coord)), types))
+        px, py = toindex_vector(coord, img)
+        inside = numpy.flatnonzero(
+            (px >= 0) & (px < img.RasterXSize) & (py >= 0) & (py < img.RasterYSize)
+        )
 
-        # save to list
-        for i in range(len(final)):
-            final[i]["crop_type"].append(tmp[i])
+        # NOT read in the entire raster, only the blocks holding points
+        codes[inside, j] = geo_functions.read_points_by_block(
+            img, px[inside], py[inside], full_read=False
+        )
+        del (img)
 
-    return final
+    return all_timestring, codes
 
 
-def toindex(ccoord, iimg):
+def toindex_vector(ccoord, iimg):
     """
     function to convert lat lon points to projected system then
-    to pixel index of the image
+    to pixel index of the image, all points in one transformation
     input of the function:
        points list [(lat1,lon1),(lat2,lon2),...]
-       geographic coordinate system and projection system informaiton
-       geo transformation information
-
+       image, with projection system and geo transformation information
     output of the function
-       pixel index
+       px, py, int arrays of pixel index
     """
     oproj = osr.SpatialReference()
     oproj.ImportFromWkt(
@@ -113,39 +130,67 @@ def toindex(ccoord, iimg):
     # Xgeo = geotransform[0] + Xpixel*geotransform[1] + Yline*geotransform[2]
     # Ygeo = geotransform[3] + Xpixel*geotransform[4] + Yline*geotransform[5]
 
-    coord_I = list()
-    for (
-        cc
-    ) in ccoord:  # this will be slow for millions points? does TransformPoints() works?
-        tmp = coordinate_transform.TransformPoint(cc[1], cc[0])[
-            :2
-        ]  # order of point coordinate switched to (lon,lat)
-        coord_I.append(
-            (
-                int((tmp[0] - geo_trans[0]) / geo_trans[1]),
-                int((tmp[1] - geo_trans[3]) / geo_trans[5]),
-            )
-        )
+    if len(ccoord) == 0:
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+    # order of point coordinate switched to (lon,lat)
+    coord = numpy.array(ccoord, dtype=numpy.float64).reshape(-1, 2)[:, ::-1]
+    projected = numpy.array(coordinate_transform.TransformPoints(coord.tolist()))
+    px = ((projected[:, 0] - geo_trans[0]) / geo_trans[1]).astype(int)
+    py = ((projected[:, 1] - geo_trans[3]) / geo_trans[5]).astype(int)
 
-    return coord_I
+    return px, py
+
+
+def toindex(ccoord, iimg):
+    """
+    function to convert lat lon points to projected system then
+    to pixel index of the image, see toindex_vector()
+    output of the function
+       pixel index [(x1,y1),(x2,y2),...]
+    """
+    px, py = toindex_vector(ccoord, iimg)
+    return list(zip(px.tolist(), py.tolist()))
+
+
+# crop type of code 0, the cdl background and points outside the image
+BACKGROUND = "Background"
+
+# 256 entry code -> crop type table, loaded once per process
+_crop_lookup = None
+
+
+def crop_lookup():
+    """
+    function to get the table of crop types by cdl code,
+    code 0, of points outside the image, is BACKGROUND if crop_index.json
+    does not name it, other codes without crop type in crop_index.json map to ""
+    """
+    global _crop_lookup
+    if _crop_lookup is None:
+        # need to read in .json file with numbering and crop types
+        with open(
+            os.path.join(
+                os.path.dirname(os.path.realpath(__file__)), "aux_data/crop_index.json"
+            )
+        ) as fid:
+            contents = json.load(fid)  # a dictionary with crop types as value
+        lookup = numpy.full(256, "", dtype=object)
+        lookup[0] = BACKGROUND
+        for key, crop_type in contents.items():
+            lookup[int(key)] = crop_type
+        _crop_lookup = lookup
+    return _crop_lookup
 
 
 def match_croptype(inds):
     """
     this function is to match the numbering of crop types with real crop type
     input of the function:
-       a list of numbering of crop types
+       a list or array of numbering of crop types
     output of the functio:
-       a list of crop types
+       a list of crop types, nested the same way as the input
     """
-    # need to read in .json file with numbering and crop types
-    with open(os.path.abspath("./aux_data/crop_index.json")) as fid:
-        contents = json.load(fid)  # a dictionary with crop types as value
-
-    inds = map(str, inds)
-    final_types = [contents[key] for key in inds]
-
-    return final_types
+    return crop_lookup()[numpy.asarray(inds, dtype=numpy.uint8)].tolist()
 
 
 def extract_CDL(coordinates, time_begin, time_end):
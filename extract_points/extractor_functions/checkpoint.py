@@ -0,0 +1,153 @@
+"""
+checkpoints of (tile, scene) extraction units
+
+Every (tile, scenes) task that returns is recorded as done for each scene it
+read, together with the hash of the tile's point set, and its partial
+results are saved as a ResultStore file. A restarted run leaves the recorded
+scenes out of its tasks and takes their results from the saved parts, so
+only the scenes that had not finished are read again. Scenes the extractor
+could not read, see ResultStore.failed_scenes, are not recorded and are
+tried again. Running again later
+with new scenes in the inventory (or a later end time) extends the results
+the same way: old scenes come from the parts, only new dates are read.
+Saved results are cut to the dates of the run's window when loaded.
+
+    checkpoint = CheckpointStore(".../2018_corn_20180101_20181231_checkpoint")
+    done = checkpoint.done("landsat", "123-40", points)  # set of scenes
+    checkpoint.record("landsat", "123-40", points, scenes, result_store)
+    previous = checkpoint.results(
+        "landsat", {"123-40": points, ...}, "20180101", "20181231"
+    )
+
+FILE CONVENTION, in the checkpoint folder:
+    checkpoint.sqlite   units(sensor, tile, points, scene, part)
+    parts/<n>.npz       ResultStore of one task, see ResultStore.save()
+"""
+import os
+import hashlib
+import sqlite3
+import numpy
+from extractor_functions.result_store import ResultStore
+from extractor_functions.geo_functions import get_latlon_key_vector
+
+
+def point_hash(points):
+    """
+    function to get a hash of a point set, the order of points does not matter
+    in: points [(lat1,lon1),(lat2,lon2),...]
+    """
+    ids = numpy.unique(get_latlon_key_vector(points)).astype("<i8")
+    return hashlib.sha1(ids.tobytes()).hexdigest()
+
+
+def window(store, start_time, end_time):
+    """
+    function to keep the scene columns of a store within a time period
+    in: start_time, end_time, YYYYMMDD, both included, None for no limit
+    """
+    keep = numpy.ones(store.n_scenes, dtype=bool)
+    if start_time is not None:
+        keep &= store.dates >= str(start_time)
+    if end_time is not None:
+        keep &= store.dates <= str(end_time)
+    if keep.all():
+        return store
+    return ResultStore.from_arrays(
+        store.point_keys.tolist(),
+        store.band_keys,
+        store.decimals,
+        store.dates[keep],
+        store.values[:, keep],
+        store.valid[:, keep],
+    )
+
+
+class CheckpointStore(object):
+    def __init__(self, path):
+        """
+        open or create the checkpoint folder
+        """
+        self.path = path
+        self.part_path = os.path.join(path, "parts")
+        if not os.path.exists(self.part_path):
+            os.makedirs(self.part_path)
+        self.conn = sqlite3.connect(os.path.join(path, "checkpoint.sqlite"))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            "sensor TEXT, tile TEXT, points TEXT, scene TEXT, part TEXT, "
+            "PRIMARY KEY (sensor, tile, points, scene))"
+        )
+        self.conn.commit()
+        self._hashes = {}
+
+    def _hash(self, points):
+        # the same point lists are asked for many times during a run
+        if id(points) not in self._hashes:
+            self._hashes[id(points)] = (points, point_hash(points))
+        return self._hashes[id(points)][1]
+
+    def done(self, sensor, tile, points):
+        """
+        function to get the scenes of a tile already extracted for these points
+        out: set of scenes
+        """
+        found = self.conn.execute(
+            "SELECT scene FROM units WHERE sensor = ? AND tile = ? AND points = ?",
+            (sensor, tile, self._hash(points)),
+        )
+        return set(row[0] for row in found)
+
+    def record(self, sensor, tile, points, scenes, result):
+        """
+        function to record the scenes of a finished task and save its results
+        in: sensor, tile, points, the task's tile and point set
+            scenes, scenes of the task, failed scenes of the result are left out
+            result, ResultStore returned by the task, may be None or empty
+        """
+        if result is not None:
+            failed = set(result.failed_scenes)
+            scenes = [scene for scene in scenes if scene not in failed]
+        part = None
+        if result is not None and len(result) != 0:
+            part = "%s.npz" % hashlib.sha1(
+                "\n".join([sensor, tile] + sorted(scenes)).encode("utf8")
+            ).hexdigest()
+            result.save(os.path.join(self.part_path, part))
+        # results are on disk before the scenes are marked done
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?)",
+            [(sensor, tile, self._hash(points), scene, part) for scene in scenes],
+        )
+        self.conn.commit()
+
+    def results(self, sensor, tile_dict, start_time=None, end_time=None):
+        """
+        function to load the saved results of the tiles' point sets
+        in: tile_dict, {"tile1":[(lat1,lon1),(lat2,lon2),...], ...}
+            start_time, end_time, YYYYMMDD, dates outside are left out,
+            None for no limit
+        out: ResultStore with all saved parts merged, None if there is none
+        """
+        merged = None
+        for tile, points in tile_dict.items():
+            if tile is None or len(points) == 0:
+                continue
+            found = self.conn.execute(
+                "SELECT DISTINCT part FROM units WHERE sensor = ? AND tile = ? "
+                "AND points = ? AND part IS NOT NULL",
+                (sensor, tile, self._hash(points)),
+            )
+            for (part,) in found:
+                store = window(
+                    ResultStore.load(os.path.join(self.part_path, part)),
+                    start_time,
+                    end_time,
+                )
+                if merged is None:
+                    merged = store
+                else:
+                    merged.merge(store)
+        return merged
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,95 @@
+"""
+cloud mask pre-pass over all scenes of a tile
+
+The extractors used to open and read the six band files of a scene right
+after its cloud mask, scene by scene, and cloudy scenes cost the mask read
+plus the wait for the next one. mask_prepass() reads the masks of all scenes
+of a tile first, in a thread pool, and keeps the clear points of every scene
+in a ClearBitmap, one bit per (scene, point). Band files are only read for
+scenes with clear points, and only at the clear points, so blocks without
+any clear point are never read, see geo_functions.read_points_by_block().
+"""
+import numpy
+from osgeo import gdal
+from concurrent.futures import ThreadPoolExecutor
+import extractor_functions.geo_functions as geo_functions
+
+# threads reading cloud masks of a tile at the same time
+MASK_WORKERS = 4
+
+
+class ClearBitmap(object):
+    def __init__(self, n_scenes, n_points):
+        """
+        clear flags of (scene, point), 8 points per byte
+        in: n_scenes, n_points, points are positions in the tile's point list
+        """
+        self.n_points = n_points
+        self.bits = numpy.zeros((n_scenes, (n_points + 7) // 8), dtype=numpy.uint8)
+
+    def set(self, scene, positions):
+        """
+        function to set the clear points of a scene
+        in: positions, int array of positions in the tile's point list
+        """
+        flags = numpy.zeros(self.n_points, dtype=bool)
+        flags[positions] = True
+        self.bits[scene] = numpy.packbits(flags)
+
+    def clear(self, scene):
+        """
+        function to get clear flags of all points of a scene
+        out: (point,) bool
+        """
+        return numpy.unpackbits(self.bits[scene], count=self.n_points).astype(bool)
+
+    def counts(self):
+        """
+        function to count clear points of every scene
+        out: (scene,) int
+        """
+        return numpy.unpackbits(self.bits, axis=1).sum(axis=1)
+
+
+def mask_prepass(mask_files, scene_geometry, clear_values, workers=MASK_WORKERS):
+    """
+    function to read the cloud masks of all scenes of a tile
+    in: mask_files, cloud mask file of every scene
+        scene_geometry, scene_cache.SceneGeometryCache of the tile's points
+        clear_values, mask values of clear pixels, e.g. pixel_qa 66, 130, ...
+    out: ClearBitmap of the scenes
+         geometry key of every scene, see SceneGeometryCache.located(),
+         None where the mask could not be read
+    """
+    bitmap = ClearBitmap(len(mask_files), len(scene_geometry.coord))
+    keys = [None] * len(mask_files)
+
+    def read_mask(scene):
+        try:
+            mask = gdal.Open(mask_files[scene])
+            key = scene_geometry.key(mask)
+            px, py, positions = scene_geometry.locate(mask)
+            values = geo_functions.get_band_value_block_vector(
+                mask, px, py, 1, cloud=True
+            )
+            del (mask)
+        except Exception as e:
+            print(e)
+            print("Unable to read cloud mask " + str(mask_files[scene]) + "\n")
+            return
+        bitmap.set(scene, positions[numpy.isin(values, clear_values)])
+        keys[scene] = key
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(read_mask, range(len(mask_files))))
+    return bitmap, keys
+
+
+def clear_points(bitmap, keys, scene_geometry, scene):
+    """
+    function to get the image location of the clear points of a scene
+    out: px, py of clear points and their position in the tile's point list
+    """
+    px, py, positions = scene_geometry.located(keys[scene])
+    clear = bitmap.clear(scene)[positions]
+    return px[clear], py[clear], positions[clear]
@@ -0,0 +1,199 @@
+"""
+join of the results of all sources on one point index
+
+Every source (landsat, sentinel, MODIS, TRMM/GPM) returns a ResultStore with
+its own points, scene dates and bands. Ensemble folds them into one array
+    values: (point, date, band) float32, nan where a band has no observation
+with
+    ids:   (point,) int64 point ids, sorted, the union of all sources
+    dates: (date,) YYYYMMDD, sorted, the union of all sources
+    bands: band names of all sources, in the order sources were added
+A source is joined as soon as it is added, as a block of the band axis, so
+only the joined arrays are kept, not the outputs of every source. Points a
+source has no data for stay nan in its bands. Observations of a point on the
+same date and band are averaged, within a store (duplicated scenes,
+overlapping tiles) and across stores (parts of a source, sources sharing a
+band), the join keeps their sums and counts and averages when it is read.
+Points and dates are appended in the order they come and the arrays grow by
+doubling, like ResultStore, ids and dates are sorted when the join is read.
+
+    ens = Ensemble()
+    ens.add(landsat_out)       # as each source finishes
+    ens.add(modis_out)
+    ens.write(writer)          # chunks of the joined store, or ens.store()
+"""
+import numpy
+from extractor_functions.result_store import ResultStore
+
+
+def collapse_dates(store):
+    """
+    function to sum the observations of a point on the same date
+    in: store, ResultStore
+    out: ids, (point,) int64 of points with data
+         dates, (date,) unique YYYYMMDD, sorted
+         sums, (point, date, band) float32, sum of observed values
+         counts, (point, date, band) uint16, number of observed values
+    """
+    observed = numpy.flatnonzero(store.valid.any(axis=1))
+    ids = store.point_keys[observed]
+    values = store.values[observed]
+    valid = store.valid[observed][:, :, None] & ~numpy.isnan(values)
+    dates, inverse = numpy.unique(store.dates, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    shape = (ids.shape[0], dates.shape[0], len(store.band_keys))
+    sums = numpy.zeros(shape, dtype=numpy.float32)
+    counts = numpy.zeros(shape, dtype=numpy.uint16)
+    numpy.add.at(sums, (slice(None), inverse), numpy.where(valid, values, 0))
+    numpy.add.at(counts, (slice(None), inverse), valid)
+    return ids, dates, sums, counts
+
+
+class Ensemble(object):
+    def __init__(self, capacity=16):
+        """
+        in: capacity, initial length of the point and date axes
+        """
+        self._ids = []
+        self._row = {}
+        self._dates = []
+        self._col = {}
+        self.band_keys = []
+        self.decimals = 0
+        self._sums = numpy.zeros((capacity, capacity, 0), dtype=numpy.float32)
+        self._counts = numpy.zeros((capacity, capacity, 0), dtype=numpy.uint16)
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ids(self):
+        """
+        (point,) int64 point ids, sorted
+        """
+        return numpy.sort(numpy.array(self._ids, dtype=numpy.int64))
+
+    @property
+    def dates(self):
+        """
+        (date,) YYYYMMDD, sorted
+        """
+        return numpy.sort(numpy.array(self._dates, dtype="<U8"))
+
+    def _reserve(self, n_points, n_dates, n_bands):
+        """
+        function to grow the arrays to hold at least n_points x n_dates x n_bands,
+        every axis grows by doubling
+        """
+        capacity = self._sums.shape
+        needed = (n_points, n_dates, n_bands)
+        if all(n <= c for n, c in zip(needed, capacity)):
+            return
+        capacity = tuple(
+            max(n, 2 * c) if n > c else c for n, c in zip(needed, capacity)
+        )
+        used = numpy.s_[: len(self._ids), : len(self._dates), : len(self.band_keys)]
+        sums = numpy.zeros(capacity, dtype=numpy.float32)
+        sums[used] = self._sums[used]
+        counts = numpy.zeros(capacity, dtype=numpy.uint16)
+        counts[used] = self._counts[used]
+        self._sums, self._counts = sums, counts
+
+    def add(self, store):
+        """
+        function to join the results of a source,
+        a source may be added in parts, e.g. per finished task
+        in: store, ResultStore of a source, None or empty is skipped
+        """
+        if not isinstance(store, ResultStore) or len(store) == 0:
+            return self
+        ids, dates, sums, counts = collapse_dates(store)
+        new_ids = [key for key in ids.tolist() if key not in self._row]
+        new_dates = [date for date in dates.tolist() if date not in self._col]
+        new_bands = [key for key in store.band_keys if key not in self.band_keys]
+        self._reserve(
+            len(self._ids) + len(new_ids),
+            len(self._dates) + len(new_dates),
+            len(self.band_keys) + len(new_bands),
+        )
+        for key in new_ids:
+            self._row[key] = len(self._ids)
+            self._ids.append(key)
+        for date in new_dates:
+            self._col[date] = len(self._dates)
+            self._dates.append(date)
+        self.band_keys += new_bands
+        self.decimals = max(self.decimals, store.decimals)
+
+        index = numpy.ix_(
+            numpy.array([self._row[key] for key in ids.tolist()], dtype=numpy.int64),
+            numpy.array([self._col[date] for date in dates.tolist()], dtype=int),
+            numpy.array([self.band_keys.index(key) for key in store.band_keys]),
+        )
+        self._sums[index] += sums
+        self._counts[index] += counts
+        return self
+
+    def take(self, ids):
+        """
+        function to copy the joined rows of given points into a ResultStore,
+        dates are the scene axis, unknown ids are skipped
+        """
+        ids = numpy.unique(numpy.asarray(ids, dtype=numpy.int64).reshape(-1))
+        ids = [key for key in ids.tolist() if key in self._row]
+        rows = numpy.array([self._row[key] for key in ids], dtype=numpy.int64)
+        dates = numpy.array(self._dates, dtype="<U8")
+        cols = numpy.argsort(dates, kind="stable")
+        bands = numpy.arange(len(self.band_keys))
+        index = numpy.ix_(rows, cols, bands)
+        counts = self._counts[index]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            values = self._sums[index] / counts
+        return ResultStore.from_arrays(
+            ids,
+            self.band_keys,
+            self.decimals,
+            dates[cols],
+            values,
+            (counts != 0).any(axis=2),
+        )
+
+    def drop(self, ids):
+        """
+        function to remove the rows of given points, unknown ids are skipped,
+        the last rows are moved into the freed ones
+        """
+        dropped = set(self._row.pop(key) for key in ids if key in self._row)
+        if len(dropped) == 0:
+            return self
+        n_rows = len(self._ids)
+        n_keep = n_rows - len(dropped)
+        holes = [row for row in sorted(dropped) if row < n_keep]
+        moved = [row for row in range(n_keep, n_rows) if row not in dropped]
+        self._sums[holes] = self._sums[moved]
+        self._counts[holes] = self._counts[moved]
+        for hole, row in zip(holes, moved):
+            self._ids[hole] = self._ids[row]
+            self._row[self._ids[hole]] = hole
+        del self._ids[n_keep:]
+        # rows appended later start from zero
+        self._sums[n_keep:n_rows] = 0
+        self._counts[n_keep:n_rows] = 0
+        return self
+
+    def store(self):
+        """
+        function to get the whole join as a ResultStore
+        """
+        return self.take(self._ids)
+
+    def write(self, writer):
+        """
+        function to hand the join to a result_writer.ChunkWriter
+        one chunk of points at a time and close it
+        """
+        ids = self.ids
+        for i in range(0, len(self), writer.chunk):
+            writer.add(self.take(ids[i:i + writer.chunk]))  # noqa : E203
+        writer.close()
@@ -2,6 +2,7 @@
 from osgeo import osr
 import numpy as np
 from osgeo import gdal
+from extractor_functions import point_registry
 
 
 def getSRSPair(dataset):
@@ -223,6 +224,111 @@ def get_band_value_fetch_vector(bandraster, pxy, dataType, cloud=False):
     return {bandraster[0]: value}
 
 
+# fraction of raster blocks touched by the points above which the whole
+# raster is read in one call instead of block by block
+FULL_READ_FRACTION = 0.5
+
+
+def get_block_size(bandraster):
+    """
+    function to get the block structure of a raster, e.g. 640x640 for
+    sentinel jp2, one or a few lines for landsat img/tif
+    in: bandraster, raster band file or gdal dataset
+    out: (block_x, block_y)
+    """
+    if isinstance(bandraster, str):
+        bandraster = gdal.Open(bandraster)
+    block_x, block_y = bandraster.GetRasterBand(1).GetBlockSize()
+    return int(block_x), int(block_y)
+
+
+def sort_by_block(px, py, block_size, *arrays):
+    """
+    function to sort locations into raster storage order:
+    row of blocks, block in the row, then y and x inside the block
+    in: px, py, int arrays of x, y in image
+        block_size, (block_x, block_y), see get_block_size()
+        arrays, any arrays of the same length reordered the same way
+    out: px, py and arrays, sorted
+    """
+    px = np.asarray(px, dtype=np.int64)
+    py = np.asarray(py, dtype=np.int64)
+    block_x, block_y = block_size
+    # lexsort sorts by the last key first
+    order = np.lexsort((px, py, px // block_x, py // block_y))
+    return (px[order], py[order]) + tuple(np.asarray(a)[order] for a in arrays)
+
+
+def read_points_by_block(bandraster, px, py, full_read=True):
+    """
+    function to read raster values at many locations, every raster block
+    touched by the points is read only once
+    in: bandraster, raster band file or gdal dataset
+        px, int array of x in image
+        py, int array of y in image
+        full_read, allow reading the whole raster when most blocks are touched,
+                   turn off for rasters too large for memory, e.g. CDL
+    out: an array of raw raster value, same order as px, py
+    """
+    if isinstance(bandraster, str):
+        bandraster = gdal.Open(bandraster)
+    band = bandraster.GetRasterBand(1)
+    px = np.asarray(px, dtype=np.int64)
+    py = np.asarray(py, dtype=np.int64)
+    result = np.zeros(shape=px.shape, dtype=np.float64)
+    if px.shape[0] == 0:
+        return result
+
+    xsize, ysize = band.XSize, band.YSize
+    block_x, block_y = band.GetBlockSize()
+    nbx = (xsize + block_x - 1) // block_x
+    nby = (ysize + block_y - 1) // block_y
+
+    # blocks are numbered in storage order, row of blocks first
+    block_id = (py // block_y) * nbx + px // block_x
+    blocks, inverse = np.unique(block_id, return_inverse=True)
+
+    if full_read and blocks.shape[0] >= FULL_READ_FRACTION * nbx * nby:
+        result[:] = band.ReadAsArray()[py, px]
+        return result
+
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(blocks.shape[0] + 1))
+    for i, block in enumerate(blocks):
+        index = order[bounds[i]:bounds[i + 1]]  # noqa : E203
+        x0 = int(block % nbx) * block_x
+        y0 = int(block // nbx) * block_y
+        window = band.ReadAsArray(
+            x0, y0, min(block_x, xsize - x0), min(block_y, ysize - y0)
+        )
+        result[index] = window[py[index] - y0, px[index] - x0]
+    return result
+
+
+def get_band_value_block_vector(bandraster, px, py, dataType, cloud=False):
+    """
+    function to get band raster value of many locations by reading
+    the raster block by block, see read_points_by_block()
+    in: bandraster, raster band file or gdal dataset
+        px, x in image
+        py, y in image
+        dataType, which satellite data
+        cloud, cloud masking
+    out: an array of value
+    """
+    result = read_points_by_block(bandraster, px, py)
+    if cloud:
+        value = np.around(result, decimals=4)
+    else:
+        if dataType in [1, 2]:
+            value = np.around(result * 0.0001, decimals=4)
+        elif dataType == 3:
+            value = np.around(result * 0.02, decimals=4)
+        else:
+            value = np.zeros(result.shape) - 1.0
+    return value
+
+
 def get_band_value_fetch_pool_vector(bandraster, pxy, dataType, cloud=False):
     """
     function to get raster band value given a location
@@ -245,12 +351,15 @@ def get_band_value_fetch_pool_vector(bandraster, pxy, dataType, cloud=False):
     return value
 
 
-def point_boundary_is_valid_vector(xsize, ysize, coord, trans, ct):
+def point_boundary_index_vector(xsize, ysize, coord, trans, ct):
     """
-    vectoerized version of funciton point_boundary_is_valid()
+    function to get image x, y of points inside the image
+    in: xsize, ysize, raster size
+        coord, list of tuple [(lat1,lon1),(lat2,lon2),...]
+        trans, gdal geo transform
+        ct, coordinates transformation reference
+    out: px, py, and the position of these points in coord
     """
-    res_key = get_latlon_key_vector(coord)
-
     # we need coord in (lon,lat)
     coord = [c[::-1] for c in coord]
 
@@ -263,11 +372,17 @@ def point_boundary_is_valid_vector(xsize, ysize, coord, trans, ct):
     index = np.logical_and(
         np.logical_and(px > 0, px < xsize), np.logical_and(py > 0, py < ysize)
     )
-    px = px[index]
-    py = py[index]
-    res_key = res_key[index]
+    return px[index], py[index], np.flatnonzero(index)
+
+
+def point_boundary_is_valid_vector(xsize, ysize, coord, trans, ct):
+    """
+    vectoerized version of funciton point_boundary_is_valid()
+    """
+    res_key = get_latlon_key_vector(coord)
+    px, py, index = point_boundary_index_vector(xsize, ysize, coord, trans, ct)
 
-    return px, py, res_key
+    return px, py, res_key[index]
 
 
 def point_boundary_is_valid(xsize, ysize, lat, lon, trans, ct):
@@ -294,16 +409,16 @@ def point_boundary_is_valid(xsize, ysize, lat, lon, trans, ct):
 def get_latlon_key_vector(coord):
     """
     vectorized version of function get_latlon_key()
+    in: coord, [(lat1,lon1),(lat2,lon2),...]
+    out: (point,) int64 point ids, see point_registry.py
     """
-    res_key = ["{:.6f}".format(cc[0]) + "," + "{:.6f}".format(cc[1]) for cc in coord]
-    return np.array(res_key)
+    return point_registry.point_ids(coord)
 
 
 def get_latlon_key(lat, lon):
     """
-    根据经纬度获取结果字典key
+    根据经纬度获取结果字典key, 即点的整数id, see point_registry.py
     :param lat: 纬度
     :param lon: 经度
     """
-    res_key = "{:.6f}".format(lat) + "," + "{:.6f}".format(lon)
-    return res_key
+    return int(point_registry.point_ids([(lat, lon)])[0])
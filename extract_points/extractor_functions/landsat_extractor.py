@@ -2,10 +2,13 @@
 import sys
 import os
 import pprint
-from osgeo import gdal
 from os.path import join
 import extractor_functions.settings as settings
 import extractor_functions.geo_functions as geo_functions
+from extractor_functions.result_store import ResultStore
+import extractor_functions.scene_catalog as scene_catalog
+from extractor_functions.scene_cache import SceneGeometryCache
+import extractor_functions.cloud_prepass as cloud_prepass
 import gc
 import time
 import numpy
@@ -16,6 +19,9 @@ sys.path.append(join(os.path.dirname(os.path.realpath(__file__)), ".."))
 printer = pprint.PrettyPrinter(indent=3)
 home_dir = os.path.expanduser("~")
 
+# threads reading the band files of a scene at the same time
+BAND_WORKERS = 6
+
 
 bandNum = len(settings.L_band_key_list)
 LT57_band_dict = {
@@ -26,13 +32,15 @@ LT8_band_dict = {
 }
 
 
-def get_file_list(path_rows, start_time, end_time, source_list):
+def get_file_list(path_rows, start_time, end_time, source_list, sources=None):
     """
     function to search data source files with in given time period, given tile id
     in:
       tile id
       start and end time with format YYYYMMDD
-      lists of data source files
+      data source files, a scene catalog file or a list of files,
+      see scene_catalog.as_catalog()
+      sources, optional dict filled with {file path: catalog entry}
     out:
       dicitonary with tile id as key and data source file corresponding
       to that tile as value
@@ -40,16 +48,17 @@ def get_file_list(path_rows, start_time, end_time, source_list):
          {"tile1":[filepath1, filepath2,...]
           "tile2":[filepath1, filepath2,...]}
     """
-    assert isinstance(source_list, list)
+    catalog = scene_catalog.as_catalog(source_list, "landsat")
     tar_list = {}
     for (path, row) in path_rows:
-        tmp_path = "/{}/{}".format(path.zfill(3), row.zfill(3))
-        file_folds = [tmp for tmp in source_list if tmp_path in tmp]
-        file_list = []
-        for file_folder in file_folds:
-            file_date = file_folder.split("_")[-4]
-            if start_time <= file_date <= end_time:
-                file_list.append(os.path.join(home_dir, file_folder.strip("./")))
+        tmp_path = path.zfill(3) + "-" + row.zfill(3)
+        file_folds = catalog.query("landsat", tmp_path, start_time, end_time)
+        file_list = [
+            os.path.join(home_dir, file_folder.strip("./"))
+            for file_folder in file_folds
+        ]
+        if sources is not None:
+            sources.update(zip(file_list, file_folds))
 
         key = path + "-" + row
         tar_list.setdefault(key, []).extend(file_list)
@@ -57,7 +66,7 @@ def get_file_list(path_rows, start_time, end_time, source_list):
     return tar_list
 
 
-def extract_landsat_SR(tile_dict, start_time, end_time, data_source):
+def extract_landsat_SR(tile_dict, start_time, end_time, data_source, read_threads=None):
     """
     function to extract landsat surface reflectance time series
     in:
@@ -65,18 +74,17 @@ def extract_landsat_SR(tile_dict, start_time, end_time, data_source):
                                     "tile2":[(lat1,lon1),(lat2,lon2),...]
                                     }
       start time and end time in format YYYYMMDD
-      source data path in a list
-
-    out: dictionary of time series, with points lat lon location as key
-         {"34.888199,-92,000100":{{"S_R_band":[("20140401",0.1),("20140402",0.3),...]}
-                                  {"S_G_band":[("20140401",0.1),("20140402",0.2),...]}
-                                  ...
-                                  }
-
-          "35.901119,-91.000211":{{"S_R_band":[("20140401",0.1),("20140402",0.3),...]}
-                                  {"S_G_band":[("20140401",0.1),("20140402",0.2),...]}
-                                  ...
-                                  }
+      source data path in a list, or a scene catalog file
+      read_threads, files of a tile read at the same time, default
+                    cloud_prepass.MASK_WORKERS masks and BAND_WORKERS bands
+
+    out: ResultStore of the time series, keyed by int64 point id, see
+         point_registry.py, a Mapping of records in the old dict format
+         {point id:{"L_R_band":[("20140401",0.1),("20140402",0.3),...],
+                    "L_G_band":[("20140401",0.1),("20140402",0.2),...],
+                    ...
+                    },
+          point id:{...},
           ....
           }
 
@@ -97,11 +105,9 @@ def extract_landsat_SR(tile_dict, start_time, end_time, data_source):
         else:
             continue
 
-    # Results dict
-    landsat_ref_res = {}
-
     # get file list given tile and time period
-    tar_list = get_file_list(path_rows, start_time, end_time, data_source)
+    sources = {}
+    tar_list = get_file_list(path_rows, start_time, end_time, data_source, sources)
 
     if len(tar_list.items()) == 0:
         # raise Exception("There is no suitable files")
@@ -109,6 +115,16 @@ def extract_landsat_SR(tile_dict, start_time, end_time, data_source):
     else:
         pass
 
+    # Results store, one row for each point of all tiles
+    landsat_ref_res = ResultStore(
+        geo_functions.get_latlon_key_vector(
+            [pt for pr_key in tar_list.keys() for pt in tile_dict[pr_key]]
+        ).tolist(),
+        settings.L_band_key_list,
+    )
+
+    band_workers = BAND_WORKERS if read_threads is None else read_threads
+
     # starting loop tile
     tile_count = 0
     for pr_key in tar_list.keys():
@@ -129,20 +145,18 @@ def extract_landsat_SR(tile_dict, start_time, end_time, data_source):
         tile_count += 1
         # get file list given tile
         img_folders = tar_list[pr_key]
+        tile_rows = landsat_ref_res.rows(
+            geo_functions.get_latlon_key_vector(tile_dict[pr_key]).tolist()
+        )
+        scene_geometry = SceneGeometryCache(tile_dict[pr_key])
 
         if len(img_folders) == 0:
             return
         else:
             pass
 
-        # base on number of points in tile chose extracting method
-        num_point_in_tile = len(tile_dict[pr_key])
-        if num_point_in_tile <= 5000:
-            fetch = True
-        else:
-            fetch = False
-
-        # starting loop files(time axis)
+        # band files and cloud mask of every scene (time axis)
+        scenes = []
         for folder_path in img_folders:
             file_date = folder_path.split("_")[-4]
 
@@ -170,151 +184,98 @@ def extract_landsat_SR(tile_dict, start_time, end_time, data_source):
                         File_Path[band_type] = tmp_file.replace(".img", ".tif")
             else:
                 print("satellite type error!")
+                landsat_ref_res.failed_scenes.append(sources[folder_path])
                 continue
 
-            # get cloud mask data
-            try:
-                qc_path = join(
-                    folder_path, folder_path.split("/")[-1] + "_pixel_qa.img"
-                )
-                if os.path.isfile(qc_path):
-                    cloudmask_file = qc_path
-                elif os.path.isfile(qc_path.replace(".img", ".tif")):
-                    cloudmask_file = qc_path.replace(".img", ".tif")
-            except Exception as e:
-                print(e)
+            # get cloud mask file
+            qc_path = join(folder_path, folder_path.split("/")[-1] + "_pixel_qa.img")
+            if os.path.isfile(qc_path):
+                cloudmask_file = qc_path
+            elif os.path.isfile(qc_path.replace(".img", ".tif")):
+                cloudmask_file = qc_path.replace(".img", ".tif")
+            else:
                 print("Unable to open QC file\n")
+                landsat_ref_res.failed_scenes.append(sources[folder_path])
                 continue
+            scenes.append((folder_path, file_date, File_Path, cloudmask_file))
+
+        # cloud masks of all scenes first, points that satisfy the cloud
+        # criteria are kept in a bitmap, bands are only read for scenes with
+        # clear points, and only at these points
+        true_cloud = numpy.array([66, 130, 322, 386, 834, 898, 1346])
+        clear_bitmap, scene_keys = cloud_prepass.mask_prepass(
+            [scene[3] for scene in scenes],
+            scene_geometry,
+            true_cloud,
+            cloud_prepass.MASK_WORKERS if read_threads is None else read_threads,
+        )
+        n_clear = clear_bitmap.counts()
+        print(
+            "Tile %s, %d out of %d scenes with clear points"
+            % (pr_key, numpy.count_nonzero(n_clear), len(scenes))
+        )
 
-            # Get geo info from cloud mask img
-            if fetch:
-                cloudmask = gdal.Open(cloudmask_file)
-                geo_ct = geo_functions.getSRSPair(cloudmask)
-                geo_tran = cloudmask.GetGeoTransform()
-                XSize = cloudmask.RasterXSize
-                YSize = cloudmask.RasterYSize
-            else:
-                cloudmask = gdal.Open(cloudmask_file)
-                geo_ct = geo_functions.getSRSPair(cloudmask)
-                geo_tran = cloudmask.GetGeoTransform()
-                XSize = cloudmask.RasterXSize
-                YSize = cloudmask.RasterYSize
-                cloudmask_raster = cloudmask.GetRasterBand(1).ReadAsArray()
-
-            # store all location index and dict key
-            px_array, py_array, res_key_array = geo_functions.point_boundary_is_valid_vector(  # noqa: E501
-                XSize, YSize, tile_dict[pr_key], geo_tran, geo_ct
+        for scene, (folder_path, file_date, File_Path, _) in enumerate(scenes):
+            if scene_keys[scene] is None:
+                # cloud mask could not be read
+                landsat_ref_res.failed_scenes.append(sources[folder_path])
+                continue
+            if n_clear[scene] == 0:
+                continue
+            px_array, py_array, row_array = cloud_prepass.clear_points(
+                clear_bitmap, scene_keys, scene_geometry, scene
             )
-
-            if fetch:
-                # get all cloud value
-                cloudmask_data = geo_functions.get_band_value_fetch_vector1(
-                    cloudmask_file, zip(px_array, py_array), 1, cloud=True
-                )
-            else:
-                cloudmask_data = geo_functions.get_band_value_vector(
-                    cloudmask_raster, px_array, py_array, 1, cloud=True
-                )
-
-            # filter out location points not satisfy cloud criteria
-            true_cloud = numpy.array([66, 130, 322, 386, 834, 898, 1346])
-            index = numpy.nonzero(numpy.in1d(numpy.array(cloudmask_data), true_cloud))
-            py_array = py_array[index[0]]
-            px_array = px_array[index[0]]
-            res_key_array = res_key_array[index[0]]
-
-            # sort py, landsat store data in strip
-            # NOTE how to read data strongly depend on how the data is stored
-            sort_index = py_array.argsort()
-            py_array = py_array[sort_index]
-            px_array = px_array[sort_index]
-            res_key_array = res_key_array[sort_index]
+            row_array = tile_rows[row_array]
 
             # claim return value dictionary and get band reflectance value
             band_data = {band_type: [] for band_type in settings.L_band_key_list}
-            if fetch:
-                try:
-                    file_pair = [
-                        (band_type, File_Path[band_type])
-                        for band_type in settings.L_band_key_list
-                    ]
-                    pxy = list(zip(px_array, py_array))
-                    p_func = functools.partial(
-                        geo_functions.get_band_value_fetch_vector, pxy=pxy, dataType=1
-                    )
-
-                    with ThreadPoolExecutor(max_workers=6) as executor:
-                        future = executor.map(p_func, file_pair)
-                    returned = list(future)
-                    for rr in returned:
-                        band_type, ref_value = (
-                            list(rr.keys())[0],
-                            numpy.array(list(rr.values())[0]),
-                        )
-                        ref_value[
-                            numpy.logical_or(ref_value < 0.0, ref_value > 1.0)
-                        ] = -1.0
-                        band_data[band_type] = ref_value
-                except Exception as e:
-                    print(e)
-                    print("Unable to get " + band_type + " data\n")
-                    continue
-                del (returned)
-            else:
-                for band_type in settings.L_band_key_list:
-                    try:
-                        bandfiles = gdal.Open(File_Path[band_type])
-                        bandrasters = bandfiles.GetRasterBand(1).ReadAsArray()
-                    except Exception as e:
-                        print(e)
-                        print("Unable to open " + band_type + " file\n")
-                        continue
-                    try:
-                        ref_value = geo_functions.get_band_value_vector(
-                            bandrasters, px_array, py_array, 1
+            try:
+                # read in the storage order of the band files, landsat uses strips
+                # NOTE how to read data strongly depend on how the data is stored
+                block_size = geo_functions.get_block_size(
+                    File_Path[settings.L_band_key_list[0]]
+                )
+                px_array, py_array, row_array = geo_functions.sort_by_block(
+                    px_array, py_array, block_size, row_array
+                )
+                p_func = functools.partial(
+                    geo_functions.get_band_value_block_vector,
+                    px=px_array,
+                    py=py_array,
+                    dataType=1,
+                )
+                with ThreadPoolExecutor(max_workers=band_workers) as executor:
+                    returned = list(
+                        executor.map(
+                            p_func,
+                            [
+                                File_Path[band_type]
+                                for band_type in settings.L_band_key_list
+                            ],
                         )
-                        ref_value[
-                            numpy.logical_or(ref_value < 0.0, ref_value > 1.0)
-                        ] = -1.0
-                        band_data[band_type] = ref_value
-                    except Exception:
-                        print("Unable to get " + band_type + " data\n")
-                        continue
-
-                    del (bandfiles)
-                    del (bandrasters)
-                    gc.collect()
-
-            if not fetch:
-                del (cloudmask_raster)
-            # Add to results, key and band data has to be 1-1 match
-            for i, res_key in enumerate(res_key_array):
-                if res_key in landsat_ref_res.keys():
-                    landsat_ref_record = landsat_ref_res[res_key]
-                    for band_type in settings.L_band_key_list:
-                        try:
-                            landsat_ref_record[band_type].append(
-                                (file_date, float(band_data[band_type][i]))
-                            )
-                        except Exception as e:
-                            print(e)
-                            pass
-                else:
-                    try:
-                        landsat_ref_record = {}
-                        for band_type in settings.L_band_key_list:
-                            landsat_ref_record[band_type] = [
-                                (file_date, float(band_data[band_type][i]))
-                            ]
-                        landsat_ref_res[res_key] = landsat_ref_record
-                    except Exception as e:
-                        print(e)
-                        pass
+                    )
+                for band_type, ref_value in zip(settings.L_band_key_list, returned):
+                    ref_value[
+                        numpy.logical_or(ref_value < 0.0, ref_value > 1.0)
+                    ] = -1.0
+                    band_data[band_type] = ref_value
+            except Exception as e:
+                print(e)
+                print("Unable to get band data of " + folder_path + "\n")
+                landsat_ref_res.failed_scenes.append(sources[folder_path])
+                continue
+            del (returned)
+            gc.collect()
+
+            # Add to results, rows and band data has to be 1-1 match
+            landsat_ref_res.write_scene(
+                file_date,
+                row_array,
+                numpy.column_stack(
+                    [band_data[band_type] for band_type in settings.L_band_key_list]
+                ),
+            )
 
         print("Tile %s, takes Time %f" % (pr_key, time.time() - tic))
-    # Sort the resuls by date
-    for _, landsat_ref_record in landsat_ref_res.items():
-        for band_type in settings.L_band_key_list:
-            landsat_ref_record[band_type].sort()
 
     return landsat_ref_res
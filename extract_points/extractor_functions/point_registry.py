@@ -0,0 +1,226 @@
+"""
+registry of sample points, dense integer ids instead of "lat,lon" keys
+
+Points used to be keyed by their coordinates formatted as "{:.6f},{:.6f}",
+every extractor formatted and hashed these strings again, and they were
+carried to the output files as string arrays. The sampler now registers
+every point once and gives it an int64 id:
+
+    registry = PointRegistry.load(".../point_registry.npz")  # or PointRegistry()
+    ids = registry.register(points)   # new points get the next free ids
+    registry.save(".../point_registry.npz")
+
+Points are the same point when they agree to 6 decimals, like the old keys.
+The registry file is shared by all sampling runs, so ids are unique over
+years and crop types. Sample files carry the table of their own points, the
+extractor makes it the registry of the process (before the pool is started,
+so workers inherit it) and extracted files only store ids, with the table
+saved once per dataset, see result_writer.ChunkWriter. Only the process that
+loads the points registers them, point_ids() only looks ids up and raises for
+unknown points, ids made up in a worker would collide with other workers'.
+
+FILE CONVENTION, for the registry and the point tables:
+    ids: (point,) int64
+    lat, lon: (point,) float64
+"""
+import os
+import numpy
+
+# file name of the global registry in the sample point folder
+REGISTRY_FILE = "point_registry.npz"
+
+# coordinates are compared at 6 decimals, the precision of the old keys
+SCALE = 10 ** 6
+LON_SPAN = 360 * SCALE + 1
+
+# registry of this process, see set_registry()
+_registry = None
+
+
+def coord_codes(coord):
+    """
+    function to pack coordinates into one int64 per point
+    in: coord, [(lat1,lon1),(lat2,lon2),...] or (point, 2) array
+    out: (point,) int64, equal for points equal at 6 decimals
+    """
+    coord = numpy.asarray(coord, dtype=numpy.float64).reshape(-1, 2)
+    lat = numpy.rint((coord[:, 0] + 90) * SCALE).astype(numpy.int64)
+    lon = numpy.rint((coord[:, 1] + 180) * SCALE).astype(numpy.int64)
+    return lat * LON_SPAN + lon
+
+
+class PointRegistry(object):
+    def __init__(self, ids=(), lat=(), lon=()):
+        """
+        in: ids, lat, lon, table of registered points, see table()
+        """
+        self.ids = numpy.asarray(ids, dtype=numpy.int64).reshape(-1)
+        self.lat = numpy.asarray(lat, dtype=numpy.float64).reshape(-1)
+        self.lon = numpy.asarray(lon, dtype=numpy.float64).reshape(-1)
+        self._index()
+
+    def _index(self):
+        codes = coord_codes(numpy.column_stack((self.lat, self.lon)))
+        order = numpy.argsort(codes, kind="stable")
+        self._codes = codes[order]
+        self._code_ids = self.ids[order]
+        id_order = numpy.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[id_order]
+        self._id_rows = id_order
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @property
+    def next_id(self):
+        return int(self.ids.max()) + 1 if len(self) else 0
+
+    def lookup(self, coord):
+        """
+        function to get the ids of points
+        in: coord, [(lat1,lon1),(lat2,lon2),...]
+        out: (point,) int64, -1 for points not registered
+        """
+        codes = coord_codes(coord)
+        found = numpy.full(codes.shape[0], -1, dtype=numpy.int64)
+        if len(self) == 0:
+            return found
+        pos = numpy.searchsorted(self._codes, codes)
+        pos[pos == len(self)] = 0
+        hit = self._codes[pos] == codes
+        found[hit] = self._code_ids[pos[hit]]
+        return found
+
+    def register(self, coord):
+        """
+        function to get the ids of points, new points are added
+        with the next free ids, in the order they first appear
+        in: coord, [(lat1,lon1),(lat2,lon2),...]
+        out: (point,) int64
+        """
+        coord = numpy.asarray(coord, dtype=numpy.float64).reshape(-1, 2)
+        ids = self.lookup(coord)
+        new = numpy.flatnonzero(ids < 0)
+        if new.shape[0] == 0:
+            return ids
+        codes, first, inverse = numpy.unique(
+            coord_codes(coord[new]), return_index=True, return_inverse=True
+        )
+        # ids in order of first appearance, not in code order
+        rank = numpy.empty(codes.shape[0], dtype=numpy.int64)
+        rank[numpy.argsort(first, kind="stable")] = numpy.arange(codes.shape[0])
+        new_ids = self.next_id + rank
+        ids[new] = new_ids[inverse.reshape(-1)]
+
+        added = numpy.sort(first)
+        self.ids = numpy.concatenate((self.ids, numpy.sort(new_ids)))
+        self.lat = numpy.concatenate((self.lat, coord[new[added], 0]))
+        self.lon = numpy.concatenate((self.lon, coord[new[added], 1]))
+        self._index()
+        return ids
+
+    def rows(self, ids):
+        """
+        function to get the table rows of ids, -1 for unknown ids
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64).reshape(-1)
+        found = numpy.full(ids.shape[0], -1, dtype=numpy.int64)
+        if len(self) == 0:
+            return found
+        pos = numpy.searchsorted(self._sorted_ids, ids)
+        pos[pos == len(self)] = 0
+        hit = self._sorted_ids[pos] == ids
+        found[hit] = self._id_rows[pos[hit]]
+        return found
+
+    def subset(self, ids):
+        """
+        function to get the registry of some registered points
+        """
+        rows = self.rows(numpy.unique(numpy.asarray(ids, dtype=numpy.int64)))
+        rows = rows[rows >= 0]
+        return PointRegistry(self.ids[rows], self.lat[rows], self.lon[rows])
+
+    def coords(self, ids):
+        """
+        function to get the coordinates of registered points
+        out: (point, 2) lat, lon, nan for unknown ids
+        """
+        rows = self.rows(ids)
+        out = numpy.full((rows.shape[0], 2), numpy.nan)
+        out[rows >= 0, 0] = self.lat[rows[rows >= 0]]
+        out[rows >= 0, 1] = self.lon[rows[rows >= 0]]
+        return out
+
+    def table(self):
+        return {"ids": self.ids, "lat": self.lat, "lon": self.lon}
+
+    def save(self, file):
+        numpy.savez(file, **self.table())
+
+    @classmethod
+    def load(cls, file):
+        with numpy.load(file) as data:
+            return cls(data["ids"], data["lat"], data["lon"])
+
+
+def set_registry(registry):
+    """
+    function to set the registry of this process
+    """
+    global _registry
+    _registry = registry
+
+
+def get_registry():
+    """
+    function to get the registry of this process,
+    an empty one is started if none was set
+    """
+    global _registry
+    if _registry is None:
+        _registry = PointRegistry()
+    return _registry
+
+
+def point_ids(coord):
+    """
+    function to get the ids of points from the registry of this process,
+    points have to be registered before, see register()
+    in: coord, [(lat1,lon1),(lat2,lon2),...]
+    out: (point,) int64
+    """
+    ids = get_registry().lookup(coord)
+    unknown = numpy.flatnonzero(ids < 0)
+    if unknown.shape[0] != 0:
+        raise ValueError(
+            "%d points are not registered, e.g. %s"
+            % (unknown.shape[0], tuple(numpy.asarray(coord)[unknown[0]].tolist()))
+        )
+    return ids
+
+
+def register_samples(res_dict, registry_file):
+    """
+    function to register the points of a sample file in the global registry
+    and add the table of its points to it, see Extractor.get_latlon()
+    in: res_dict, {"landsat": {"tile1": [(lat1,lon1),...], ...}, ...}
+        registry_file, the global registry, created if it does not exist,
+                       sampling runs must not write it at the same time
+    out: res_dict, with the "points" table added
+    """
+    if os.path.isfile(registry_file):
+        registry = PointRegistry.load(registry_file)
+    else:
+        registry = PointRegistry()
+    # one call, every call with new points indexes the whole registry again
+    coord = [
+        pt
+        for sensor, tile_dict in res_dict.items()
+        if sensor != "points"
+        for points in tile_dict.values()
+        for pt in points
+    ]
+    res_dict["points"] = registry.subset(registry.register(coord)).table()
+    registry.save(registry_file)
+    return res_dict
@@ -0,0 +1,195 @@
+"""
+per year TRMM/GPM cubes with time as the contiguous axis
+
+Daily TRMM/GPM files hold one global grid each, so extracting the time series
+of a few thousand points opens and reads a whole global grid for every day.
+The builder packs the daily files of one year into a memory mapped .npy cube
+of shape (lon, lat, day) float32, one slot per day of the year, so the series
+of one grid cell is a single contiguous read:
+
+    build_cube(gpm_source, "gpm", 2018, cube_path)
+    cube = open_cube(cube_path, "gpm", 2018)
+    cube.series(lon_ind, lat_ind, "20180401", "20180930")
+
+FILE CONVENTION, in cube_path:
+    {sensor}_{year}.npy       (lon, lat, day) float32, nan for no data
+    {sensor}_{year}_grid.npz  lon, lat: grid centers
+                              dates: (day,) YYYYMMDD of every slot
+                              available: (day,) bool, day had a file
+"""
+import os
+import logging
+import netCDF4
+import numpy
+from extractor_functions import scene_catalog
+from extractor_functions import calendar_axis
+
+logger = logging.getLogger(__name__)
+
+# precipitation variable of the daily files
+VARIABLES = {"gpm": "precipitationCal", "trmm": "precipitation"}
+
+# memory of the lon slab of whole year series built before it is written,
+# a GPM lon row is 1800 lat x 366 days float32, about 2.6MB
+SLAB_BYTES = 2 * 1024 ** 3
+
+# default cube folder, relative to home
+CUBE_PATH = "tq-data04/gpm/cube"
+
+
+def cube_file(cube_path, sensor, year):
+    return os.path.join(cube_path, "%s_%s.npy" % (sensor, year))
+
+
+def grid_file(cube_path, sensor, year):
+    return os.path.join(cube_path, "%s_%s_grid.npz" % (sensor, year))
+
+
+def year_dates(year):
+    """
+    function to list all days of a year
+    out: list of YYYYMMDD
+    """
+    return calendar_axis.date_labels("%s0101" % year, "%s1231" % year).tolist()
+
+
+def _home_path(filename):
+    return os.path.join(os.path.expanduser("~"), filename.strip("./ \n"))
+
+
+def build_cube(d_source, sensor, year, cube_path):
+    """
+    function to pack the daily files of one year into a cube
+    in: d_source, list of daily files or a scene catalog file,
+                  see scene_catalog.as_catalog()
+        sensor, "gpm" or "trmm"
+        year, e.g. 2018
+        cube_path, output folder
+    out: path of the cube file, None if there is no file of that year
+    """
+    dates = year_dates(year)
+    catalog = scene_catalog.as_catalog(d_source, sensor)
+    day_files = dict(catalog.query_dates(sensor, "global", dates[0], dates[-1]))
+    if len(day_files) == 0:
+        logger.info("No %s file in year %s" % (sensor, year))
+        return None
+
+    # grid of the first day, all daily files share the grid
+    with netCDF4.Dataset(_home_path(day_files[min(day_files)]), "r") as nc:
+        lon = numpy.array(nc.variables["lon"][:])
+        lat = numpy.array(nc.variables["lat"][:])
+
+    if not os.path.exists(cube_path):
+        os.makedirs(cube_path)
+    out_file = cube_file(cube_path, sensor, year)
+    tmp_file = out_file + ".tmp.npy"
+    shape = (len(lon), len(lat), len(dates))
+    cube = numpy.lib.format.open_memmap(
+        tmp_file, mode="w+", dtype=numpy.float32, shape=shape
+    )
+    available = numpy.array([ts in day_files for ts in dates])
+
+    # whole year series of a slab of lon rows, the slab is one contiguous block
+    # of the cube, so the cube file is written once, front to back
+    slab = max(1, int(SLAB_BYTES // (len(lat) * len(dates) * 4)))
+    for l0 in range(0, len(lon), slab):
+        l1 = min(l0 + slab, len(lon))
+        block = numpy.full(
+            (l1 - l0, len(lat), len(dates)), numpy.nan, dtype=numpy.float32
+        )
+        for i, ts in enumerate(dates):
+            if not available[i]:
+                continue
+            try:
+                with netCDF4.Dataset(_home_path(day_files[ts]), "r") as nc:
+                    day = nc.variables[VARIABLES[sensor]][l0:l1]
+            except Exception as e:
+                logger.info(e)
+                # the day is left out of all slabs
+                available[i] = False
+                continue
+            # (lon, lat) grid, masked cells are stored as nan
+            block[:, :, i] = numpy.ma.filled(day.astype(numpy.float32), numpy.nan)
+        cube[l0:l1] = block
+        del (block)
+        logger.info(
+            "%s %s packed up to lon row %d of %d" % (sensor, year, l1, len(lon))
+        )
+    cube.flush()
+    del cube
+
+    numpy.savez(
+        grid_file(cube_path, sensor, year),
+        lon=lon,
+        lat=lat,
+        dates=numpy.array(dates),
+        available=available,
+    )
+    # the cube only shows up once it is complete
+    os.replace(tmp_file, out_file)
+    return out_file
+
+
+def has_cube(cube_path, sensor, year):
+    return os.path.isfile(cube_file(cube_path, sensor, year)) and os.path.isfile(
+        grid_file(cube_path, sensor, year)
+    )
+
+
+class PrecipCube(object):
+    def __init__(self, cube_path, sensor, year):
+        """
+        open a cube built by build_cube(), data is memory mapped, not loaded
+        """
+        grid = numpy.load(grid_file(cube_path, sensor, year))
+        self.lon = grid["lon"]
+        self.lat = grid["lat"]
+        self.dates = grid["dates"]
+        # slots are consecutive days, the slot of a day is its ordinal offset
+        self.first_day = int(calendar_axis.to_days(self.dates[0]))
+        self.available = grid["available"]
+        self.data = numpy.load(cube_file(cube_path, sensor, year), mmap_mode="r")
+
+    def series(self, lon_ind, lat_ind, start_time, end_time):
+        """
+        function to read the whole time series of grid cells
+        in: lon_ind, lat_ind, int arrays of grid index
+            start and end time in format YYYYMMDD
+        out: dates, (day,) YYYYMMDD of days that had a file
+             values, (cell, day) float32
+        """
+        n_slots = self.dates.shape[0]
+        d0 = int(calendar_axis.to_days(start_time)) - self.first_day
+        d1 = int(calendar_axis.to_days(end_time)) - self.first_day + 1
+        d0 = min(max(d0, 0), n_slots)
+        d1 = min(max(d1, d0), n_slots)
+        days = numpy.arange(d0, d1)[self.available[d0:d1]]
+        values = self.data[numpy.asarray(lon_ind), numpy.asarray(lat_ind), d0:d1]
+        return self.dates[days], values[:, days - d0]
+
+
+def open_cube(cube_path, sensor, year):
+    """
+    function to open the cube of a year, None if it is not built
+    """
+    if cube_path is None or not has_cube(cube_path, sensor, year):
+        return None
+    return PrecipCube(cube_path, sensor, year)
+
+
+# build cubes
+if __name__ == "__main__":
+    import sys
+
+    # python -m extractor_functions.precip_cube gpm 2018 [2019 ...]
+    sensor, years = sys.argv[1], sys.argv[2:]
+    with open(
+        os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            "aux_data/%s_all.txt" % sensor.upper(),
+        )
+    ) as fid:
+        source = fid.readlines()
+    cube_path = os.path.join(os.path.expanduser("~"), CUBE_PATH)
+    for year in years:
+        print(build_cube(source, sensor, year, cube_path))
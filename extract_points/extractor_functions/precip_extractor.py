@@ -1,10 +1,13 @@
 import os
 import logging
-import datetime
 import netCDF4
-import itertools
 import numpy
 import gc
+from extractor_functions.result_store import ResultStore
+from extractor_functions import scene_catalog
+from extractor_functions import precip_cube
+from extractor_functions import point_registry
+from extractor_functions import calendar_axis
 
 # from memory_profiler import profile
 
@@ -13,8 +16,13 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.propagate = True
 
+# first day read from GPM, 20140312 still belongs to TRMM, hardcoded based on data
+GPM_START = "20140313"
 
-def extract_precip(gpm_source, trmm_source, coord, time_start, time_end):
+
+def extract_precip(
+    gpm_source, trmm_source, coord, time_start, time_end, cube_path=None
+):
     """
     function to extract precipitation data given data source, latitude,
     longitude and a period of time
@@ -27,97 +35,64 @@ def extract_precip(gpm_source, trmm_source, coord, time_start, time_end):
     coord: coordinate (lat, lon); float, a list of tuple
     time_start: start time, should be in the format of 'YYYYMMDD' [string]
     time_end: end time, should be in the format of "YYYYMMDD" [string]
+    cube_path: folder of per year cubes, see precip_cube.py, years with a cube
+               are read from it instead of the daily files
 
     output of the function:
     a list of data with format[{coord1:[(time1,value1),(time2,value2),....]},
                                {coord2:[(time1,value1),(time2,value2),....]}]
     """
 
-    # parse date, format=YYYYMMDD
-    time_start = datetime.datetime.strptime(time_start, "%Y%m%d")
-    time_end = datetime.datetime.strptime(time_end, "%Y%m%d")
-    s_yr, s_mon, s_day = time_start.year, time_start.month, time_start.day
-    e_yr, e_mon, e_day = time_end.year, time_end.month, time_end.day
-
-    # get coordinate str, for dict key use later
-    coord_str = convert_to_strkey(coord)
+    # every day of the period as day ordinals, see calendar_axis.py
+    days = calendar_axis.date_axis(time_start, time_end)
+    gpm_start = int(calendar_axis.to_days(GPM_START))
 
     # check time span, decide which dataset to use
-
-    if (
-        (s_yr < 2014)
-        or (s_yr == 2014 and s_mon < 3)
-        or (s_yr == 2014 and s_mon == 3 and s_day <= 12)
-    ):  # GPM start 2014-3-12
-        if (
-            (e_yr < 2014)
-            or (e_yr == 2014 and e_mon < 3)
-            or (e_yr == 2014 and e_mon == 3 and e_day <= 12)
-        ):
+    if days[0] < gpm_start:
+        if days[-1] < gpm_start:
             logger.info("entire time period is with in TRMM span, use TRMM ONLY")
             condition = "TRMM"
-
-        elif (
-            (e_yr > 2014)
-            or (e_yr == 2014 and e_mon > 3)
-            or (e_yr == 2014 and e_mon == 3 and e_day > 12)
-        ):
+        else:
             logger.info(
                 " entire time period cross both TRMM and GPM, use both TRMM and GPM"
             )
             condition = "TRMM_GPM"
-
-    elif (
-        (s_yr > 2014)
-        or (s_yr == 2014 and s_mon > 3)
-        or (s_yr == 2014 and s_mon == 3 and s_day > 12)
-    ):
+    else:
         logger.info("entire time period is with in GPM span, use GPM ONLY")
         condition = "GPM"
 
-    else:
-        pass
-
-    # create time string for the entire period we want to get data, in format YYYYMMDD
-    ss_time = datetime.date(s_yr, s_mon, s_day)
-    ee_time = datetime.date(e_yr, e_mon, e_day)
-    delta = ee_time - ss_time
-
-    all_time_string = list()
+    # time string for the entire period we want to get data, in format YYYYMMDD
+    all_time_string = calendar_axis.date_labels(time_start, time_end).tolist()
 
-    for tt in range(delta.days + 1):
-        # format to YYYYMMDD
-        all_time_string.append(
-            (ss_time + datetime.timedelta(days=tt)).strftime("%Y%m%d")
-        )
     # NOW to get precipitation data from source
     # use TRMM data only
     if condition == "TRMM":
-        d_return = get_TRMM_GPM(trmm_source, coord, all_time_string, TRMM=True)
+        d_return = get_TRMM_GPM(
+            trmm_source, coord, all_time_string, TRMM=True, cube_path=cube_path
+        )
 
     # use GPM data only
     elif condition == "GPM":
-        d_return = get_TRMM_GPM(gpm_source, coord, all_time_string, GPM=True)
+        d_return = get_TRMM_GPM(
+            gpm_source, coord, all_time_string, GPM=True, cube_path=cube_path
+        )
 
     # use both data
     elif condition == "TRMM_GPM":
 
-        ind = all_time_string.index("20140313")
+        ind = gpm_start - int(days[0])
         TRMM_time_string = all_time_string[:ind]
-        # 20140312 belongs to TRMM, hardcoded based on data
-        d_return_TRMM = get_TRMM_GPM(trmm_source, coord, TRMM_time_string, TRMM=True)
+        d_return_TRMM = get_TRMM_GPM(
+            trmm_source, coord, TRMM_time_string, TRMM=True, cube_path=cube_path
+        )
 
         GPM_time_string = all_time_string[ind:]
-        d_return_GPM = get_TRMM_GPM(gpm_source, coord, GPM_time_string, GPM=True)
-
-        # d_return={key: d_return_TRMM[key]+d_return_GPM[key] for key in d_return_TRMM}
-        # both dict should have same keys
-        # TODO: better ways than loop?
-        d_return = {c: {"TRMM_GPM": []} for c in coord_str}
-        for key in d_return_TRMM.keys():
-            d_return[key]["TRMM_GPM"] = (
-                d_return_TRMM[key]["TRMM_GPM"] + d_return_GPM[key]["TRMM_GPM"]
-            )
+        d_return_GPM = get_TRMM_GPM(
+            gpm_source, coord, GPM_time_string, GPM=True, cube_path=cube_path
+        )
+
+        # both stores have same points, GPM days are appended after TRMM days
+        d_return = d_return_TRMM.merge(d_return_GPM)
     else:
         pass
 
@@ -125,14 +100,17 @@ def extract_precip(gpm_source, trmm_source, coord, time_start, time_end):
 
 
 # @profile   #add  function memory usage profiler
-def get_TRMM_GPM(d_source, coord, time_string, TRMM=False, GPM=False):
+def get_TRMM_GPM(d_source, coord, time_string, TRMM=False, GPM=False, cube_path=None):
     """
     function to get TRMM and GPM data given data source and time strings
     input of the function:
-    d_source:   a list of data source file  in format list of string
+    d_source:   a list of data source file  in format list of string,
+                or a scene catalog file, see scene_catalog.as_catalog()
     time_string: a list of time strings in format YYYYMMDD
+    cube_path: folder of per year cubes, years with a cube are read from it,
+               the other years from the daily files
     output of the function:
-    a list containing time string and data value e.g. [("20100101",3),("20100102",5),..]
+    a ResultStore, read as {point id: {"TRMM_GPM": [("20100101",3),..]}}
 
     BY DEFAULT, I assume all data are in *nc or *nc4 format
     """
@@ -146,73 +124,78 @@ def get_TRMM_GPM(d_source, coord, time_string, TRMM=False, GPM=False):
     # #NOTE: dict created by this method using the same object for all values,
     # so when you update one, you update all
 
-    # final return is a dict
-    coord_str = convert_to_strkey(coord)
-    final = {c: {"TRMM_GPM": []} for c in coord_str}
+    # final return is a result store
+    coord_ids = point_registry.point_ids(coord).tolist()
+    final = ResultStore(coord_ids, ["TRMM_GPM"], decimals=3)
+    rows = final.rows(coord_ids)
+
+    sensor = "trmm" if TRMM else "gpm"
+    lat, lon = numpy.array(coord, dtype=numpy.float64).reshape(-1, 2).T
+
+    # whole time series of every point from the per year cubes,
+    # years without a cube are read from the daily files
+    daily_time = []
+    for yr in sorted(set(ts[:4] for ts in time_string)):
+        yr_time = [ts for ts in time_string if ts[:4] == yr]
+        cube = precip_cube.open_cube(cube_path, sensor, yr)
+        if cube is None:
+            daily_time += yr_time
+            continue
+        logger.info("We are reading %s cube of %s" % (sensor, yr))
+        cells, inverse = grid_cells(cube.lon, cube.lat, lat, lon)
+        dates, values = cube.series(cells[0], cells[1], min(yr_time), max(yr_time))
+        values = values[inverse]
+        for j, ts in enumerate(dates.tolist()):
+            final.write_scene(ts, rows, values[:, j])
+    if len(daily_time) == 0:
+        return final
+
+    # daily files of the period, looked up once in the scene catalog
+    catalog = scene_catalog.as_catalog(d_source, sensor)
+    day_files = dict(
+        catalog.query_dates(sensor, "global", min(daily_time), max(daily_time))
+    )
 
     # simple solution, given time string, search and read in data of all coord location
     # TODO better solutions? I think I can do parallel for this part
-    for i, ts in enumerate(time_string):  # it has to do a search in list every time
+    cells = None
+    for ts in daily_time:
         logger.info("We are dealing with time %s" % ts)
-        filename = [ds for ds in d_source if ts in ds][0]
+        if ts not in day_files:
+            logger.info("No file for time %s" % ts)
+            continue
+        filename = day_files[ts]
         filename = os.path.join(os.path.expanduser("~"), filename.strip("./ \n"))
         logger.info("We are working on file %s" % filename)
 
         # here filename should be a .nc or .nc4
 
-        # TODO:
-        # concatenate all daily precipitation into yearly file can speedup file reading
+        # NOTE per year cubes (precip_cube.py) avoid reading a file per day
         try:
             nc = netCDF4.Dataset(filename, "r")
         except Exception as e:
             logger.info(e)
             continue
 
+        if cells is None:
+            # grid cells of all points, every cell is read once
+            cells, inverse = grid_cells(
+                nc.variables["lon"][:], nc.variables["lat"][:], lat, lon
+            )
+
+        # read in data, data will be masked array
         if GPM:
-            if i == 0:
-                GPM_grid = [nc.variables["lon"][:], nc.variables["lat"][:]]
-                # coord_ind=(numpy.searchsorted(GPM_grid[0],list(zip(*coord))[1],side="left"),
-                # numpy.searchsorted(GPM_grid[1],list(zip(*coord))[0],side="left"))
-                coord_ind_lon = [numpy.argmin(abs(GPM_grid[0] - cc[1])) for cc in coord]
-                coord_ind_lat = [numpy.argmin(abs(GPM_grid[1] - cc[0])) for cc in coord]
-                coord_ind = (coord_ind_lon, coord_ind_lat)
-
-                precipitation = nc.variables["precipitationCal"][:]
-                # read in data, data will be masked array
-            else:
-                precipitation = nc.variables["precipitationCal"][:]
+            precipitation = nc.variables["precipitationCal"][:]
         elif TRMM:
-            if i == 0:
-                TRMM_grid = [nc.variables["lon"][:], nc.variables["lat"][:]]
-                # coord_ind=(numpy.searchsorted(TRMM_grid[0],list(zip(*coord))[1],side="left"),
-                # numpy.searchsorted(TRMM_grid[1],list(zip(*coord))[0],side="left"))
-                coord_ind_lon = [
-                    numpy.argmin(abs(TRMM_grid[0] - cc[1])) for cc in coord
-                ]
-                coord_ind_lat = [
-                    numpy.argmin(abs(TRMM_grid[1] - cc[0])) for cc in coord
-                ]
-                coord_ind = (coord_ind_lon, coord_ind_lat)
-
-                precipitation = nc.variables["precipitation"][:]
-            else:
-                precipitation = nc.variables["precipitation"][:]
+            precipitation = nc.variables["precipitation"][:]
         else:
             pass
 
-        tmp = list(
-            zip(
-                itertools.repeat(ts, len(coord_ind[0])),
-                precipitation[coord_ind].round(decimals=3),
-            )
-        )  # coordinate (lon,lat)
-
-        # for i, key in enumerate(final.keys()):
-        #   final[key].append(tmp[i])
-
-        for i, key in enumerate(final.keys()):
-            final[key]["TRMM_GPM"].append(tmp[i])
-        # [item["TRMM_GPM"].append(tt) for item, tt in zip(final,tmp)]
+        # coordinate (lon,lat), masked cells are stored as nan
+        tmp = numpy.ma.filled(
+            precipitation[cells].round(decimals=3).astype(float), numpy.nan
+        )[inverse]
+        final.write_scene(ts, rows, tmp)
 
         del (precipitation)
         del (tmp)
@@ -222,20 +205,51 @@ def get_TRMM_GPM(d_source, coord, time_string, TRMM=False, GPM=False):
     return final
 
 
-def convert_to_strkey(cd):
+def nearest_index(grid, values):
+    """
+    function to get index of the nearest grid center of every value
+    IN: grid, 1-D array of sorted grid centers; values, array of lat or lon
+    OUT: int array of grid index
+    regular grids are solved by arithmetic on the spacing, irregular ones
+    by a binary search, both in one pass over all values
+    """
+    grid = numpy.asarray(grid, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if grid.shape[0] == 1:
+        return numpy.zeros(values.shape, dtype=numpy.int64)
+    if grid[0] > grid[-1]:  # descending grid
+        return grid.shape[0] - 1 - nearest_index(grid[::-1], values)
+
+    step = numpy.diff(grid)
+    if numpy.allclose(step, step[0]):
+        ind = numpy.rint((values - grid[0]) / step[0]).astype(numpy.int64)
+        return numpy.clip(ind, 0, grid.shape[0] - 1)
+
+    # nearer of the two grid centers around every value
+    right = numpy.clip(numpy.searchsorted(grid, values), 1, grid.shape[0] - 1)
+    left = right - 1
+    return numpy.where(
+        values - grid[left] <= grid[right] - values, left, right
+    ).astype(numpy.int64)
+
+
+def grid_cells(lon_grid, lat_grid, lat, lon):
     """
-    function to convert float (lat,lon) to str lat,lon
-    serve as key of dictionary
-    IN: a list of points in float
-    OUT: a list of points in str
+    function to get the grid cells of points, points sharing a cell are merged
+    IN: lon_grid, lat_grid, grid centers; lat, lon, arrays of points
+    OUT: cells, (lon_ind, lat_ind) of unique cells
+         inverse, cell of every point, cell_values[inverse] gives point values
     """
-    str_latlon = ["{:.6f}".format(cc[0]) + "," + "{:.6f}".format(cc[1]) for cc in cd]
-    return str_latlon
+    lon_ind = nearest_index(lon_grid, lon)
+    lat_ind = nearest_index(lat_grid, lat)
+    n_lat = len(lat_grid)
+    cell_id, inverse = numpy.unique(lon_ind * n_lat + lat_ind, return_inverse=True)
+    return (cell_id // n_lat, cell_id % n_lat), inverse.reshape(-1)
 
 
 # pack all the code above into a main function extract_TRMM_GPM
 # @profile(precision=4)
-def extract_TRMM_GPM(coordinates, time_begin, time_end):
+def extract_TRMM_GPM(coordinates, time_begin, time_end, cube_path=None):
     """
     Main function
     input of the function:
@@ -244,6 +258,7 @@ def extract_TRMM_GPM(coordinates, time_begin, time_end):
             coordinates usualy is (lon,lat)
       time_begin: a time string of format YYYYMMDD
       time_end: a time string of format YYYYMMDD
+      cube_path: folder of per year cubes, default precip_cube.CUBE_PATH
       we also need a list of file names where data is stored,
          I think I will just go to save all filenames into a file and read them in
 
@@ -273,8 +288,10 @@ def extract_TRMM_GPM(coordinates, time_begin, time_end):
     except Exception as e:
         logger.info(e)
 
+    if cube_path is None:
+        cube_path = os.path.join(os.path.expanduser("~"), precip_cube.CUBE_PATH)
     precip_return = extract_precip(
-        G_source, T_source, coordinates, time_begin, time_end
+        G_source, T_source, coordinates, time_begin, time_end, cube_path
     )
 
     logger.info("HERO, we are done")
@@ -289,6 +306,7 @@ if __name__ == "__main__":
 
     sample_start = "20160404"
     sample_end = "20160415"
+    point_registry.get_registry().register(sample_points)
 
     import time
 
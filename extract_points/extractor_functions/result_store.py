@@ -0,0 +1,313 @@
+"""
+array backed container for extracted time series
+
+All extractors used to grow {point: {band: [(date, value), ...]}} one tuple
+at a time. ResultStore keeps the same information in three arrays:
+    values: (point, scene, band) float32, extracted values
+    valid:  (point, scene) bool, True where the point got an observation
+    dates:  (scene,) YYYYMMDD label of every scene column
+Scenes of the same date are written to the same column as long as they do not
+overlap in points, so the scene axis stays about as long as the date axis.
+A value may be nan in a valid column when only some bands were observed, e.g.
+in stores joined by ensemble.Ensemble, such values are left out of records.
+The store is a read-only Mapping, records in the old dict format are built on
+access, so code written for the dict of lists of tuples keeps working.
+Scenes an extractor could not read are listed in failed_scenes, so that a
+checkpoint does not record them as done, see checkpoint.py.
+"""
+from collections.abc import Mapping
+import numpy
+from extractor_functions import calendar_axis
+
+
+class ResultStore(Mapping):
+    def __init__(self, point_keys, band_keys, decimals=4, capacity=16):
+        """
+        in: point_keys, ids of all points that may get data, see point_registry.py
+            band_keys, band names, e.g. settings.L_band_key_list
+            decimals, rounding applied when records are read back
+            capacity, initial length of the scene axis
+        """
+        self._keys = list(dict.fromkeys(point_keys))  # unique, order kept
+        self.band_keys = list(band_keys)
+        self.decimals = decimals
+        self._row = {key: i for i, key in enumerate(self._keys)}
+        self._values = numpy.full(
+            (len(self._keys), capacity, len(self.band_keys)),
+            numpy.nan,
+            dtype=numpy.float32,
+        )
+        self._valid = numpy.zeros((len(self._keys), capacity), dtype=bool)
+        self._dates = numpy.empty(capacity, dtype="<U8")
+        self.n_scenes = 0
+        self._order = None
+        self.failed_scenes = []
+
+    @property
+    def n_points(self):
+        return len(self._keys)
+
+    @property
+    def point_keys(self):
+        return numpy.array(self._keys, dtype=numpy.int64)
+
+    @property
+    def values(self):
+        return self._values[: self.n_points, : self.n_scenes]
+
+    @property
+    def valid(self):
+        return self._valid[: self.n_points, : self.n_scenes]
+
+    @property
+    def dates(self):
+        return self._dates[: self.n_scenes]
+
+    def rows(self, keys):
+        """
+        function to get store rows of given point keys
+        in: an iterable of point ids
+        out: int array of row index
+        """
+        return numpy.array([self._row[key] for key in keys], dtype=numpy.int64)
+
+    def _reserve(self, n_points, n_scenes):
+        """
+        function to grow the arrays to hold at least n_points x n_scenes,
+        every axis grows by doubling
+        """
+        point_capacity, scene_capacity = self._valid.shape
+        if n_points <= point_capacity and n_scenes <= scene_capacity:
+            return
+        if n_points > point_capacity:
+            point_capacity = max(n_points, 2 * point_capacity)
+        if n_scenes > scene_capacity:
+            scene_capacity = max(n_scenes, 2 * scene_capacity)
+        values = numpy.full(
+            (point_capacity, scene_capacity, self._values.shape[2]),
+            numpy.nan,
+            dtype=numpy.float32,
+        )
+        values[: self.n_points, : self.n_scenes] = self.values
+        valid = numpy.zeros((point_capacity, scene_capacity), dtype=bool)
+        valid[: self.n_points, : self.n_scenes] = self.valid
+        dates = numpy.empty(scene_capacity, dtype="<U8")
+        dates[: self.n_scenes] = self.dates
+        self._values, self._valid, self._dates = values, valid, dates
+
+    def _add_points(self, keys):
+        """
+        function to append rows for new point keys
+        """
+        keys = [key for key in dict.fromkeys(keys) if key not in self._row]
+        if len(keys) == 0:
+            return
+        self._reserve(self.n_points + len(keys), self.n_scenes)
+        for key in keys:
+            self._row[key] = len(self._keys)
+            self._keys.append(key)
+
+    def _new_column(self, date):
+        """
+        function to append an empty scene column
+        """
+        self._reserve(self.n_points, self.n_scenes + 1)
+        col = self.n_scenes
+        self._dates[col] = date
+        self.n_scenes += 1
+        self._order = None
+        return col
+
+    def write_scene(self, date, rows, values):
+        """
+        function to write values of one scene
+        in: date, YYYYMMDD of the scene
+            rows, int array of store rows
+            values, (len(rows), band) array, or (len(rows),) for a single band
+        rows are written to the first column of the same date that has no data
+        for them yet, a new column is only added for rows observed twice on
+        that date (duplicated scenes, overlapping tiles)
+        """
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        values = numpy.asarray(values, dtype=numpy.float32)
+        if values.ndim == 1:
+            values = values[:, None]
+        for col in numpy.flatnonzero(self.dates == date):
+            if rows.shape[0] == 0:
+                return
+            free = ~self._valid[rows, col]
+            self._values[rows[free], col] = values[free]
+            self._valid[rows[free], col] = True
+            rows, values = rows[~free], values[~free]
+        if rows.shape[0] == 0:
+            return
+        col = self._new_column(date)
+        self._values[rows, col] = values
+        self._valid[rows, col] = True
+
+    def merge(self, other):
+        """
+        function to add the scenes of another store into this one,
+        points are matched by key, unknown points are appended
+        """
+        self._add_points(other._keys)
+        rows = self.rows(other._keys)
+        for j in range(other.n_scenes):
+            observed = other.valid[:, j]
+            self.write_scene(other._dates[j], rows[observed], other.values[observed, j])
+        return self
+
+    def take(self, keys):
+        """
+        function to copy the rows of given points into a new store,
+        unknown keys are skipped, scene columns without data are left out
+        """
+        keys = [key for key in dict.fromkeys(keys) if key in self._row]
+        rows = self.rows(keys)
+        valid = self.valid[rows]
+        cols = numpy.flatnonzero(valid.any(axis=0))
+        out = ResultStore(
+            keys, self.band_keys, self.decimals, capacity=max(1, cols.shape[0])
+        )
+        out._values[:, : cols.shape[0]] = self.values[rows][:, cols]
+        out._valid[:, : cols.shape[0]] = valid[:, cols]
+        out._dates[: cols.shape[0]] = self.dates[cols]
+        out.n_scenes = cols.shape[0]
+        return out
+
+    def drop(self, keys):
+        """
+        function to remove the rows of given points, unknown keys are skipped
+        """
+        dropped = numpy.zeros(self.n_points, dtype=bool)
+        dropped[[self._row[key] for key in keys if key in self._row]] = True
+        keep = numpy.flatnonzero(~dropped)
+        self._keys = [self._keys[row] for row in keep]
+        self._row = {key: i for i, key in enumerate(self._keys)}
+        self._values = self._values[keep]
+        self._valid = self._valid[keep]
+
+    def save(self, file_path):
+        """
+        function to save the store as typed arrays in a npz file,
+        no pickled objects, see load(), dates are also saved as int32
+        day ordinals, see calendar_axis.py
+        """
+        numpy.savez(
+            file_path,
+            points=self.point_keys,
+            dates=self.dates,
+            days=calendar_axis.to_days(self.dates),
+            bands=numpy.array(self.band_keys, dtype=str),
+            values=self.values,
+            valid=self.valid,
+            decimals=self.decimals,
+        )
+
+    @classmethod
+    def from_arrays(cls, point_keys, band_keys, decimals, dates, values, valid):
+        """
+        function to build a store from typed arrays, see save()
+        in: point_keys, (point,) keys, band_keys, (band,) names
+            dates, (scene,), values, (point, scene, band), valid, (point, scene)
+        """
+        n_scenes = len(dates)
+        out = cls(point_keys, band_keys, int(decimals), capacity=max(1, n_scenes))
+        out._values[:, :n_scenes] = values
+        out._valid[:, :n_scenes] = valid
+        out._dates[:n_scenes] = dates
+        out.n_scenes = n_scenes
+        return out
+
+    @classmethod
+    def from_records(cls, records, decimals=4):
+        """
+        function to build a store from records in the old dict format
+        in: records, {point id: {band: [(date, value), ...]}}
+        """
+        band_keys = list(
+            dict.fromkeys(band for record in records.values() for band in record)
+        )
+        dates = sorted(
+            set(
+                str(date)
+                for record in records.values()
+                for series in record.values()
+                for date, _ in series
+            )
+        )
+        col = {date: j for j, date in enumerate(dates)}
+        values = numpy.full(
+            (len(records), len(dates), len(band_keys)), numpy.nan, dtype=numpy.float32
+        )
+        for i, record in enumerate(records.values()):
+            for b, band in enumerate(band_keys):
+                for date, value in record.get(band, []):
+                    values[i, col[str(date)], b] = value
+        return cls.from_arrays(
+            list(records),
+            band_keys,
+            decimals,
+            numpy.array(dates, dtype="<U8"),
+            values,
+            ~numpy.isnan(values).all(axis=2),
+        )
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        function to load a store saved by save()
+        """
+        data = numpy.load(file_path)
+        return cls.from_arrays(
+            data["points"].tolist(),
+            data["bands"].tolist(),
+            data["decimals"],
+            data["dates"],
+            data["values"],
+            data["valid"],
+        )
+
+    def _date_order(self):
+        if self._order is None:
+            self._order = numpy.argsort(self.dates, kind="stable")
+        return self._order
+
+    def _observed(self):
+        return self.valid.any(axis=1)
+
+    def __getitem__(self, key):
+        """
+        function to build the record of one point in the dict format
+        out: {band: [(date, value), ...]} sorted by date
+        """
+        row = self._row[key]
+        order = self._date_order()
+        cols = order[self._valid[row, order]]
+        if cols.shape[0] == 0:
+            raise KeyError(key)
+        dates = self._dates[cols].tolist()
+        values = numpy.around(
+            self._values[row, cols].astype(numpy.float64), decimals=self.decimals
+        )
+        # joined stores have nan in bands a source did not observe
+        observed = ~numpy.isnan(values)
+        values = values.tolist()
+        return {
+            band: [
+                (dates[i], values[i][b])
+                for i in numpy.flatnonzero(observed[:, b]).tolist()
+            ]
+            for b, band in enumerate(self.band_keys)
+        }
+
+    def __contains__(self, key):
+        row = self._row.get(key)
+        return row is not None and bool(self.valid[row].any())
+
+    def __iter__(self):
+        for row in numpy.flatnonzero(self._observed()):
+            yield self._keys[row]
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self._observed()))
@@ -0,0 +1,88 @@
+"""
+streaming writer of extracted results
+
+Points are handed to the writer as soon as their extraction is finished and
+are flushed to fixed size chunk files, so memory is bounded by the chunk
+size instead of the dataset size.
+OUTPUT FILE CONVENTION:
+   year_croptype_extracted_results_index.npz  e.g. 2017_corn_extracted_results_0.npz
+   every file holds typed arrays, see ResultStore.save():
+       points: (point,) int64 point ids
+       dates: (scene,) YYYYMMDD
+       days: (scene,) int32 day ordinals of the dates, see calendar_axis.py
+       bands: (band,) band names
+       values: (point, scene, band) float32
+       valid: (point, scene) bool
+   year_croptype_point_table.npz, lat/lon of all points of the files, written
+   once per dataset on close(), see point_registry.py
+"""
+import os
+import numpy
+from extractor_functions.result_store import ResultStore
+from extractor_functions import point_registry
+
+# name of the lat/lon table of a dataset, after year_croptype
+POINT_TABLE = "point_table.npz"
+
+
+class ChunkWriter(object):
+    def __init__(self, out_path, yr, ctype, chunk=5000):
+        """
+        in: out_path, output folder, relative to home, absolute paths are kept
+            yr, ctype, year and crop type of the file names
+            chunk, number of points per file
+        """
+        if not os.path.isabs(out_path):
+            out_path = os.path.join(os.path.expanduser("~"), os.path.normpath(out_path))
+        self.out_path = out_path
+        self.yr = yr
+        self.ctype = ctype
+        self.chunk = chunk
+        self.n_files = 0
+        self.n_points = 0
+        self._buffer = None
+        self._ids = []
+
+    def file_name(self, n):
+        name = self.yr + "_" + self.ctype + "_" + "extracted_results"
+        return os.path.join(self.out_path, name + "_" + str(n) + ".npz")
+
+    def table_name(self):
+        name = self.yr + "_" + self.ctype + "_" + POINT_TABLE
+        return os.path.join(self.out_path, name)
+
+    def add(self, store):
+        """
+        function to add finished points, full chunks are flushed right away
+        in: store, ResultStore of points that will get no more data
+        """
+        if store is None or len(store) == 0:
+            return
+        if self._buffer is None:
+            self._buffer = ResultStore([], store.band_keys, store.decimals)
+        self._buffer.merge(store.take(list(store)))
+        while len(self._buffer) >= self.chunk:
+            self._flush(self.chunk)
+
+    def _flush(self, size):
+        keys = list(self._buffer)[:size]
+        self._buffer.take(keys).save(self.file_name(self.n_files))
+        self._ids.append(numpy.array(keys, dtype=numpy.int64))
+        self._buffer.drop(keys)
+        print("saved %d points to %s" % (len(keys), self.file_name(self.n_files)))
+        self.n_files += 1
+        self.n_points += len(keys)
+
+    def close(self):
+        """
+        function to flush the last, partial chunk
+        and save the lat/lon table of all written points
+        """
+        if self._buffer is not None and len(self._buffer) != 0:
+            self._flush(len(self._buffer))
+        self._buffer = None
+        if len(self._ids) != 0:
+            ids = numpy.concatenate(self._ids)
+            point_registry.get_registry().subset(ids).save(self.table_name())
+            self._ids = []
+        return self.n_files
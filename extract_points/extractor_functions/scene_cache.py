@@ -0,0 +1,62 @@
+"""
+per tile cache of scene geometry
+
+All scenes of a WRS-2 path/row, MGRS tile or MODIS tile share the projection,
+and usually the geo transform and raster size as well. SceneGeometryCache
+projects the points of a tile once for every distinct
+(projection WKT, geo transform, raster size) and hands the image locations
+back for all dates of the tile. The cache is shared by the mask reading
+threads of cloud_prepass.py, locate() projects under a lock since osr
+transformations are not thread safe, and every geometry is projected once.
+"""
+import threading
+import extractor_functions.geo_functions as geo_functions
+
+
+class SceneGeometryCache(object):
+    def __init__(self, coord):
+        """
+        in: coord, points of the tile [(lat1,lon1),(lat2,lon2),...]
+        """
+        self.coord = coord
+        self._transforms = {}  # projection WKT -> osr.CoordinateTransformation
+        self._locations = {}  # scene geometry key -> (px, py, index)
+        self._lock = threading.Lock()
+
+    def key(self, dataset):
+        """
+        function to get the geometry key of a scene,
+        (projection WKT, geo transform, raster size)
+        """
+        return (
+            dataset.GetProjection(),
+            tuple(dataset.GetGeoTransform()),
+            dataset.RasterXSize,
+            dataset.RasterYSize,
+        )
+
+    def locate(self, dataset):
+        """
+        function to get image location of the tile points in a scene
+        in: dataset, gdal dataset of any file of the scene
+        out: px, py of points inside the image and their position in coord,
+             see geo_functions.point_boundary_index_vector()
+        NOTE returned arrays are shared between scenes, do not modify in place
+        """
+        key = self.key(dataset)
+        with self._lock:
+            if key not in self._locations:
+                projection, geo_tran, XSize, YSize = key
+                if projection not in self._transforms:
+                    self._transforms[projection] = geo_functions.getSRSPair(dataset)
+                self._locations[key] = geo_functions.point_boundary_index_vector(
+                    XSize, YSize, self.coord, geo_tran, self._transforms[projection]
+                )
+            return self._locations[key]
+
+    def located(self, key):
+        """
+        function to get the image location of a scene already located,
+        by its geometry key, see locate()
+        """
+        return self._locations[key]
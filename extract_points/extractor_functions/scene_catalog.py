@@ -0,0 +1,306 @@
+"""
+scene catalog built from the data inventories
+
+The inventories (json lists of Landsat/Sentinel folders, txt lists of
+TRMM/GPM files) hold hundreds of thousands of paths. Instead of scanning them
+with a substring test for every tile, every path is parsed once into
+(sensor, tile, date) and stored in a SQLite file with an index on these
+columns, so that a tile and date range is a single indexed query.
+
+    catalog = open_catalog("landsat_list.json", "landsat")
+    catalog.query("landsat", "123-040", "20180101", "20181231")
+
+tile keys follow the sampler keys:
+    landsat:    "path-row", e.g. "123-040"
+    sentinel:   MGRS tile, e.g. "49RCM"
+    gpm, trmm:  "global"
+    MOD11A1, MYD11A1:   MODIS tile, e.g. "h11v05"
+
+MODIS products have no inventory, their trees of date folders are scanned
+(scan_folders), and on later runs only folders whose mtime changed are listed
+again:
+
+    catalog = open_folder_catalog({"MOD11A1": ".../MOD11A1.006"}, db_path)
+    catalog.query("MOD11A1", "h11v05", "20180101", "20181231")
+"""
+import os
+import re
+import json
+import sqlite3
+
+sentinel_pattern = re.compile(
+    r"/(\d{1,2})/([A-Z])/([A-Z]{2})/(\d{4})/(\d{1,2})/(\d{1,2})/"
+)
+precip_pattern = re.compile(r"\.(\d{8})[.-]")
+modis_folder_pattern = re.compile(r"^(\d{4})\.(\d{2})\.(\d{2})$")
+
+# seconds to wait for a catalog file locked by another job, a first scan of a
+# folder tree or inventory is written in one transaction and takes minutes
+CATALOG_TIMEOUT = 1800
+
+
+def parse_landsat(path):
+    """
+    function to get tile and date of a landsat folder, e.g.
+    .../LC08/01/123/040/LC08_L1TP_123040_20180101_20180106_01_T1
+    out: ("123-040", "20180101") or None
+    """
+    parts = path.rstrip("/").split("/")
+    name_parts = parts[-1].split("_")
+    if len(parts) < 3 or len(name_parts) < 4:
+        return None
+    if not (parts[-3].isdigit() and parts[-2].isdigit()):
+        return None
+    return parts[-3].zfill(3) + "-" + parts[-2].zfill(3), name_parts[-4]
+
+
+def parse_sentinel(path):
+    """
+    function to get tile and date of a sentinel SAFE folder, e.g.
+    .../tiles/14/T/MP/2016/11/24/0/S2A_...SAFE
+    out: ("14TMP", "20161124") or None
+    """
+    found = sentinel_pattern.search(path)
+    if found is None:
+        return None
+    zone, band, square, year, month, day = found.groups()
+    return zone.zfill(2) + band + square, year + month.zfill(2) + day.zfill(2)
+
+
+def parse_precip(path):
+    """
+    function to get date of a daily TRMM/GPM file, e.g.
+    .../3B-DAY-L.MS.MRG.3IMERG.20180412-S000000-E235959.V05.nc4
+    out: ("global", "20180412") or None
+    """
+    found = precip_pattern.search(path)
+    if found is None:
+        return None
+    return "global", found.group(1)
+
+
+def parse_modis(path):
+    """
+    function to get tile and date of a MODIS file in its date folder, e.g.
+    .../MOD11A1.006/2018.01.02/MOD11A1.A2018002.h11v05.006.2018003085210.hdf
+    out: ("h11v05", "20180102") or None
+    """
+    parts = path.rstrip("/").split("/")
+    name_parts = parts[-1].split(".")
+    if len(parts) < 2 or len(name_parts) < 4 or name_parts[-1] != "hdf":
+        return None
+    found = modis_folder_pattern.match(parts[-2])
+    if found is None:
+        return None
+    return name_parts[2], "".join(found.groups())
+
+
+PARSERS = {
+    "landsat": parse_landsat,
+    "sentinel": parse_sentinel,
+    "gpm": parse_precip,
+    "trmm": parse_precip,
+    "MOD11A1": parse_modis,
+    "MYD11A1": parse_modis,
+}
+
+
+class SceneCatalog(object):
+    def __init__(self, db_path=":memory:"):
+        """
+        open or create a catalog
+        in: db_path, SQLite file, in memory catalog by default
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=CATALOG_TIMEOUT)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS scenes ("
+            "sensor TEXT, tile TEXT, date TEXT, path TEXT, "
+            "PRIMARY KEY (sensor, tile, date, path)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS inventories ("
+            "sensor TEXT, inventory TEXT, mtime REAL, size INTEGER, "
+            "PRIMARY KEY (sensor, inventory))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS folders ("
+            "sensor TEXT, folder TEXT, mtime REAL, "
+            "PRIMARY KEY (sensor, folder))"
+        )
+        self.conn.commit()
+
+    def add(self, sensor, paths):
+        """
+        function to add inventory paths of a sensor,
+        paths the sensor parser can not read are skipped
+        out: number of paths added
+        """
+        parser = PARSERS[sensor]
+        rows = []
+        for path in paths:
+            path = path.strip()
+            parsed = parser(path)
+            if parsed is None:
+                continue
+            rows.append((sensor, parsed[0], parsed[1], path))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO scenes VALUES (?, ?, ?, ?)", rows
+        )
+        self.conn.commit()
+        return len(rows)
+
+    def is_current(self, sensor, inventory):
+        """
+        function to check the catalog was built from this version of inventory
+        """
+        stat = os.stat(inventory)
+        found = self.conn.execute(
+            "SELECT mtime, size FROM inventories WHERE sensor = ? AND inventory = ?",
+            (sensor, os.path.abspath(inventory)),
+        ).fetchone()
+        return found is not None and tuple(found) == (stat.st_mtime, stat.st_size)
+
+    def add_inventory(self, sensor, inventory):
+        """
+        function to (re)load all paths of a sensor from an inventory file,
+        json list or text file with one path per line
+        """
+        with open(inventory) as fid:
+            if inventory.endswith(".json"):
+                paths = json.load(fid)
+            else:
+                paths = fid.readlines()
+        stat = os.stat(inventory)
+        self.conn.execute("DELETE FROM scenes WHERE sensor = ?", (sensor,))
+        added = self.add(sensor, paths)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO inventories VALUES (?, ?, ?, ?)",
+            (sensor, os.path.abspath(inventory), stat.st_mtime, stat.st_size),
+        )
+        self.conn.commit()
+        return added
+
+    def _remove_folder(self, sensor, folder):
+        prefix = folder + "/"
+        self.conn.execute(
+            "DELETE FROM scenes WHERE sensor = ? AND substr(path, 1, ?) = ?",
+            (sensor, len(prefix), prefix),
+        )
+        self.conn.execute(
+            "DELETE FROM folders WHERE sensor = ? AND folder = ?", (sensor, folder)
+        )
+
+    def scan_folders(self, sensor, root):
+        """
+        function to refresh the paths of a sensor from a tree of folders,
+        root/<folder>/<file>, one listdir of root and a stat of every folder,
+        folders are only listed again when their mtime changed
+        out: number of folders listed
+        """
+        known = dict(
+            self.conn.execute(
+                "SELECT folder, mtime FROM folders WHERE sensor = ?", (sensor,)
+            ).fetchall()
+        )
+        current = {}
+        for name in os.listdir(root):
+            folder = os.path.join(root, name)
+            if os.path.isdir(folder):
+                current[folder] = os.stat(folder).st_mtime
+
+        for folder in set(known) - set(current):
+            self._remove_folder(sensor, folder)
+        changed = [f for f, mtime in current.items() if known.get(f) != mtime]
+        for folder in changed:
+            self._remove_folder(sensor, folder)
+            self.add(sensor, [os.path.join(folder, f) for f in os.listdir(folder)])
+            self.conn.execute(
+                "INSERT INTO folders VALUES (?, ?, ?)",
+                (sensor, folder, current[folder]),
+            )
+        self.conn.commit()
+        return len(changed)
+
+    def query(self, sensor, tile, start_time, end_time):
+        """
+        function to get paths of a tile within a time period
+        in: sensor, tile key, start and end time in format YYYYMMDD
+        out: list of paths ordered by date
+        """
+        found = self.conn.execute(
+            "SELECT path FROM scenes WHERE sensor = ? AND tile = ? "
+            "AND date BETWEEN ? AND ? ORDER BY date, path",
+            (sensor, tile, start_time, end_time),
+        )
+        return [row[0] for row in found]
+
+    def query_dates(self, sensor, tile, start_time, end_time):
+        """
+        function to get (date, path) of a tile within a time period
+        """
+        found = self.conn.execute(
+            "SELECT date, path FROM scenes WHERE sensor = ? AND tile = ? "
+            "AND date BETWEEN ? AND ? ORDER BY date, path",
+            (sensor, tile, start_time, end_time),
+        )
+        return [tuple(row) for row in found]
+
+    def tiles(self, sensor):
+        """
+        function to list all tiles of a sensor
+        """
+        found = self.conn.execute(
+            "SELECT DISTINCT tile FROM scenes WHERE sensor = ? ORDER BY tile", (sensor,)
+        )
+        return [row[0] for row in found]
+
+    def close(self):
+        self.conn.close()
+
+
+def open_catalog(inventory, sensor, db_path=None):
+    """
+    function to open the catalog of an inventory file,
+    the catalog is (re)built when the inventory changed
+    in: inventory, json or txt inventory file
+        sensor, key of PARSERS
+        db_path, catalog file, default is inventory + ".sqlite"
+    out: SceneCatalog
+    """
+    if db_path is None:
+        db_path = inventory + ".sqlite"
+    catalog = SceneCatalog(db_path)
+    if not catalog.is_current(sensor, inventory):
+        catalog.add_inventory(sensor, inventory)
+    return catalog
+
+
+def open_folder_catalog(roots, db_path):
+    """
+    function to open a catalog of folder trees and refresh it
+    in: roots, {sensor: root folder}, e.g. {"MOD11A1": ".../MOD11A1.006"}
+        db_path, catalog file
+    out: SceneCatalog
+    """
+    catalog = SceneCatalog(db_path)
+    for sensor, root in roots.items():
+        catalog.scan_folders(sensor, root)
+    return catalog
+
+
+def as_catalog(source, sensor):
+    """
+    function to get a catalog from what extractors receive as data source:
+    a SceneCatalog, a catalog file path, or a list of paths (indexed in memory)
+    """
+    if isinstance(source, SceneCatalog):
+        return source
+    if isinstance(source, str):
+        # sqlite would create an empty catalog, and no scene would be found
+        if not os.path.isfile(source):
+            raise FileNotFoundError("No scene catalog %s" % source)
+        return SceneCatalog(source)
+    catalog = SceneCatalog()
+    catalog.add(sensor, source)
+    return catalog
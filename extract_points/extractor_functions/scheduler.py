@@ -0,0 +1,98 @@
+"""
+functions to split extraction into (tile, scenes) tasks
+
+One task per tile leaves most workers idle while the largest tile runs.
+Tiles are split into chunks of consecutive scenes, sized so that every task
+costs about the same (points x scenes), and handed out largest first to the
+pool's work queue. Scenes of a chunk share the per tile caches, so a chunk is
+kept as long as the balance allows.
+"""
+import math
+from extractor_functions import scene_catalog
+from extractor_functions import shared_transport
+
+# number of tasks per worker the work is split into
+TASKS_PER_WORKER = 4
+
+
+def tile_key(sensor, tile):
+    """
+    function to convert a sampler tile key to a scene catalog tile key
+    """
+    if sensor == "landsat":
+        return "-".join(part.zfill(3) for part in tile.split("-"))
+    return tile
+
+
+def scene_tasks(
+    tile_dict, data_source, sensor, start_time, end_time, worker_num, checkpoint=None
+):
+    """
+    function to split tiles into (tile, scenes) tasks
+    in: tile_dict, {"tile1":[(lat1,lon1),(lat2,lon2),...], ...}
+        data_source, scene list or catalog file, see scene_catalog.as_catalog()
+        sensor, "landsat" or "sentinel"
+        start and end time in format YYYYMMDD
+        worker_num, number of worker processes
+        checkpoint, checkpoint.CheckpointStore, scenes already done are left out
+    out: list of ({"tile": points}, [scene1, scene2, ...]), largest first
+    """
+    catalog = scene_catalog.as_catalog(data_source, sensor)
+    tile_files = {}
+    for tile, points in tile_dict.items():
+        if tile is None or len(points) == 0:
+            continue
+        files = catalog.query(sensor, tile_key(sensor, tile), start_time, end_time)
+        if checkpoint is not None:
+            done = checkpoint.done(sensor, tile, points)
+            files = [f for f in files if f not in done]
+        if len(files) != 0:
+            tile_files[tile] = files
+
+    total_cost = sum(len(tile_dict[tile]) * len(f) for tile, f in tile_files.items())
+    task_cost = max(1, total_cost // (worker_num * TASKS_PER_WORKER))
+
+    tasks = []
+    for tile, files in tile_files.items():
+        points = tile_dict[tile]
+        chunk = max(1, math.ceil(task_cost / len(points)))
+        for i in range(0, len(files), chunk):
+            tasks.append(({tile: points}, files[i:i + chunk]))  # noqa : E203
+
+    tasks.sort(key=lambda task: len(task[1]) * len(list(task[0].values())[0]))
+    return tasks[::-1]
+
+
+def run_task(task, run_function):
+    """
+    function to run one (tile, scenes) task in a worker
+    in: task, ({"tile": points}, [scene1, ...])
+        run_function, extractor with time period bound, e.g.
+        functools.partial(extract_landsat_SR, start_time=..., end_time=...)
+    """
+    tile_dict, files = task
+    return run_function(tile_dict, data_source=files)
+
+
+def run_numbered_task(numbered_task, run_function):
+    """
+    function to run one task and return it with its number,
+    so results handed back out of order can be matched to their task
+    in: numbered_task, (number, task), e.g. from enumerate(tasks)
+    out: (number, result)
+    """
+    number, task = numbered_task
+    return number, run_task(task, run_function)
+
+
+def run_shared_task(numbered_descriptor, run_function):
+    """
+    function to run one task whose points are in shared memory,
+    see shared_transport.py
+    in: numbered_descriptor, (number, one of SharedPoints.descriptors)
+    out: (number, result block descriptor)
+    """
+    number, descriptor = numbered_descriptor
+    task, positions, name = shared_transport.task_points(descriptor)
+    returned = run_task(task, run_function)
+    return number, shared_transport.send_result(returned, positions, name)
@@ -0,0 +1,199 @@
+"""
+shared memory transport between the extractor pool and the parent process
+
+Pickling every tile's list of (lat, lon) tuples into the workers, and the
+results back, cost about as much as the extraction itself. Instead:
+    - the parent puts the points of all tasks into one shared (point, 2)
+      float64 array, tasks only carry (tile, start, stop) segments of it
+    - a worker writes its results into a new shared block laid out as
+          positions (point,) int64, index in the shared point array
+          valid     (point, scene) bool
+          values    (point, scene, band) float32
+      and hands back its name, shapes, date labels and failed scenes
+    - the parent copies the block into a ResultStore and unlinks it
+Result blocks are named after the point block and the task number, so the
+parent knows every block a worker may create, blocks of results it never
+received, e.g. when a run is stopped, are unlinked by SharedPoints.close().
+Only these small descriptors are pickled.
+"""
+from multiprocessing import shared_memory
+import numpy
+from extractor_functions.result_store import ResultStore
+from extractor_functions.geo_functions import get_latlon_key_vector
+
+# shared point arrays attached in this process, by block name
+_attached = {}
+
+
+class SharedPoints(object):
+    def __init__(self, tasks):
+        """
+        put the points of all tasks into one shared block
+        in: tasks, list of ({"tile": points}, [scene1, ...]),
+            see scheduler.scene_tasks(), tasks of a tile share its point list
+        """
+        segments = {}
+        coords = []
+        self.descriptors = []
+        for tile_dict, files in tasks:
+            task_segments = []
+            for tile, points in tile_dict.items():
+                if (tile, id(points)) not in segments:
+                    start = len(coords)
+                    coords.extend(points)
+                    segments[(tile, id(points))] = (start, len(coords))
+                task_segments.append((tile,) + segments[(tile, id(points))])
+            self.descriptors.append((task_segments, files))
+
+        self.coords = numpy.array(coords, dtype=numpy.float64).reshape(-1, 2)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(1, self.coords.nbytes)
+        )
+        shared = numpy.ndarray(self.coords.shape, numpy.float64, buffer=self.shm.buf)
+        shared[:] = self.coords
+        self.descriptors = [
+            (
+                self.shm.name,
+                self.coords.shape[0],
+                task_segments,
+                files,
+                "%s_%d" % (self.shm.name, number),
+            )
+            for number, (task_segments, files) in enumerate(self.descriptors)
+        ]
+        # result blocks not received yet
+        self.outstanding = set(descriptor[4] for descriptor in self.descriptors)
+        self._keys = None
+
+    def keys(self, positions):
+        """
+        function to get point ids of positions in the shared array
+        """
+        if self._keys is None:
+            self._keys = get_latlon_key_vector(self.coords)
+        return self._keys[numpy.asarray(positions, dtype=numpy.int64)].tolist()
+
+    def receive(self, descriptor):
+        """
+        function to copy a worker's result block into a ResultStore
+        and free the block
+        in: descriptor from send_result(), may be None
+        """
+        if descriptor is None:
+            return None
+        name, n_points, dates, band_keys, decimals, failed = descriptor
+        self.outstanding.discard(name)
+        if name is None:
+            # nothing extracted, only failed scenes
+            store = ResultStore([], band_keys, decimals)
+            store.failed_scenes = failed
+            return store
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            positions, valid, values = _result_arrays(
+                shm, n_points, len(dates), len(band_keys)
+            )
+            store = ResultStore.from_arrays(
+                self.keys(positions), band_keys, decimals, dates, values, valid
+            )
+        finally:
+            shm.close()
+            shm.unlink()
+        store.failed_scenes = failed
+        return store
+
+    def close(self):
+        """
+        function to free the point block and result blocks never received,
+        workers must have stopped
+        """
+        for name in self.outstanding:
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                # the task had no results, or never ran
+                continue
+            shm.close()
+            shm.unlink()
+        self.outstanding.clear()
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _result_arrays(shm, n_points, n_scenes, n_bands):
+    positions = numpy.ndarray((n_points,), numpy.int64, buffer=shm.buf)
+    offset = positions.nbytes
+    valid = numpy.ndarray((n_points, n_scenes), bool, buffer=shm.buf, offset=offset)
+    offset += valid.nbytes
+    values = numpy.ndarray(
+        (n_points, n_scenes, n_bands), numpy.float32, buffer=shm.buf, offset=offset
+    )
+    return positions, valid, values
+
+
+def task_points(descriptor):
+    """
+    function to get the points of a task in a worker
+    in: descriptor, one of SharedPoints.descriptors
+    out: ({"tile": [(lat1,lon1),...]}, [scene1, ...]),
+         positions, {point id: position in the shared array}
+         name of the task's result block, see send_result()
+    """
+    name, n_coords, task_segments, files, result_name = descriptor
+    if name not in _attached:
+        # blocks of earlier jobs are gone, keep only the current one
+        for shm, _ in _attached.values():
+            shm.close()
+        _attached.clear()
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (
+            shm,
+            numpy.ndarray((n_coords, 2), numpy.float64, buffer=shm.buf),
+        )
+    coords = _attached[name][1]
+
+    tile_dict = {}
+    positions = {}
+    for tile, start, stop in task_segments:
+        points = [tuple(cc) for cc in coords[start:stop].tolist()]
+        tile_dict[tile] = points
+        for i, key in enumerate(get_latlon_key_vector(points).tolist()):
+            positions.setdefault(key, start + i)
+    return (tile_dict, files), positions, result_name
+
+
+def send_result(store, positions, name):
+    """
+    function to write a worker's results into a new shared block
+    in: store, ResultStore returned by the extractor, may be None
+        positions, name, from task_points()
+    out: descriptor for SharedPoints.receive(), None for no results,
+         without a block when there are only failed scenes
+    """
+    if store is None:
+        return None
+    failed = list(store.failed_scenes)
+    if len(store) == 0:
+        if len(failed) == 0:
+            return None
+        return (None, 0, [], store.band_keys, store.decimals, failed)
+    store = store.take(list(store))  # observed points and scenes only
+    n_points, n_scenes, n_bands = store.values.shape
+    size = n_points * (8 + n_scenes + 4 * n_scenes * n_bands)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, size))
+    positions_out, valid, values = _result_arrays(shm, n_points, n_scenes, n_bands)
+    positions_out[:] = [positions[key] for key in store.point_keys.tolist()]
+    valid[:] = store.valid
+    values[:] = store.values
+    descriptor = (
+        shm.name,
+        n_points,
+        store.dates.tolist(),
+        store.band_keys,
+        store.decimals,
+        failed,
+    )
+    # the parent unlinks the block once it is copied
+    del positions_out, valid, values
+    shm.close()
+    return descriptor
@@ -1,23 +1,26 @@
 import glob
 import os
+import sys
 import json
 import pprint
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "extract_points"))
+from extractor_functions.scene_catalog import open_catalog  # noqa: E402
+
 
 def main(tile_js, path_js):
 
     with open(tile_js, 'r') as f:
         tiles = json.load(f)
 
-    with open(path_js, 'r') as ff:
-        paths = json.load(ff)
+    catalog = open_catalog(path_js, 'landsat')
 
     home = os.path.expanduser('~')
     tiles_path = []
     for tile in tiles:
         print('processing '+tile)
-        tilee = tile.split('/')[0].zfill(3)+tile.split('/')[1].zfill(3)
-        tile_path = [x for x in paths if tilee in x]
+        tilee = tile.split('/')[0].zfill(3)+'-'+tile.split('/')[1].zfill(3)
+        tile_path = catalog.query('landsat', tilee, '00000000', '99999999')
         print(len(tile_path))
         tile_path = [x for x in tile_path if 'LC08' in x]
         print(len(tile_path))
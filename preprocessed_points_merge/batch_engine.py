@@ -0,0 +1,86 @@
+"""
+array engine of the preprocessor, a whole file of points at once
+
+The preprocessor used to loop over points and bands, truncating, de-duplicating,
+filling and interpolating one list of (date, value) tuples at a time. Here all
+series of a file are one array
+    cube: (point, day, band) float64, nan where a day has no observation
+on a daily axis from start to end day, see calendar_axis.date_axis(), and
+every step works along the day axis (axis 1) of the whole cube:
+
+    axis = calendar_axis.date_axis("20180401", "20181001")
+    cols = calendar_axis.axis_columns(calendar_axis.to_days(dates), axis)
+    cube = scatter(rows, cols, bands, values, shape)
+    cube = smooth(interpolate(cube), window, polyorder)
+"""
+import numpy as np
+from scipy.signal import savgol_filter
+
+
+def scatter(rows, cols, bands, values, shape):
+    """
+    function to put observations onto the cube, observations of a point
+    and band on the same day are averaged
+    in: rows, cols, bands, values, (observation,) arrays,
+        observations with col -1 are left out
+        shape, (point, day, band)
+    out: cube, nan where there is no observation
+    """
+    inside = cols >= 0
+    index = (rows[inside], cols[inside], bands[inside])
+    sums = np.zeros(shape)
+    counts = np.zeros(shape)
+    np.add.at(sums, index, values[inside])
+    np.add.at(counts, index, 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def normalize(cube, norm_range):
+    """
+    function to scale values to 0..1
+    in: norm_range, [upper, lower]
+    """
+    cube = (cube - norm_range[1]) / (norm_range[0] - norm_range[1])
+    return np.clip(cube, 0, 1)
+
+
+def interpolate(cube):
+    """
+    function to fill nan days linearly between their valid neighbours,
+    days before the first and after the last valid day take its value,
+    series without any valid day stay nan
+    """
+    n_days = cube.shape[1]
+    valid = ~np.isnan(cube)
+    day = np.arange(n_days).reshape(1, -1, 1)
+    prev_day = np.maximum.accumulate(np.where(valid, day, -1), axis=1)
+    next_day = np.minimum.accumulate(
+        np.where(valid, day, n_days)[:, ::-1], axis=1
+    )[:, ::-1]
+    # edges take the only neighbour there is
+    prev_day, next_day = (
+        np.where(prev_day < 0, next_day, prev_day),
+        np.where(next_day == n_days, prev_day, next_day),
+    )
+    prev_value = np.take_along_axis(cube, np.clip(prev_day, 0, n_days - 1), axis=1)
+    next_value = np.take_along_axis(cube, np.clip(next_day, 0, n_days - 1), axis=1)
+    span = next_day - prev_day
+    weight = np.where(span > 0, (day - prev_day) / np.maximum(span, 1), 0)
+    return prev_value + weight * (next_value - prev_value)
+
+
+def smooth(cube, window_length, polyorder):
+    """
+    function to run the SG filter along the day axis of all series at once,
+    series without any valid day stay nan
+    """
+    empty = np.isnan(cube)
+    result = savgol_filter(
+        np.where(empty, 0, cube),
+        window_length=window_length,
+        polyorder=polyorder,
+        axis=1,
+    )
+    result[empty] = np.nan
+    return result
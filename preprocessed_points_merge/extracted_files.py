@@ -0,0 +1,188 @@
+"""
+memory mapped, random access reading of extracted npz files
+
+np.load reads an npz member whole on access, even when only the rows of a
+few sampled points are used. Typed chunk files (see
+extract_points/extractor_functions/result_writer.py) are written uncompressed
+by np.savez, so every member is a plain .npy block at some offset of the zip
+file and can be mapped in place:
+
+    files = open_npz(file_path)
+    values = files["values"][rows]   # reads only these rows from disk
+
+Compressed members, scalars and empty arrays are loaded with np.load, object
+arrays are left out. Old files of pickled (point, {band: [(date, value)]})
+records, arr_0, are converted once to a record file with an offset index:
+
+    python extracted_files.py [folder]    # default EXTRACTED_PATH
+
+RECORD FILE CONVENTION:
+    points: (point,) point ids, or the keys of the old records
+    bands: (band,) band names
+    has_band: (point, band) bool, False where a record had no such band
+    offsets: (point + 1,) int64, observations of point i are offsets[i]:offsets[i+1]
+    days: (obs,) int32 day ordinals, see calendar_axis.py
+    band_index: (obs,) int16, column of bands
+    values: (obs,) float64
+"""
+import os
+import sys
+import struct
+import zipfile
+import numpy as np
+from os.path import join
+
+sys.path.append(
+    join(os.path.dirname(os.path.realpath(__file__)), "..", "extract_points")
+)
+from extractor_functions import calendar_axis  # noqa : E402
+
+# size of the fixed part of a zip local file header
+LOCAL_HEADER = 30
+
+
+def _member_offset(fid, info):
+    """
+    function to get the offset of a zip member's data in the file
+    """
+    fid.seek(info.header_offset)
+    header = fid.read(LOCAL_HEADER)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    return info.header_offset + LOCAL_HEADER + name_length + extra_length
+
+
+def npz_headers(file_path):
+    """
+    function to read the array headers of an npz file, no data is read
+    out: {name: (shape, dtype, fortran order, data offset)},
+         offset is None for compressed members
+    """
+    headers = {}
+    with zipfile.ZipFile(file_path) as archive:
+        members = archive.infolist()
+        with open(file_path, "rb") as fid:
+            for info in members:
+                name = info.filename[: -len(".npy")]
+                if info.compress_type == zipfile.ZIP_STORED:
+                    fid.seek(_member_offset(fid, info))
+                    member = fid
+                else:
+                    member = archive.open(info)
+                version = np.lib.format.read_magic(member)
+                if version == (1, 0):
+                    header = np.lib.format.read_array_header_1_0(member)
+                else:
+                    header = np.lib.format.read_array_header_2_0(member)
+                shape, fortran, dtype = header
+                offset = fid.tell() if member is fid else None
+                headers[name] = (shape, dtype, fortran, offset)
+    return headers
+
+
+def open_npz(file_path):
+    """
+    function to open the arrays of an npz file, memory mapped where possible
+    out: {name: array}
+    """
+    arrays = {}
+    headers = npz_headers(file_path)
+    with np.load(file_path) as loaded:
+        for name, (shape, dtype, fortran, offset) in headers.items():
+            if dtype.hasobject:
+                continue
+            if offset is None or len(shape) == 0 or 0 in shape:
+                arrays[name] = loaded[name]
+                continue
+            arrays[name] = np.memmap(
+                file_path,
+                dtype=dtype,
+                mode="r",
+                shape=shape,
+                order="F" if fortran else "C",
+                offset=offset,
+            )
+    return arrays
+
+
+def read_rows(files, rows):
+    """
+    function to read the observations of some points of a record file,
+    sorted rows are read front to back
+    in: files, from open_npz(), rows, (row,) int point rows
+    out: obs_rows, (obs,) position in rows of every observation
+         days, band_index, values, (obs,) of the observations
+    """
+    offsets = np.asarray(files["offsets"])
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    obs_rows = np.repeat(np.arange(rows.shape[0]), lengths)
+    # position of every observation in the flat arrays
+    index = np.arange(int(lengths.sum())) + np.repeat(
+        starts - (np.cumsum(lengths) - lengths), lengths
+    )
+    return (
+        obs_rows,
+        np.asarray(files["days"][index]),
+        np.asarray(files["band_index"][index]),
+        np.asarray(files["values"][index]),
+    )
+
+
+def flatten_records(data):
+    """
+    function to convert pickled records to the arrays of a record file
+    in: data, [(point, {band: [(date, value), ...]}), ...]
+    out: {name: array}, see RECORD FILE CONVENTION
+    """
+    bands = sorted(set(band for entry in data for band in entry[1]))
+    has_band = np.zeros((len(data), len(bands)), dtype=bool)
+    lengths, dates, band_index, values = [], [], [], []
+    for i, (_, data_entry) in enumerate(data):
+        n_obs = 0
+        for b, band in enumerate(bands):
+            if band not in data_entry:
+                continue
+            has_band[i, b] = True
+            data_series = data_entry[band]
+            n_obs += len(data_series)
+            band_index += [b] * len(data_series)
+            dates += [dp[0] for dp in data_series]
+            values += [dp[1] for dp in data_series]
+        lengths.append(n_obs)
+    return {
+        "points": np.asarray([entry[0] for entry in data]),
+        "bands": np.array(bands, dtype=str),
+        "has_band": has_band,
+        "offsets": np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+        "days": calendar_axis.to_days(dates).astype(np.int32),
+        "band_index": np.asarray(band_index, dtype=np.int16),
+        "values": np.asarray(values, dtype=np.float64),
+    }
+
+
+def convert_records(file_path):
+    """
+    function to rewrite a pickled arr_0 file as a record file, in place
+    out: True if the file was converted
+    """
+    if "arr_0" not in npz_headers(file_path):
+        return False
+    # the only place pickled files are still read
+    with np.load(file_path, allow_pickle=True) as loaded:
+        records = flatten_records(loaded["arr_0"])
+    tmp_file = file_path[: -len(".npz")] + ".tmp.npz"
+    np.savez(tmp_file, **records)
+    os.replace(tmp_file, file_path)
+    return True
+
+
+if __name__ == "__main__":
+    from settings import EXTRACTED_PATH
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else EXTRACTED_PATH
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith(".npz") or file_name.endswith("point_table.npz"):
+            continue
+        if convert_records(join(folder, file_name)):
+            print("converted", file_name)
@@ -1,19 +1,23 @@
 # from waterwheel.file_read_tools.reader_settings import SAT_NODATA_DICT
 import os
+import sys
 import json
 import copy
 import logging
-import datetime
 import cv2
 import gdal
 import numpy as np
-import pandas as pd
 from scipy.signal import savgol_filter
 from os.path import join
 
 HOME_DIR = os.path.expanduser("~")
 from waterwheel.geo_tools.raster_tool import RasterTool
 
+sys.path.append(
+    join(os.path.dirname(os.path.realpath(__file__)), "..", "extract_points")
+)
+from extractor_functions import calendar_axis  # noqa : E402
+
 
 class interpolation:
     logging.basicConfig(level=logging.DEBUG)
@@ -75,15 +79,13 @@ class interpolation:
 
         self.ndvi_list.sort()
         self.time_list = [i[0] for i in self.ndvi_list]
-        self.original_time_order = list(
-            map(self._ymd_to_jd, self.time_list)
-        )  # YMD to order
-        nidx = pd.date_range(
-            self.time_list[0], self.time_list[-1], freq="1D"
-        )  # time index
-        new_time_tmp = nidx.to_pydatetime()
-        new_time = [tmp.strftime("%Y%m%d") for tmp in new_time_tmp]
-        self.new_time_order = list(map(self._ymd_to_jd, new_time))
+        # YMD to order, of the scenes and of every day between them
+        self.original_time_order = calendar_axis.day_of_year(
+            calendar_axis.to_days(self.time_list)
+        ).tolist()
+        self.new_time_order = calendar_axis.day_of_year(
+            calendar_axis.date_axis(self.time_list[0], self.time_list[-1])
+        ).tolist()
 
     def _load_json(self, file):
         with open(file) as f:
@@ -91,10 +93,7 @@ class interpolation:
         return res
 
     def _ymd_to_jd(self, str_time):
-        fmt = "%Y%m%d"
-        dt = datetime.datetime.strptime(str_time, fmt)
-        tt = dt.timetuple()
-        return tt.tm_yday
+        return int(calendar_axis.day_of_year(calendar_axis.to_days(str_time)))
 
     def tif_to_arr(self) -> list:
         """
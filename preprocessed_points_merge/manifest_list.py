@@ -15,6 +15,7 @@ manifest_regular_short = [
 ]
 
 QUANTITY = 2000  # PER YEAR PER CROP
+SEED = 0  # SAME POINTS OF A FILE ON EVERY RUN, None FOR A NEW SAMPLE
 MANIFEST_PREP = manifest_regular_short
 
 MODEL_DATA_TYPE = REF_TYPES_L  # + LST_TYPES + PRECIP_TYPES  # noqa :F405
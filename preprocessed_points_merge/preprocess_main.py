@@ -19,8 +19,8 @@ class BatchRun():
         combiner(train_years, test_year, start_day, end_day, sg_win, sg_poly,
                  MODEL_NOTE)
 
-    def run(self, func, manifest):
-        Parallel(n_jobs=2, prefer='processes', verbose=15)(
+    def run(self, func, manifest, n_jobs=2):
+        Parallel(n_jobs=n_jobs, prefer='processes', verbose=15)(
             delayed(func)(process_item)
             for process_item in manifest)
 
@@ -29,14 +29,16 @@ if __name__ == '__main__':
     B = BatchRun()
     if PROCESS_STATE == 0:
         print("Total file to be pre-processed: ", len(MANIFEST_PREP))  # noqa :F405
-        B.run(B.batch_processor, MANIFEST_PREP)
+        # files of an item are processed in parallel, see Preprocessor.batch_run
+        B.run(B.batch_processor, MANIFEST_PREP, n_jobs=1)
         print("Finish processing!")
         print("Start pre-training...")
         B.run(B.batch_pretrain, MANIFEST_PRET)
         print("= = = DONE = = =")
     elif PROCESS_STATE == 1:
         print("Total file to be pre-processed: ", len(MANIFEST_PREP))  # noqa :F405
-        B.run(B.batch_processor, MANIFEST_PREP)
+        # files of an item are processed in parallel, see Preprocessor.batch_run
+        B.run(B.batch_processor, MANIFEST_PREP, n_jobs=1)
         print("Finish processing!")
     else:
         print("Start pre-training...")
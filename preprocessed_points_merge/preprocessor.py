@@ -2,17 +2,46 @@ from settings import *  # noqa :F403
 from manifest_list import *  # noqa :F403
 
 import os
+import sys
 import pprint
-import random
+import zlib
+import multiprocessing
 import numpy as np
-import pandas as pd
-from scipy.signal import savgol_filter
+import batch_engine
+import extracted_files
 from joblib import Parallel, delayed
-import datetime
 
 from os.path import join
 from math import floor
 
+sys.path.append(
+    join(os.path.dirname(os.path.realpath(__file__)), "..", "extract_points")
+)
+from extractor_functions import calendar_axis  # noqa : E402
+
+# memory per (point, day, type) cell of a file being processed: the cube,
+# its interpolation temporaries and the (date, value) records of the output
+CELL_BYTES = 160
+# memory per (point, scene, band) value of the sampled rows of a file
+SCENE_BYTES = 16
+# pickled arr_0 files take about this many times their size once loaded
+PICKLE_EXPANSION = 8
+# share of the available memory the workers of batch_run may take
+MEMORY_FRACTION = 0.7
+
+
+def available_memory():
+    """memory available to new processes, in bytes"""
+    try:
+        with open("/proc/meminfo") as fid:
+            for line in fid:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
 printer = pprint.PrettyPrinter(indent=3)
 
 """
@@ -22,7 +51,7 @@ fit into models, also it includes the following purposes:
     2. To smooth the data with SG filter
 Input is dict of dicts dicts (data_list), the following is the input sample:
 [
-    [("lat1, lon1"),
+    [id1,
         {
             "S_R_band": [(20170101, 1)...(20171001, 2)],
             "S_G_band": ...
@@ -31,7 +60,7 @@ Input is dict of dicts dicts (data_list), the following is the input sample:
              note this lst is averaged with day and night, and averaged with MOD and MYD
             "TRMM_GPM": ...
         }]
-    [(lat2, lon2),
+    [id2,
         {
             ...
         }]
@@ -39,11 +68,16 @@ Input is dict of dicts dicts (data_list), the following is the input sample:
 The wrapped input are npz files saved to a dedicated locations,
 the naming convention is:
     YEAR_CROPTYPE_SERIAL.npz, for example, 2017_corn_1.npz
+holding typed chunk arrays or records with an offset index, old pickled
+records are converted once, see extracted_files.py, a seeded random sample of
+points is read from a file without loading the rest
 the output should also be wrapped with the following requirements:
     1. saved to pre-defined locations
     2. with pre-defined naming conventions
 Terminology:
-data_list: list of list of (coordinate, data_list)
+data_list: list of list of (coordinate, data_list),
+           coordinate is the integer point id of the extracted files, their
+           lat/lon are in YEAR_CROPTYPE_point_table.npz next to them
 data_entry: one data_list entry in data_list
 data_series: list of time-series tuples of given
              data type in a single entry in data_list
@@ -60,6 +94,7 @@ class Preprocessor:
             end_day="1001",
             sg_window=33,
             sg_polyorder=2,
+            seed=SEED,  # noqa :F405
     ):
         self.year = year
         self.crop_type = crop_type
@@ -67,100 +102,161 @@ class Preprocessor:
         self.end_day = year + end_day
         self.sg_window = sg_window
         self.sg_polyorder = sg_polyorder
+        # seed of the points sampled from a file, None for a new sample every run
+        self.seed = seed
         # self.process_types = REF_TYPES_L + LST_TYPES + PRECIP_TYPES  # noqa :F405
         self.process_types = REF_TYPES_L  # noqa :F405
         # if year > "2015":
         #     self.process_types += REF_TYPES_S  # noqa :F405
         self.normalize_range = {"MODIS_LST": [320, 260], "TRMM_GPM": [30, 0]}
+        # daily axis of all series as day ordinals and YYYYMMDD labels,
+        # shared by all preprocessors of the window, see calendar_axis.py
+        self.days = calendar_axis.date_axis(self.start_day, self.end_day)
+        self.day_list = calendar_axis.date_labels(self.start_day, self.end_day)
 
     def _get_file_list(self):
         file_list = []
         year_crop = self.year + "_" + self.crop_type
         file_list_tot = os.listdir(EXTRACTED_PATH)  # noqa :F405
         for file_name in file_list_tot:
+            if file_name.endswith("point_table.npz"):
+                continue  # lat/lon of the point ids, not data
             if year_crop in file_name:
                 file_list.append(file_name)
         print(file_list)
         return file_list
 
-    def _load_files(self, file_name):
-        """this function automatically loads appropriate files"""
-        file_path = join(EXTRACTED_PATH, file_name)  # noqa :F405
-        print("Processing file...", file_name)
-        data = np.load(file_path)["arr_0"]  # shape should be (10000, 2)
-        return data
+    def _sample_rows(self, file_name, n_points, quantity):
+        """rows of at most quantity random points of a file, sorted,
+             with a seed the sample of a file is the same on every run"""
+        if quantity >= n_points:
+            return np.arange(n_points)
+        if self.seed is None:
+            rng = np.random.default_rng()
+        else:
+            rng = np.random.default_rng([self.seed, zlib.crc32(file_name.encode())])
+        return np.sort(rng.choice(n_points, quantity, replace=False))
 
-    def _normalize_data(self, data_series, data_type, norm_range):
-        """truncate the data series to specified day range"""
-        new_series = []
-        for dp in data_series:
-            new_value = (dp[1] - norm_range[1]) / (norm_range[0] - norm_range[1])
-            if new_value < 0:
-                new_value = 0
-            elif new_value > 1:
-                new_value = 1
-            new_series.append((dp[0], new_value))
-        return new_series
-
-    def _truncate_data(self, data_series):
-        """truncate the data list to fit in the given
-             time range defined in init function"""
-        return [
-            (dp[0], dp[1])
-            for dp in data_series
-            if dp[0] >= self.start_day and dp[0] <= self.end_day
-        ]
-
-    def _fill_time_with_nan(self, data_series):
-        """fill missing data days of given date range with
-               nan value, in order to be interpolated"""
-        day_list = []
-        day_list.append(self.start_day)
-        next_day = datetime.datetime.strptime(self.start_day, "%Y%m%d")
-        while next_day < datetime.datetime.strptime(self.end_day, "%Y%m%d"):
-            next_day = next_day + datetime.timedelta(days=1)
-            day_list.append(next_day.strftime("%Y%m%d"))
+    def _records_cube(self, files, rows):
+        """scatter the observations of some rows of a record file,
+             see extracted_files.py, onto the cube"""
+        band_list = files["bands"].tolist()
+        # column of every band of the file in process_types, -1 if not processed
+        type_cols = np.array(
+            [
+                self.process_types.index(b) if b in self.process_types else -1
+                for b in band_list
+            ],
+            dtype=np.int64,
+        )
+        obs_rows, days, band_index, values = extracted_files.read_rows(files, rows)
+        types = type_cols[band_index]
+        cols = calendar_axis.axis_columns(days, self.days)
+        cols[types < 0] = -1
+        cube = batch_engine.scatter(
+            obs_rows,
+            cols,
+            types,
+            values,
+            (rows.shape[0], len(self.days), len(self.process_types)),
+        )
+        has_type = np.zeros((rows.shape[0], len(self.process_types)), dtype=bool)
+        file_has = np.asarray(files["has_band"])[rows]
+        for b, t in enumerate(type_cols.tolist()):
+            if t >= 0:
+                has_type[:, t] = file_has[:, b]
+        return cube, has_type
 
-        data_days = [x[0] for x in data_series]
-        valid_data = [(x[0], x[1]) for x in data_series if x[0] in data_days]
-        """be careful, only to process reflectance"""
-        missing_days = [x for x in day_list if x not in data_days]
+    def _load_files(self, file_name, quantity):
+        """this function automatically loads appropriate files,
+             at most quantity random points of them, as a cube of
+             process_types on the day axis, see batch_engine.py
+        out: points, (point,) ids
+             cube, (point, day, type) float64, nan for days without data
+             has_type, (point, type) bool, False where a type is missing"""
+        file_path = join(EXTRACTED_PATH, file_name)  # noqa :F405
+        print("Processing file...", file_name)
+        if "arr_0" in extracted_files.npz_headers(file_path):
+            print("Pickled records, convert them once with extracted_files.py")
+            with np.load(file_path, allow_pickle=True) as loaded:
+                data = loaded["arr_0"]  # shape should be (10000, 2)
+            rows = self._sample_rows(file_name, len(data), quantity)
+            records = extracted_files.flatten_records(data[rows])
+            del (data)
+            cube, has_type = self._records_cube(records, np.arange(rows.shape[0]))
+            return records["points"], cube, has_type
 
-        new_series = []
-        missing_data = [(d, np.nan) for d in missing_days]
+        # typed arrays are memory mapped, only sampled rows are read
+        files = extracted_files.open_npz(file_path)
+        points = files["points"]
+        rows = self._sample_rows(file_name, points.shape[0], quantity)
+        if "offsets" in files:
+            cube, has_type = self._records_cube(files, rows)
+            return np.asarray(points[rows]), cube, has_type
 
-        new_series += missing_data
-        new_series += valid_data
-        new_series.sort()
-        return new_series
+        # typed chunk files, see extractor_functions/result_writer.py
+        dates, bands = files["dates"], files["bands"]
+        if "days" in files:
+            days = files["days"]
+        else:
+            days = calendar_axis.to_days(dates)
+        band_list = bands.tolist()
+        file_bands = [band_list.index(t) for t in self.process_types if t in band_list]
+        has_type = np.isin(self.process_types, band_list)
+        values = files["values"][rows][:, :, file_bands]
+        values = np.around(values.astype(np.float64), decimals=int(files["decimals"]))
+        # nan for bands a joined source did not observe, see ensemble.py
+        observed = files["valid"][rows][:, :, None] & ~np.isnan(values)
+        point_index, scene_index, band_index = np.nonzero(observed)
+        cube = batch_engine.scatter(
+            point_index,
+            calendar_axis.axis_columns(days, self.days)[scene_index],
+            np.flatnonzero(has_type)[band_index],
+            values[observed],
+            (rows.shape[0], len(self.days), len(self.process_types)),
+        )
+        has_type = np.repeat(has_type[None, :], rows.shape[0], axis=0)
+        return np.asarray(points[rows]), cube, has_type
 
-    def _remove_duplicates(self, data_series):
-        """remove possible duplicated values in data_series"""
-        new_series = []
-        tmp_recorder = {}
-        for dp in data_series:
-            if dp[0] not in tmp_recorder.keys():
-                tmp_recorder[dp[0]] = [dp[1]]
-            else:
-                tmp_recorder[dp[0]].append(dp[1])
-        for data_day in tmp_recorder.keys():
-            # MARK: taking average of duplicated values
-            new_series.append((data_day, np.mean(tmp_recorder[data_day])))
-        new_series.sort()
-        return new_series
+    def _process_cube(self, cube):
+        """normalize LST and precip data, interpolate and smooth
+             all other types, along the day axis of the whole cube"""
+        for t, data_type in enumerate(self.process_types):
+            if data_type in (LST_TYPES + PRECIP_TYPES):  # noqa :F405
+                cube[:, :, t] = batch_engine.normalize(
+                    cube[:, :, t], self.normalize_range[data_type]
+                )
+        """do not interpolate precip data"""
+        smooth = [
+            t
+            for t, data_type in enumerate(self.process_types)
+            if data_type not in PRECIP_TYPES  # noqa :F405
+        ]
+        if len(smooth) != 0:
+            cube[:, :, smooth] = batch_engine.smooth(
+                batch_engine.interpolate(cube[:, :, smooth]),
+                self.sg_window,
+                self.sg_polyorder,
+            )
+        return cube
 
-    def _interpolate_and_sg(self, data_series):
-        """interpolate the data to convert nan values to interpolated values"""
-        datestr = list(zip(*data_series))[0]
-        valuestr = list(zip(*data_series))[1]
-        valuestr = pd.Series(valuestr)
-        value_interp = valuestr.interpolate(method="linear", limit_direction="both")
-        # MARK: pay attention to limit_direction
-        sg_result = savgol_filter(
-            value_interp, window_length=self.sg_window, polyorder=self.sg_polyorder
-        )
-        result = list(zip(datestr, sg_result))
-        return result
+    def _to_data_list(self, points, cube, has_type):
+        """convert the cube back to (coordinate, data_entry) items,
+             points missing a type are left out"""
+        day_list = self.day_list.tolist()
+        new_data_list = []
+        for i in np.flatnonzero(has_type.all(axis=1)).tolist():
+            new_data_entry = {}
+            for t, data_type in enumerate(self.process_types):
+                series = cube[i, :, t].tolist()
+                if data_type in PRECIP_TYPES:  # noqa :F405
+                    new_data_entry[data_type] = [
+                        dp for dp in zip(day_list, series) if dp[1] == dp[1]
+                    ]
+                else:
+                    new_data_entry[data_type] = list(zip(day_list, series))
+            new_data_list.append((points[i].item(), new_data_entry))
+        return new_data_list
 
     def single_run(self, file_name, quantity):
         """run the whole process for a single npz file"""
@@ -188,65 +284,63 @@ class Preprocessor:
             print(file_name, "already processed")
             return
 
-        data_list = self._load_files(file_name)
-        # print(type(data_list))
-        if quantity < len(data_list):
-            random_index = random.sample(range(0, len(data_list)), quantity)
-            data_list = data_list[random_index]
-
-        new_data_list = []
-        for list_index in range(0, len(data_list) - 1):
-            # if list_index % 1000 == 0:
-            #     print('Processing ', list_index, 'out of ', len(data_list))
-
-            bad_entry = 0
-            # print(list_index, type(data_list), len(data_list))
-            list_item = data_list[list_index]
-            coordinate, data_entry = list_item
-            new_data_entry = {}
-
-            for data_type in self.process_types:
-                try:
-                    data_series = data_entry[data_type]
-                except KeyError as e:
-                    bad_entry = 1
-                    print(data_type, bad_entry)
-                    continue
-                # if eval(data_series[-1][0]) < 20180730:
-                #     print('NOT ENOUGH SAMPLES: ', coordinate, save_name)
-                #     bad_entry = 1
-                #     break
-                data_series = self._truncate_data(data_series)
-                data_series = self._remove_duplicates(data_series)
-
-                """need to normalize LST and precip data"""
-                if data_type in (LST_TYPES + PRECIP_TYPES):  # noqa :F405
-                    data_series = self._normalize_data(
-                        data_series, data_type, self.normalize_range[data_type]
-                    )
-
-                """do not interpolate precip data"""
-                if data_type not in PRECIP_TYPES:  # noqa :F405
-                    data_series = self._fill_time_with_nan(data_series)
-                    data_series = self._interpolate_and_sg(data_series)
-
-                new_data_entry[data_type] = data_series
-
-            if bad_entry == 0:
-                new_list_item = (coordinate, new_data_entry)
-                new_data_list.append(new_list_item)
+        points, cube, has_type = self._load_files(file_name, quantity)
+        missing = len(points) - int(has_type.all(axis=1).sum())
+        if missing != 0:
+            print(missing, "points miss a data type, left out")
+        cube = self._process_cube(cube)
+        new_data_list = self._to_data_list(points, cube, has_type)
 
         print('results:', len(new_data_list))
         np.savez(join(PREPROCESSED_PATH, save_name), new_data_list)  # noqa :F405
-        # print(new_data_list)
-        data_list = None
+        del (cube, new_data_list)
         return
 
-    def batch_run(self):
+    def _file_memory(self, file_name, quantity):
+        """estimate the peak memory of single_run on a file, in bytes"""
+        file_path = join(EXTRACTED_PATH, file_name)  # noqa :F405
+        headers = extracted_files.npz_headers(file_path)
+        n_cells = len(self.days) * len(self.process_types)
+        if "values" not in headers:
+            # pickled records are loaded whole
+            return (
+                PICKLE_EXPANSION * os.path.getsize(file_path)
+                + quantity * n_cells * CELL_BYTES
+            )
+        if "offsets" in headers:
+            # record files, observations of the sampled points only
+            n_points, n_obs = headers["points"][0][0], headers["values"][0][0]
+            sampled = min(n_points, quantity)
+            return sampled * n_cells * CELL_BYTES + (
+                n_obs * sampled // max(1, n_points) * SCENE_BYTES
+            )
+        n_points, n_scenes, n_bands = headers["values"][0]
+        return min(n_points, quantity) * (
+            n_cells * CELL_BYTES + n_scenes * n_bands * SCENE_BYTES
+        )
+
+    def _worker_num(self, file_list, quantity):
+        """number of files processed at once, as many as there are cores
+             while the largest files fit into the available memory"""
+        if len(file_list) == 0:
+            return 1
+        largest = max(self._file_memory(f, quantity) for f in file_list)
+        by_memory = int(MEMORY_FRACTION * available_memory() // max(1, largest))
+        return max(1, min(multiprocessing.cpu_count(), len(file_list), by_memory))
+
+    def batch_run(self, n_jobs=None):
+        """run single_run on all files of the year and crop type,
+             files are processed in parallel, n_jobs files at a time,
+             by default as many as cores and memory allow"""
         file_list = self._get_file_list()
-        for file_name in file_list:
-            # self.single_run(file_name, floor(QUANTITY / len(file_list)))  # noqa :F405
-            self.single_run(file_name, QUANTITY)  # noqa :F405
+        if n_jobs is None:
+            n_jobs = self._worker_num(file_list, QUANTITY)  # noqa :F405
+        print("Processing", len(file_list), "files with", n_jobs, "workers")
+        # self.single_run(file_name, floor(QUANTITY / len(file_list)))  # noqa :F405
+        Parallel(n_jobs=n_jobs, prefer="processes", verbose=5)(
+            delayed(self.single_run)(file_name, QUANTITY)  # noqa :F405
+            for file_name in file_list
+        )
 
 
 # if __name__ == "__main__":
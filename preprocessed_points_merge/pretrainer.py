@@ -61,6 +61,7 @@ def single_combine(year, start_day, end_day, sg_win, sg_poly):
     print(file_list)
     batch_x = []
     batch_y = []
+    batch_id = []
     for filename in file_list:
         print('Processing', filename)
         crop_type = filename.split('_')[1]
@@ -84,13 +85,16 @@ def single_combine(year, start_day, end_day, sg_win, sg_poly):
                 continue
             batch_x.append(layer)
             batch_y.append(indicator)
+            batch_id.append(coordinate)
 
-    return np.asarray(batch_x, dtype=np.float32), np.asarray(batch_y)
+    return np.asarray(batch_x, dtype=np.float32), np.asarray(batch_y), \
+        np.asarray(batch_id)
 
 
 def combiner(train_years, test_year, start_day, end_day, sg_win, sg_poly, note='REG'):
     batch_x_train = []
     batch_y_train = []
+    batch_id_train = []
 
     train_label, test_label = label_maker(
         train_years, test_year, start_day, end_day, sg_win, sg_poly, note
@@ -99,22 +103,30 @@ def combiner(train_years, test_year, start_day, end_day, sg_win, sg_poly, note='
     test_filename = test_label + '.npz'
 
     for year in train_years:
-        batch_x, batch_y = single_combine(year, start_day, end_day, sg_win, sg_poly)
+        batch_x, batch_y, batch_id = single_combine(
+            year, start_day, end_day, sg_win, sg_poly
+        )
         try:
             batch_x_train = np.concatenate((batch_x_train, batch_x), axis=0)
             batch_y_train = np.concatenate((batch_y_train, batch_y), axis=0)
+            batch_id_train = np.concatenate((batch_id_train, batch_id), axis=0)
         except ValueError:
             batch_x_train = batch_x
             batch_y_train = batch_y
+            batch_id_train = batch_id
 
-    batch_x, batch_y = single_combine(test_year, start_day, end_day, sg_win, sg_poly)
+    batch_x, batch_y, batch_id = single_combine(
+        test_year, start_day, end_day, sg_win, sg_poly
+    )
     batch_x_test = batch_x
     batch_y_test = batch_y
+    batch_id_test = batch_id
 
+    # point ids of the samples, lat/lon in the point tables of the extracted files
     np.savez(join(PRETRAIN_PATH, train_filename), features=batch_x_train,
-             labels=batch_y_train)
+             labels=batch_y_train, point_ids=batch_id_train)
     np.savez(join(PRETRAIN_PATH, test_filename), features=batch_x_test,
-             labels=batch_y_test)
+             labels=batch_y_test, point_ids=batch_id_test)
 
 
 # def batch_run():
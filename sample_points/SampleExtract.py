@@ -7,6 +7,8 @@ OUTPUT: npz file contain the sample points position, e.g.
     [
     {'tile_id':[(lat1, lon1), (lat2, lon2), ...]}
     ]
+    plus 'points': {'ids': ..., 'lat': ..., 'lon': ...}, integer ids of the points
+    in the global registry of the folder, see extractor_functions/point_registry.py
 file path: e.g. data_pool/U-TMP/excersize/sample_points/2017_Rice_023-035_sample_points_c.npz
 """
 import os
@@ -19,6 +21,11 @@ import logging
 import subprocess
 import numpy as np
 from shapely import geometry
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "extract_points")
+)
+from extractor_functions.point_registry import REGISTRY_FILE  # noqa : E402
+from extractor_functions.point_registry import register_samples  # noqa : E402
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger()
 
@@ -325,6 +332,7 @@ if __name__ == '__main__':
                 npz_name = year + '_' + crop_type + '_' + region + '_sample_points_c.npz'
                 npz_path = os.path.join(home_dir, root_path, 'sample_points', npz_name)
                 print('RESULT PATH:', npz_path)
+                register_samples(DICT, os.path.join(home_dir, root_path, 'sample_points', REGISTRY_FILE))
                 np.savez(npz_path, DICT)
 
     elif state == 2:
@@ -364,6 +372,7 @@ if __name__ == '__main__':
                 npz_name = year + '_' + crop_type + '_' + region + '_sample_points_c.npz'
                 npz_path = os.path.join(home_dir, root_path, 'sample_points', npz_name)
                 print('RESULT PATH:', npz_path)
+                register_samples(DICT, os.path.join(home_dir, root_path, 'sample_points', REGISTRY_FILE))
                 np.savez(npz_path, DICT)
 
     logger.warning("HERO: all done!")
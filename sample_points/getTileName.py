@@ -10,8 +10,26 @@ import numpy as np
 import shapefile
 
 sys.path.append(join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.append(
+    join(os.path.dirname(os.path.realpath(__file__)), "..", "extract_points")
+)
+from extractor_functions.point_registry import REGISTRY_FILE  # noqa : E402
+from extractor_functions.point_registry import register_samples  # noqa : E402
 printer = pprint.PrettyPrinter(indent=3)
 
+# converters already built in this process, by (class, shapefile)
+_converters = {}
+
+
+def get_converter(converter_class, shapefile):
+    """
+    function to build a tile converter once per process and shapefile
+    """
+    key = (converter_class, shapefile)
+    if key not in _converters:
+        _converters[key] = converter_class(shapefile)
+    return _converters[key]
+
 
 def get_landsat_tile(point, mrs_path):
     """
@@ -22,10 +40,10 @@ def get_landsat_tile(point, mrs_path):
        '029-030': [(43.29, -98.182), (42.361, -96.506), (42.361, -96.606)]}
     """
     tile_dict = {}
-    to_WRS = ConvertToWRS(mrs_path)
-    for (lat, lon) in point:
-        result = to_WRS.get_wrs(lat, lon)
-        if len(result) is 0:
+    to_WRS = get_converter(ConvertToWRS, mrs_path)
+    lats, lons = np.array(point, dtype=np.float64).reshape(-1, 2).T
+    for (lat, lon), result in zip(point, to_WRS.get_wrs_many(lats, lons)):
+        if len(result) == 0:
             print("The point has no landsat tile:" + str((lat, lon)))
         for i in range(0, len(result)):
             path = str(result[i]["path"]).zfill(3)
@@ -44,10 +62,10 @@ def get_sentinel_tile(point, mrgs_path):
        '15TTG': [(42.347, -95.351), (42.361, -96.506), (42.361, -96.606)]}
     """
     tile_dict = {}
-    to_MRGS = ConvertToMRGS(mrgs_path)
-    for (lat, lon) in point:
-        result = to_MRGS.get_mrgs(lat, lon)
-        if len(result) is 0:
+    to_MRGS = get_converter(ConvertToMRGS, mrgs_path)
+    lats, lons = np.array(point, dtype=np.float64).reshape(-1, 2).T
+    for (lat, lon), result in zip(point, to_MRGS.get_mrgs_many(lats, lons)):
+        if len(result) == 0:
             print("The point has no sentinel tile:" + str((lat, lon)))
         for key in result:
             tile_dict.setdefault(key, []).append((lat, lon))
@@ -129,6 +147,9 @@ if __name__ == "__main__":
         # print(res_dict)
         crop = file.split('/')[-1].split('.')[0]
         file_name = '2018_' + crop + '_Hunan_sample_points_c.npz'
-        file = join('/home/zy/data2/citrus/hunan_data/hunan_process', file_name)
+        out_dir = '/home/zy/data2/citrus/hunan_data/hunan_process'
+        # integer point ids, unique over all sample files of the folder
+        register_samples(res_dict, join(out_dir, REGISTRY_FILE))
+        file = join(out_dir, file_name)
         np.savez(file, res_dict)
         print('save npz done!!', file)
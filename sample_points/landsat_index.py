@@ -1,8 +1,6 @@
 # coding: utf8
 import os
-from osgeo import ogr
-import shapely.geometry
-import shapely.wkt
+from tile_index import TileIndex, load_grid
 
 
 class ConvertToWRS:
@@ -17,8 +15,8 @@ class ConvertToWRS:
     1. Create an instance of the class:
 
         conv = ConvertToWRS()
-    (This will take a while to run, as it loads
-    the shapefiles in to memory)
+    (The first run reads the shapefile, later runs load
+    the cache next to it, see tile_index.load_grid)
     2. Use the get_wrs method to do a conversion:
         print conv.get_wrs(50.14, -1.43)
     For example:
@@ -41,33 +39,18 @@ class ConvertToWRS:
         #     "wrs2_descending_world",
         #     "wrs2_descending.shp",
         # )
-        # Open the shapefile
-        self.shapefile = ogr.Open(shapefile)
         if not os.path.exists(shapefile):
             raise Exception("path-row file was not found and check out the file dir!")
-            # print('path-row file was not found and check out the file dir!')
-            # exit(0)
-        # Get the only layer within it
-        self.layer = self.shapefile.GetLayer(0)
 
-        self.polygons = []
+        # polygons and path/row values, through the cache next to the shapefile
+        shapes, values = load_grid(shapefile, ["PATH", "ROW"])
 
-        # For each feature in the layer
-        for i in range(self.layer.GetFeatureCount()):
-            # Get the feature, and its path and row attributes
-            feature = self.layer.GetFeature(i)
-            path = feature["PATH"]
-            row = feature["ROW"]
+        # Store the shape and the path/row values
+        # in a list so we can search it easily later
+        self.polygons = list(zip(shapes, values["PATH"], values["ROW"]))
 
-            # Get the geometry into a Shapely-compatible
-            # format by converting to Well-known Text (Wkt)
-            # and importing that into shapely
-            geom = feature.GetGeometryRef()
-            shape = shapely.wkt.loads(geom.ExportToWkt())
-
-            # Store the shape and the path/row values
-            # in a list so we can search it easily later
-            self.polygons.append((shape, path, row))
+        # bulk loaded spatial index of all polygons
+        self.index = TileIndex([poly[0] for poly in self.polygons])
 
     def get_wrs(self, lat, lon):
         """Get the Landsat WRS-2 path and row for the given
@@ -76,19 +59,17 @@ class ConvertToWRS:
         overlap between two (or more) landsat scene areas:
         [{path: 202, row: 26}, {path: 186, row: 7}]
         """
+        return self.get_wrs_many([lat], [lon])[0]
 
-        # Create a point with the given latitude
-        # and longitude (NB: the arguments are lon, lat
-        # not lat, lon)
-        pt = shapely.geometry.Point(lon, lat)
-        res = []
-        # Iterate through every polgon
-        for poly in self.polygons:
-            # If the point is within the polygon then
-            # append the current path/row to the results
-            # list
-            if pt.within(poly[0]):
-                res.append({"path": poly[1], "row": poly[2]})
-
-        # Return the results list to the user
-        return res
+    def get_wrs_many(self, lats, lons):
+        """Get the Landsat WRS-2 path and row for arrays of
+        latitude and longitude co-ordinates, see get_wrs.
+        Returns one list of dicts per point.
+        """
+        return [
+            [
+                {"path": self.polygons[i][1], "row": self.polygons[i][2]}
+                for i in found
+            ]
+            for found in self.index.query_many(lats, lons)
+        ]
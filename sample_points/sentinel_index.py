@@ -1,9 +1,7 @@
 #!/usr/bin/env python3
 # coding: utf8
 import os
-from osgeo import ogr
-import shapely.geometry
-import shapely.wkt
+from tile_index import TileIndex, load_grid
 import time
 import mgrs
 
@@ -18,7 +16,8 @@ class ConvertToMRGS:
     Usage:
     1. Create an instance of the class:
         conv = ConvertToMRGS()
-    (This will take a while to run, as it loads the shapefiles in to memory)
+    (The first run reads the shapefile, later runs load
+    the cache next to it, see tile_index.load_grid)
     2. Use the get_mrgs method to do a conversion:
         print conv.get_mrgs(50.14, -1.43)
     For example:
@@ -39,32 +38,18 @@ class ConvertToMRGS:
         shapefile = os.path.join(
             os.path.expanduser('~'), "data_pool/U-TMP/TILE/MRGS-CHN", "MRGS_Grid.shp"
         )
-        # Open the shapefile
-        self.shapefile = ogr.Open(shapefile)
         if not os.path.exists(shapefile):
             raise Exception("path-row file was not found and check out the file dir!")
-            # print('path-row file was not found and check out the file dir!')
-            # exit(0)
-        # Get the only layer within it
-        self.layer = self.shapefile.GetLayer(0)
 
-        self.polygons = []
+        # polygons and tile names, through the cache next to the shapefile
+        shapes, values = load_grid(shapefile, ["Name"])
 
-        # For each feature in the layer
-        for i in range(self.layer.GetFeatureCount()):
-            # Get the feature, and its path and row attributes
-            feature = self.layer.GetFeature(i)
-            prName = feature["Name"]
+        # Store the shape and the tile name
+        # in a list so we can search it easily later
+        self.polygons = list(zip(shapes, values["Name"]))
 
-            # Get the geometry into a Shapely-compatible
-            # format by converting to Well-known Text (Wkt)
-            # and importing that into shapely
-            geom = feature.GetGeometryRef()
-            shape = shapely.wkt.loads(geom.ExportToWkt())
-
-            # Store the shape and the path/row values
-            # in a list so we can search it easily later
-            self.polygons.append((shape, prName))
+        # bulk loaded spatial index of all polygons
+        self.index = TileIndex([poly[0] for poly in self.polygons])
 
     def get_mrgs(self, lat, lon):
         """Get the Sentinel tile name for the given
@@ -73,22 +58,17 @@ class ConvertToMRGS:
         overlap between two (or more) Sentinel scene areas:
         ['14TPM', '14TPN', '15TTG']
         """
+        return self.get_mrgs_many([lat], [lon])[0]
 
-        # Create a point with the given latitude
-        # and longitude (NB: the arguments are lon, lat
-        # not lat, lon)
-        pt = shapely.geometry.Point(lon, lat)
-        res = []
-        # Iterate through every polgon
-        for poly in self.polygons:
-            # If the point is within the polygon then
-            # append the current path/row to the results
-            # list
-            if pt.within(poly[0]):
-                res.append(poly[1])
-
-        # Return the results list to the user
-        return res
+    def get_mrgs_many(self, lats, lons):
+        """Get the Sentinel tile names for arrays of
+        latitude and longitude co-ordinates, see get_mrgs.
+        Returns one list of names per point.
+        """
+        return [
+            [self.polygons[i][1] for i in found]
+            for found in self.index.query_many(lats, lons)
+        ]
 
 
 if __name__ == "__main__":
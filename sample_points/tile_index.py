@@ -0,0 +1,215 @@
+# coding: utf8
+"""
+spatial index of tile polygons, shared by ConvertToWRS and ConvertToMRGS
+
+Testing a point against every WRS-2 / MGRS polygon is O(points x polygons).
+TileIndex bulk loads the polygons into a Shapely STRtree once; a query only
+runs the exact within() test on the polygons whose bounding box holds the
+point, and points outside the extent of the whole grid are dropped first.
+
+Reading the polygons with OGR and parsing them from WKT takes tens of seconds,
+load_grid() does it once and keeps a compiled cache next to the shapefile:
+    <shapefile>.tilecache/
+        wkb.npy          uint8, all polygons as WKB, back to back
+        offsets.npy      int64, start of every polygon in wkb.npy, plus the end
+        <field>.npy      attribute values, one per polygon
+        meta.json        version, fields, mtime, size and sha1 of the shapefile
+The cache is used while the shapefile has the same mtime and size, or the same
+content hash, and is rebuilt otherwise. wkb.npy is memory mapped.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import shapely
+import shapely.geometry
+import shapely.wkb
+import shapely.wkt
+from shapely.strtree import STRtree
+
+# shapely 2 queries arrays of points at once and returns indices
+SHAPELY2 = int(shapely.__version__.split(".")[0]) >= 2
+
+CACHE_VERSION = 1
+
+
+def _shapefile_parts(shapefile):
+    """geometry and attribute files of a shapefile"""
+    base = os.path.splitext(shapefile)[0]
+    return [shapefile] + [
+        base + ext for ext in [".dbf", ".shx"] if os.path.exists(base + ext)
+    ]
+
+
+def _stat(shapefile):
+    stats = [os.stat(part) for part in _shapefile_parts(shapefile)]
+    return max(st.st_mtime for st in stats), sum(st.st_size for st in stats)
+
+
+def _sha1(shapefile):
+    sha1 = hashlib.sha1()
+    for part in _shapefile_parts(shapefile):
+        with open(part, "rb") as fid:
+            for block in iter(lambda: fid.read(1 << 20), b""):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _read_shapefile(shapefile, fields):
+    """read polygons and attributes with OGR"""
+    from osgeo import ogr
+
+    layer_file = ogr.Open(shapefile)
+    layer = layer_file.GetLayer(0)
+    shapes = []
+    values = {field: [] for field in fields}
+    for i in range(layer.GetFeatureCount()):
+        feature = layer.GetFeature(i)
+        for field in fields:
+            values[field].append(feature[field])
+        # Get the geometry into a Shapely-compatible
+        # format by converting to Well-known Text (Wkt)
+        geom = feature.GetGeometryRef()
+        shapes.append(shapely.wkt.loads(geom.ExportToWkt()))
+    return shapes, values
+
+
+def _write_cache(cache_dir, shapes, values, meta):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    if os.path.exists(os.path.join(cache_dir, "meta.json")):
+        os.remove(os.path.join(cache_dir, "meta.json"))
+    wkb = [shape.wkb for shape in shapes]
+    offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(w) for w in wkb])
+    np.save(
+        os.path.join(cache_dir, "wkb.npy"),
+        np.frombuffer(b"".join(wkb), dtype=np.uint8),
+    )
+    np.save(os.path.join(cache_dir, "offsets.npy"), offsets)
+    for field, field_values in values.items():
+        np.save(os.path.join(cache_dir, field + ".npy"), np.array(field_values))
+    # meta is written last, the cache is only valid once it exists
+    with open(os.path.join(cache_dir, "meta.json"), "w") as fid:
+        json.dump(meta, fid)
+
+
+def _read_cache(cache_dir, fields):
+    wkb = np.load(os.path.join(cache_dir, "wkb.npy"), mmap_mode="r")
+    offsets = np.load(os.path.join(cache_dir, "offsets.npy"))
+    pieces = [bytes(wkb[o0:o1]) for o0, o1 in zip(offsets[:-1], offsets[1:])]
+    if SHAPELY2:
+        shapes = list(shapely.from_wkb(pieces))
+    else:
+        shapes = [shapely.wkb.loads(piece) for piece in pieces]
+    values = {
+        field: np.load(os.path.join(cache_dir, field + ".npy")).tolist()
+        for field in fields
+    }
+    return shapes, values
+
+
+def load_grid(shapefile, fields):
+    """
+    function to load tile polygons and their attributes,
+    through the compiled cache next to the shapefile
+    in: shapefile, e.g. wrs2_descending.shp
+        fields, attribute names, e.g. ["PATH", "ROW"]
+    out: shapes, list of shapely polygons
+         values, {field: [value of every polygon]}
+    """
+    cache_dir = shapefile + ".tilecache"
+    meta_file = os.path.join(cache_dir, "meta.json")
+    mtime, size = _stat(shapefile)
+    meta = None
+    if os.path.isfile(meta_file):
+        with open(meta_file) as fid:
+            meta = json.load(fid)
+        if meta.get("version") != CACHE_VERSION or not set(fields) <= set(
+            meta.get("fields", [])
+        ):
+            meta = None
+
+    if meta is not None:
+        if [meta["mtime"], meta["size"]] == [mtime, size]:
+            return _read_cache(cache_dir, fields)
+        # touched or copied, but same content
+        sha1 = _sha1(shapefile)
+        if meta["sha1"] == sha1:
+            meta["mtime"], meta["size"] = mtime, size
+            try:
+                with open(meta_file, "w") as fid:
+                    json.dump(meta, fid)
+            except OSError:
+                pass
+            return _read_cache(cache_dir, fields)
+    else:
+        sha1 = _sha1(shapefile)
+
+    shapes, values = _read_shapefile(shapefile, fields)
+    meta = {
+        "version": CACHE_VERSION,
+        "fields": list(fields),
+        "mtime": mtime,
+        "size": size,
+        "sha1": sha1,
+    }
+    try:
+        _write_cache(cache_dir, shapes, values, meta)
+    except OSError as e:
+        # read only data folder, work without cache
+        print("Unable to write tile cache %s: %s" % (cache_dir, e))
+    return shapes, values
+
+
+class TileIndex:
+    def __init__(self, shapes):
+        """
+        in: shapes, list of shapely polygons, e.g. one per WRS-2 path/row
+        """
+        self.shapes = list(shapes)
+        self.bounds = np.array([s.bounds for s in self.shapes]).reshape(-1, 4)
+        self.tree = STRtree(self.shapes)
+        # shapely 1.x returns geometries, map them back to their index
+        self._index = {id(s): i for i, s in enumerate(self.shapes)}
+
+    def query(self, lat, lon):
+        """
+        function to get index of polygons holding a point, ascending
+        """
+        return self.query_many([lat], [lon])[0]
+
+    def query_many(self, lats, lons):
+        """
+        function to get index of polygons holding every point
+        in: lats, lons, arrays of point coordinates
+        out: list of lists of polygon index, ascending, one list per point
+        """
+        lats = np.asarray(lats, dtype=np.float64).reshape(-1)
+        lons = np.asarray(lons, dtype=np.float64).reshape(-1)
+        res = [[] for _ in range(lats.shape[0])]
+        if len(self.shapes) == 0:
+            return res
+
+        # bounding box prefilter, points outside the whole grid are skipped
+        minx, miny = self.bounds[:, 0].min(), self.bounds[:, 1].min()
+        maxx, maxy = self.bounds[:, 2].max(), self.bounds[:, 3].max()
+        inside = (lons >= minx) & (lons <= maxx) & (lats >= miny) & (lats <= maxy)
+        candidates = np.flatnonzero(inside)
+
+        if SHAPELY2:
+            pts = shapely.points(lons[candidates], lats[candidates])
+            pt_i, poly_i = self.tree.query(pts, predicate="within")
+            order = np.lexsort((poly_i, pt_i))
+            for p, q in zip(candidates[pt_i[order]], poly_i[order]):
+                res[p].append(int(q))
+        else:
+            for p in candidates:
+                pt = shapely.geometry.Point(lons[p], lats[p])
+                found = [
+                    self._index[id(poly)]
+                    for poly in self.tree.query(pt)
+                    if pt.within(poly)
+                ]
+                res[p] = sorted(found)
+        return res